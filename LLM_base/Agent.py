@@ -1,14 +1,21 @@
 import os
-import json
 import uuid
 import logging
-from typing import Optional, Any, Callable, Dict
+import asyncio
+import weakref
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Any, AsyncIterator, Callable, Dict, Iterator, List
 
 import sys
 
 # 导入之前创建的配置加载模块
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from tool.config_load import load_config_to_env
+from LLM_base.memory_journal import MemoryJournal
+from LLM_base.memory_cache import MemoryCache
+from LLM_base.context_budget import ContextBudgeter, format_turns
+from LLM_base.prompt import get_prompt, HISTORY_SUMMARY_PROMPT
 
 # 导入langgraph相关库（假设已经安装）
 try:
@@ -35,13 +42,21 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 logger = logging.getLogger(__name__)
 
 class Agent:
-    def __init__(self, config_path="E:\\GitHub\\config.yaml", model_type="doubao"):
+    def __init__(self, config_path="E:\\GitHub\\config.yaml", model_type="doubao",
+                 memory_cache_size: int = 256, memory_cache_bytes: int = 64 * 1024 * 1024,
+                 memory_ttl: Optional[float] = None, max_history_tokens: int = 2000,
+                 keep_recent_turns: int = 6):
         """
         初始化Agent类
         
         Args:
             config_path (str, optional): 配置文件路径，默认为"E:\GitHub\config.yaml"
             model_type (str, optional): 模型类型，默认为"glm"，可选值为"glm"或"doubao"
+            memory_cache_size (int, optional): 内存中最多保留的对话记忆数，默认为256
+            memory_cache_bytes (int, optional): 内存中对话记忆的总字节上限，默认为64MB
+            memory_ttl (float, optional): 对话记忆空闲超过该秒数后落盘并移出内存，默认为None
+            max_history_tokens (int, optional): 提示词中历史对话部分的token上限，默认为2000
+            keep_recent_turns (int, optional): 原样保留的最近对话轮数，更早的对话折叠为摘要，默认为6
         """
         # 利用config_load函数加载配置
         self.config = load_config_to_env(config_path=config_path, return_dict=True)
@@ -85,8 +100,34 @@ class Agent:
             os.makedirs(self.memory_dir)
             logger.info(f"创建memory目录: {self.memory_dir}")
         
-        # 用于存储不同conversation_id对应的memory实例的字典
-        self.memories: Dict[str, ConversationBufferMemory] = {}
+        # 追加式记忆日志：每轮只追加一条记录，定期压缩为快照
+        self.memory_journal = MemoryJournal(self.memory_dir)
+        
+        # conversation_id -> 记忆写入锁：写入记忆并追加日志、淘汰时写快照在同一把锁内完成，
+        # 快照不会只包含一轮对话的记忆而漏掉（或重复）它的日志记录
+        self._memory_locks: "weakref.WeakValueDictionary[str, threading.Lock]" = weakref.WeakValueDictionary()
+        self._memory_locks_guard = threading.Lock()
+        
+        # 不同conversation_id对应的memory实例的LRU缓存，淘汰时先落盘，再次访问时重新加载
+        self.memories = MemoryCache(
+            max_entries=memory_cache_size,
+            max_bytes=memory_cache_bytes,
+            ttl=memory_ttl,
+            on_evict=self._evict_memory
+        )
+        
+        # 按token预算构建历史，较早的对话折叠为滚动摘要
+        self.context_budgeter = ContextBudgeter(
+            self.memory_dir,
+            max_history_tokens=max_history_tokens,
+            keep_recent_turns=keep_recent_turns
+        )
+        # 摘要折叠在后台线程中执行，不占用回复路径；每个对话同时最多一个折叠任务，
+        # 任务执行期间的新请求只保留最新的对话列表，任务结束前再处理一次
+        self._fold_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-fold")
+        self._fold_lock = threading.Lock()
+        # conversation_id -> 待折叠的对话列表（None表示任务已取走、正在执行）
+        self._fold_requests: Dict[str, Optional[List[Dict[str, str]]]] = {}
     
     def create_llm(self, model_name: str = "doubao-seed-1-6-251015", provider: str = "doubao", **kwargs) -> bool:
         """
@@ -166,36 +207,97 @@ class Agent:
         file_path = self._get_memory_file_path(conversation_id)
         memory = ConversationBufferMemory()
         
-        # 如果文件存在，加载内容
-        if os.path.exists(file_path):
+        # 如果快照或日志存在，加载快照并重放日志
+        if self.memory_journal.exists(conversation_id):
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    # 加载对话历史
-                    if 'conversations' in data:
-                        for conv in data['conversations']:
-                            if 'Human' in conv and 'AI' in conv:
-                                memory.save_context(
-                                    {'input': conv['Human']},
-                                    {'output': conv['AI']}
-                                )
+                for conv in self.memory_journal.load(conversation_id):
+                    memory.save_context(
+                        {'input': conv['Human']},
+                        {'output': conv['AI']}
+                    )
                 logger.info(f"成功从文件加载记忆: {file_path}")
             except Exception as e:
                 logger.error(f"从文件加载记忆时出错: {e}")
         else:
             # 文件不存在，创建空文件
             try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump({'conversations': []}, f, ensure_ascii=False, indent=2)
+                self.memory_journal.write_snapshot(conversation_id, [])
                 logger.info(f"创建新的空记忆文件: {file_path}")
             except Exception as e:
                 logger.error(f"创建空记忆文件时出错: {e}")
         
         return memory
     
+    def _extract_conversations(self, memory: ConversationBufferMemory) -> List[Dict[str, str]]:
+        """
+        从记忆实例中提取Human-AI对话列表
+        
+        Args:
+            memory (ConversationBufferMemory): 记忆实例
+            
+        Returns:
+            List[Dict[str, str]]: 对话列表
+        """
+        # 直接从memory获取对话历史，而不是解析格式
+        memory_variables = memory.load_memory_variables({})
+        
+        # 创建新的对话列表
+        conversations = []
+        
+        # 使用memory的chat_memory.messages直接获取消息
+        if hasattr(memory, 'chat_memory') and hasattr(memory.chat_memory, 'messages'):
+            messages = memory.chat_memory.messages
+            # 处理消息对（Human-AI）
+            i = 0
+            while i < len(messages):
+                if i + 1 < len(messages):
+                    # 检查是否为Human-AI对
+                    if messages[i].type == 'human' and messages[i+1].type == 'ai':
+                        conversations.append({
+                            'Human': messages[i].content,
+                            'AI': messages[i+1].content
+                        })
+                        i += 2  # 跳过这对消息
+                    else:
+                        i += 1  # 不匹配则前进一位
+                else:
+                    break
+            logger.info(f"从chat_memory中提取了{len(conversations)}条对话记录")
+        else:
+            # 备用方法：使用历史文本解析
+            if 'history' in memory_variables and memory_variables['history']:
+                history = memory_variables['history']
+                # 更健壮的解析方式
+                lines = history.split('\n')
+                current_conv = {}
+                
+                for line in lines:
+                    line = line.strip()
+                    if not line:
+                        continue
+                        
+                    if line.startswith('Human:'):
+                        # 如果已经有Human但没有匹配的AI，说明之前的AI回复被截断
+                        if 'Human' in current_conv:
+                            # 将不完整的对话记录下来，然后开始新的
+                            conversations.append(current_conv.copy())
+                        current_conv = {'Human': line[7:].strip()}
+                    elif line.startswith('AI:') and 'Human' in current_conv:
+                        # 保存完整的对话对
+                        current_conv['AI'] = line[3:].strip()
+                        conversations.append(current_conv.copy())
+                        current_conv = {}
+                
+                # 记录最后一个可能不完整的对话
+                if current_conv:
+                    conversations.append(current_conv)
+            logger.info(f"从history文本中解析了{len(conversations)}条对话记录")
+        
+        return conversations
+    
     def _save_memory_to_file(self, conversation_id: str, memory: ConversationBufferMemory):
         """
-        保存记忆到文件
+        保存完整记忆快照到文件，并压缩追加日志
         
         Args:
             conversation_id (str): 对话ID
@@ -203,81 +305,270 @@ class Agent:
         """
         file_path = self._get_memory_file_path(conversation_id)
         try:
-            # 直接从memory获取对话历史，而不是解析格式
-            memory_variables = memory.load_memory_variables({})
-            
-            # 创建新的对话列表
-            conversations = []
+            conversations = self._extract_conversations(memory)
+            # 写入快照（临时文件+fsync+原子替换），随后截断日志
+            self.memory_journal.write_snapshot(conversation_id, conversations)
+            logger.info(f"成功保存记忆到文件: {file_path}，共{len(conversations)}条对话")
+        except Exception as e:
+            logger.error(f"保存记忆到文件时出错: {e}")
+    
+    def _append_memory_to_file(self, conversation_id: str, memory: ConversationBufferMemory, human: str, ai: str):
+        """
+        将一轮对话追加到记忆日志，日志过长时压缩为快照
+        
+        Args:
+            conversation_id (str): 对话ID
+            memory (ConversationBufferMemory): 记忆实例（压缩时使用）
+            human (str): 用户输入
+            ai (str): AI回复
+        """
+        try:
+            self.memory_journal.append(conversation_id, human, ai)
+        except Exception as e:
+            logger.error(f"追加记忆日志时出错: {e}，改为写入完整快照")
+            self._save_memory_to_file(conversation_id, memory)
+            return
+        
+        if self.memory_journal.needs_compaction(conversation_id):
+            logger.info(f"记忆日志达到压缩阈值，压缩: {conversation_id}")
+            self._save_memory_to_file(conversation_id, memory)
+    
+    def _evict_memory(self, conversation_id: str, memory: ConversationBufferMemory):
+        """
+        记忆被移出缓存时的回调：写入完整快照并释放日志句柄
+        
+        Args:
+            conversation_id (str): 对话ID
+            memory (ConversationBufferMemory): 被淘汰的记忆实例
+        """
+        with self._memory_lock(conversation_id):
+            self._save_memory_to_file(conversation_id, memory)
+            self.memory_journal.forget(conversation_id)
+        self.context_budgeter.forget(conversation_id)
+        logger.info(f"对话记忆已移出内存: {conversation_id}")
+    
+    def _memory_lock(self, conversation_id: str) -> threading.Lock:
+        """
+        获取对话的记忆写入锁
+        
+        Args:
+            conversation_id (str): 对话ID
             
-            # 使用memory的chat_memory.messages直接获取消息
-            if hasattr(memory, 'chat_memory') and hasattr(memory.chat_memory, 'messages'):
-                messages = memory.chat_memory.messages
-                # 处理消息对（Human-AI）
-                i = 0
-                while i < len(messages):
-                    if i + 1 < len(messages):
-                        # 检查是否为Human-AI对
-                        if messages[i].type == 'human' and messages[i+1].type == 'ai':
-                            conversations.append({
-                                'Human': messages[i].content,
-                                'AI': messages[i+1].content
-                            })
-                            i += 2  # 跳过这对消息
-                        else:
-                            i += 1  # 不匹配则前进一位
-                    else:
-                        break
-                logger.info(f"从chat_memory中提取了{len(conversations)}条对话记录")
-            else:
-                # 备用方法：使用历史文本解析
-                if 'history' in memory_variables and memory_variables['history']:
-                    history = memory_variables['history']
-                    # 更健壮的解析方式
-                    lines = history.split('\n')
-                    current_conv = {}
-                    
-                    for line in lines:
-                        line = line.strip()
-                        if not line:
-                            continue
-                            
-                        if line.startswith('Human:'):
-                            # 如果已经有Human但没有匹配的AI，说明之前的AI回复被截断
-                            if 'Human' in current_conv:
-                                # 将不完整的对话记录下来，然后开始新的
-                                conversations.append(current_conv.copy())
-                            current_conv = {'Human': line[7:].strip()}
-                        elif line.startswith('AI:') and 'Human' in current_conv:
-                            # 保存完整的对话对
-                            current_conv['AI'] = line[3:].strip()
-                            conversations.append(current_conv.copy())
-                            current_conv = {}
-                    
-                    # 记录最后一个可能不完整的对话
-                    if current_conv:
-                        conversations.append(current_conv)
-                logger.info(f"从history文本中解析了{len(conversations)}条对话记录")
+        Returns:
+            threading.Lock: 该对话的锁，不再被持有时自动释放
+        """
+        with self._memory_locks_guard:
+            lock = self._memory_locks.get(conversation_id)
+            if lock is None:
+                lock = threading.Lock()
+                self._memory_locks[conversation_id] = lock
+            return lock
+    
+    def _get_memory(self, conversation_id: str) -> ConversationBufferMemory:
+        """
+        从缓存获取记忆，未命中时从文件加载并放入缓存
+        
+        Args:
+            conversation_id (str): 对话ID
             
-            # 保存到文件，确保完整写入
-            temp_file = file_path + '.tmp'
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                json.dump({'conversations': conversations}, f, ensure_ascii=False, indent=2)
-                # 强制刷新缓冲区
-                f.flush()
-                os.fsync(f.fileno())
+        Returns:
+            ConversationBufferMemory: 记忆实例
+        """
+        memory = self.memories.get(conversation_id)
+        if memory is None:
+            memory = self._load_memory_from_file(conversation_id)
+            self.memories.put(conversation_id, memory)
+        return memory
+    
+    def _summarize_history(self, previous_summary: str, conversations: List[Dict[str, str]]) -> Optional[str]:
+        """
+        调用LLM将较早的对话合并进已有摘要
+        
+        Args:
+            previous_summary (str): 已有摘要，可能为空
+            conversations (List[Dict[str, str]]): 待折叠的对话列表
             
-            # 原子性替换文件，确保文件完整性
-            os.replace(temp_file, file_path)
-            logger.info(f"成功保存记忆到文件: {file_path}，共{len(conversations)}条对话")
+        Returns:
+            Optional[str]: 新摘要，失败返回None
+        """
+        content = ""
+        if previous_summary:
+            content += f"【已有摘要】\n{previous_summary}\n\n"
+        content += f"【新增对话】\n{format_turns(conversations)}"
+        summary_prompt = get_prompt(HISTORY_SUMMARY_PROMPT, content)
+        if summary_prompt is None:
+            return None
+        try:
+            response = self.llm.invoke(summary_prompt)
+            return response.content if hasattr(response, 'content') else str(response)
+        except Exception as e:
+            logger.error(f"生成对话摘要时出错: {e}")
+            return None
+    
+    def _build_history(self, conversation_id: str, memory: ConversationBufferMemory) -> str:
+        """
+        在token预算内构建提示词中的历史部分
+        
+        Args:
+            conversation_id (str): 对话ID
+            memory (ConversationBufferMemory): 记忆实例
             
+        Returns:
+            str: 历史文本（摘要 + 最近对话）
+        """
+        conversations = self._extract_conversations(memory)
+        return self.context_budgeter.build_history(conversation_id, conversations)
+    
+    def _fold_history(self, conversation_id: str, memory: ConversationBufferMemory):
+        """
+        回复完成后，把超出保留窗口的对话交给后台线程折叠进滚动摘要
+        
+        Args:
+            conversation_id (str): 对话ID
+            memory (ConversationBufferMemory): 记忆实例
+        """
+        try:
+            conversations = self._extract_conversations(memory)
         except Exception as e:
-            logger.error(f"保存记忆到文件时出错: {e}")
-            # 清理临时文件
-            if os.path.exists(file_path + '.tmp'):
-                try:
-                    os.remove(file_path + '.tmp')
-                except:
-                    pass
+            logger.error(f"折叠对话摘要时出错: {e}")
+            return
+        with self._fold_lock:
+            running = conversation_id in self._fold_requests
+            self._fold_requests[conversation_id] = conversations
+        if not running:
+            self._fold_executor.submit(self._run_fold, conversation_id)
+    
+    def _run_fold(self, conversation_id: str):
+        """
+        后台折叠任务：处理该对话的最新折叠请求，直到没有新的请求
+        
+        Args:
+            conversation_id (str): 对话ID
+        """
+        while True:
+            with self._fold_lock:
+                conversations = self._fold_requests.get(conversation_id)
+                if conversations is None:
+                    self._fold_requests.pop(conversation_id, None)
+                    return
+                self._fold_requests[conversation_id] = None
+            try:
+                self.context_budgeter.maybe_fold(conversation_id, conversations, self._summarize_history)
+            except Exception as e:
+                logger.error(f"折叠对话摘要时出错: {e}")
+    
+    def memory_cache_stats(self) -> Dict[str, Any]:
+        """
+        获取记忆缓存的命中、未命中和淘汰统计
+        
+        Returns:
+            Dict[str, Any]: 统计信息字典
+        """
+        return self.memories.stats()
+    
+    def close(self):
+        """
+        等待进行中的摘要折叠，将缓存中的记忆落盘，并刷新关闭记忆日志
+        """
+        self._fold_executor.shutdown(wait=True)
+        self.memories.evict_all()
+        self.memory_journal.close()
+    
+    def _prepare_conversation(self, conversation_id: Optional[str]) -> Optional[str]:
+        """
+        确保LLM已创建，为新对话生成conversation_id并创建空记忆
+        
+        Args:
+            conversation_id (str, optional): 对话ID，如果为None则生成新的ID
+            
+        Returns:
+            Optional[str]: 本次使用的conversation_id，LLM创建失败返回None
+        """
+        # 检查LLM是否存在
+        if self.llm is None:
+            # LLM不存在时，先创建LLM
+            if not self.create_llm():
+                logger.error("LLM创建失败")
+                return None
+        
+        if conversation_id is None:
+            # 生成新的conversation_id
+            conversation_id = str(uuid.uuid4())
+            logger.info(f"生成新的对话ID: {conversation_id}")
+            # 为新ID创建空记忆
+            memory = ConversationBufferMemory()
+            self.memories[conversation_id] = memory
+            # 保存空记忆到文件
+            self._save_memory_to_file(conversation_id, memory)
+        return conversation_id
+    
+    def _build_full_prompt(self, conversation_id: str, memory: ConversationBufferMemory, prompt: str) -> str:
+        """
+        构建带记忆的完整提示（按token预算截取历史）
+        
+        Args:
+            conversation_id (str): 对话ID
+            memory (ConversationBufferMemory): 记忆实例
+            prompt (str): 提示词
+            
+        Returns:
+            str: 完整提示
+        """
+        history = self._build_history(conversation_id, memory)
+        full_prompt = ""
+        if history:
+            full_prompt += f"{history}\n"
+        full_prompt += f"Human: {prompt}\nAI: "
+        return full_prompt
+    
+    @staticmethod
+    def _extract_content(response: Any) -> str:
+        """
+        从LLM返回的消息（或流式分块）中提取文本内容
+        
+        Args:
+            response (Any): LLM返回对象
+            
+        Returns:
+            str: 文本内容
+        """
+        if hasattr(response, 'content'):
+            content = response.content
+        elif isinstance(response, dict) and 'content' in response:
+            content = response['content']
+        else:
+            content = str(response)
+        return content if isinstance(content, str) else str(content)
+    
+    def _commit_reply(self, conversation_id: str, memory: ConversationBufferMemory, prompt: str, reply: str) -> str:
+        """
+        将一轮完整对话写入记忆、日志和摘要
+        
+        Args:
+            conversation_id (str): 对话ID
+            memory (ConversationBufferMemory): 记忆实例
+            prompt (str): 提示词
+            reply (str): 完整回复
+            
+        Returns:
+            str: 实际写入的回复（空回复会被替换为占位文本）
+        """
+        # 确保回复内容不为空
+        if not reply.strip():
+            reply = "（暂无回复）"
+        
+        # 记录完整回复内容长度，用于调试
+        logger.info(f"接收到的完整回复长度: {len(reply)} 字符")
+        
+        # 将新的对话内容保存到记忆中并追加到记忆日志，与淘汰时的快照互斥
+        with self._memory_lock(conversation_id):
+            memory.save_context({'input': prompt}, {'output': reply})
+            self._append_memory_to_file(conversation_id, memory, prompt, reply)
+        # 记忆增长后更新缓存占用
+        self.memories.refresh(conversation_id)
+        # 超出保留窗口的对话在后台折叠进摘要
+        self._fold_history(conversation_id, memory)
+        return reply
     
     def generate_response(self, prompt: str, conversation_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
@@ -290,89 +581,153 @@ class Agent:
         Returns:
             Optional[Dict[str, Any]]: 包含回复内容和conversation_id的字典，如果失败则返回None
         """
-        # 检查LLM是否存在
-        if self.llm is None:
-            # LLM不存在时
-            if conversation_id is None:
-                # conversation_id不存在时，创建LLM，生成新的conversation_id，创建空文件
-                if not self.create_llm():
-                    logger.error("LLM创建失败")
-                    return None
-                # 生成新的conversation_id
-                conversation_id = str(uuid.uuid4())
-                logger.info(f"生成新的对话ID: {conversation_id}")
-                # 为新ID创建空文件
-                memory = ConversationBufferMemory()
-                self.memories[conversation_id] = memory
-                # 保存空记忆到文件
-                self._save_memory_to_file(conversation_id, memory)
-            else:
-                # conversation_id存在时，创建LLM，加载对应记忆文件
-                if not self.create_llm():
-                    logger.error("LLM创建失败")
-                    return None
-                # 加载记忆
-                if conversation_id not in self.memories:
-                    self.memories[conversation_id] = self._load_memory_from_file(conversation_id)
-        else:
-            # LLM存在时
-            if conversation_id is None:
-                # 生成新的conversation_id
-                conversation_id = str(uuid.uuid4())
-                logger.info(f"生成新的对话ID: {conversation_id}")
-                # 为新ID创建空记忆
-                self.memories[conversation_id] = ConversationBufferMemory()
-                # 保存空记忆到文件
-                self._save_memory_to_file(conversation_id, self.memories[conversation_id])
-            else:
-                # 确保对应conversation_id的记忆已加载
-                if conversation_id not in self.memories:
-                    self.memories[conversation_id] = self._load_memory_from_file(conversation_id)
+        conversation_id = self._prepare_conversation(conversation_id)
+        if conversation_id is None:
+            return None
         
         try:
-            # 获取当前对话的记忆
-            memory = self.memories[conversation_id]
-            
-            # 构建带记忆的完整提示
-            memory_variables = memory.load_memory_variables({})
-            full_prompt = ""
-            if 'history' in memory_variables and memory_variables['history']:
-                full_prompt += f"{memory_variables['history']}\n"
-            full_prompt += f"Human: {prompt}\nAI: "
+            # 获取当前对话的记忆（未命中缓存时从文件加载）
+            memory = self._get_memory(conversation_id)
+            full_prompt = self._build_full_prompt(conversation_id, memory, prompt)
             
             # 将提示词输入LLM并获取回复
             response = self.llm.invoke(full_prompt)
+            reply = self._commit_reply(conversation_id, memory, prompt, self._extract_content(response))
             
-            # 提取回复内容
-            if hasattr(response, 'content'):
-                reply = response.content
-            elif isinstance(response, dict) and 'content' in response:
-                reply = response['content']
-            else:
-                reply = str(response)
-            
-            # 确保回复内容不为空
-            if not reply.strip():
-                reply = "（暂无回复）"
-            
-            # 记录完整回复内容长度，用于调试
-            logger.info(f"接收到的完整回复长度: {len(reply)} 字符")
+            logger.info("成功获取LLM回复并更新记忆")
+            return {
+                'response': reply,
+                'conversation_id': conversation_id
+            }
+        except Exception as e:
+            logger.error(f"获取LLM回复时出错: {e}")
+            return None
+    
+    async def agenerate_response(self, prompt: str, conversation_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        generate_response的协程版本，使用LLM的ainvoke，记忆读写放到线程池中执行
+        
+        Args:
+            prompt (str): 提示词
+            conversation_id (str, optional): 对话ID，如果为None则生成新的ID
             
-            # 将新的对话内容保存到记忆中
-            memory.save_context({'input': prompt}, {'output': reply})
+        Returns:
+            Optional[Dict[str, Any]]: 包含回复内容和conversation_id的字典，如果失败则返回None
+        """
+        conversation_id = await asyncio.to_thread(self._prepare_conversation, conversation_id)
+        if conversation_id is None:
+            return None
+        
+        try:
+            memory = await asyncio.to_thread(self._get_memory, conversation_id)
+            full_prompt = await asyncio.to_thread(self._build_full_prompt, conversation_id, memory, prompt)
             
-            # 保存记忆到文件
-            self._save_memory_to_file(conversation_id, memory)
+            response = await self.llm.ainvoke(full_prompt)
+            reply = await asyncio.to_thread(
+                self._commit_reply, conversation_id, memory, prompt, self._extract_content(response)
+            )
             
-            logger.info("成功获取LLM回复并更新记忆")
+            logger.info("成功异步获取LLM回复并更新记忆")
             return {
                 'response': reply,
                 'conversation_id': conversation_id
             }
         except Exception as e:
-            logger.error(f"获取LLM回复时出错: {e}")
+            logger.error(f"异步获取LLM回复时出错: {e}")
             return None
-
+    
+    def stream_response(self, prompt: str, conversation_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        astream_response的同步版本，使用LLM的stream，供工作线程逐块消费
+        
+        Args:
+            prompt (str): 提示词
+            conversation_id (str, optional): 对话ID，如果为None则生成新的ID
+        
+        Yields:
+            Dict[str, Any]: 与astream_response相同格式的分块
+        """
+        conversation_id = self._prepare_conversation(conversation_id)
+        if conversation_id is None:
+            yield {'error': "LLM创建失败", 'conversation_id': None, 'done': True}
+            return
+        
+        parts: List[str] = []
+        try:
+            memory = self._get_memory(conversation_id)
+            full_prompt = self._build_full_prompt(conversation_id, memory, prompt)
+        
+            for chunk in self.llm.stream(full_prompt):
+                delta = self._extract_content(chunk)
+                if not delta:
+                    continue
+                parts.append(delta)
+                yield {'delta': delta, 'conversation_id': conversation_id, 'done': False}
+        except Exception as e:
+            logger.error(f"流式获取LLM回复时出错: {e}")
+            yield {'error': str(e), 'conversation_id': conversation_id, 'done': True}
+            return
+        
+        # 先通知调用方LLM输出已结束（如立即合成最后一句），再提交记忆
+        yield {'delta': '', 'conversation_id': conversation_id, 'done': False, 'stream_end': True}
+        
+        # 流结束后再提交记忆，避免半截回复进入历史
+        try:
+            reply = self._commit_reply(conversation_id, memory, prompt, "".join(parts))
+        except Exception as e:
+            logger.error(f"提交流式回复到记忆时出错: {e}")
+            reply = "".join(parts)
+        
+        logger.info("成功流式获取LLM回复并更新记忆")
+        yield {'delta': '', 'response': reply, 'conversation_id': conversation_id, 'done': True}
+    
+    async def astream_response(self, prompt: str, conversation_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式获取LLM回复，逐块产出文本，流结束后一次性写入记忆
+        
+        Args:
+            prompt (str): 提示词
+            conversation_id (str, optional): 对话ID，如果为None则生成新的ID
+            
+        Yields:
+            Dict[str, Any]: 分块 {'delta': 新增文本, 'conversation_id': ..., 'done': False}；
+                LLM输出结束后、写入记忆前产出 {'delta': '', 'conversation_id': ..., 'done': False, 'stream_end': True}；
+                最后一块为 {'delta': '', 'response': 完整回复, 'conversation_id': ..., 'done': True}。
+                失败时产出 {'error': 错误信息, 'conversation_id': ..., 'done': True} 并结束
+        """
+        conversation_id = await asyncio.to_thread(self._prepare_conversation, conversation_id)
+        if conversation_id is None:
+            yield {'error': "LLM创建失败", 'conversation_id': None, 'done': True}
+            return
+        
+        parts: List[str] = []
+        try:
+            memory = await asyncio.to_thread(self._get_memory, conversation_id)
+            full_prompt = await asyncio.to_thread(self._build_full_prompt, conversation_id, memory, prompt)
+            
+            async for chunk in self.llm.astream(full_prompt):
+                delta = self._extract_content(chunk)
+                if not delta:
+                    continue
+                parts.append(delta)
+                yield {'delta': delta, 'conversation_id': conversation_id, 'done': False}
+        except Exception as e:
+            logger.error(f"流式获取LLM回复时出错: {e}")
+            yield {'error': str(e), 'conversation_id': conversation_id, 'done': True}
+            return
+        
+        # 先通知调用方LLM输出已结束（如立即合成最后一句），再提交记忆
+        yield {'delta': '', 'conversation_id': conversation_id, 'done': False, 'stream_end': True}
+        
+        # 流结束后再提交记忆，避免半截回复进入历史
+        try:
+            reply = await asyncio.to_thread(self._commit_reply, conversation_id, memory, prompt, "".join(parts))
+        except Exception as e:
+            logger.error(f"提交流式回复到记忆时出错: {e}")
+            reply = "".join(parts)
+        
+        logger.info("成功流式获取LLM回复并更新记忆")
+        yield {'delta': '', 'response': reply, 'conversation_id': conversation_id, 'done': True}
 
 def create_agent_node(config_path: Optional[str] = None, model_name: str = "glm-4", provider: str = "zhipu", **kwargs) -> Optional[Callable[[Dict[str, Any]], Dict[str, Any]]]:
     """
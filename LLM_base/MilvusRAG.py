@@ -1,9 +1,12 @@
 import os
+import json
 import logging
 import sys
 import time
 import uuid
-from typing import List, Dict, Any
+import threading
+from queue import Queue, Empty
+from typing import List, Dict, Any, Optional, Tuple
 import numpy as np
 from openai import OpenAI
 from langchain_core.embeddings import Embeddings
@@ -11,17 +14,31 @@ from tool.config_load import load_config_to_env
 load_config_to_env()
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from LLM_base.embedding_cache import EmbeddingCache, get_default_embedding_cache
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # 导入新版MilvusClient
-from pymilvus import MilvusClient
+from pymilvus import MilvusClient, DataType
+
+# 向量索引的默认构建参数和检索参数
+VECTOR_INDEX_DEFAULTS = {
+    "HNSW": {"build": {"M": 16, "efConstruction": 200}, "search": {"ef": 64}},
+    "IVF_FLAT": {"build": {"nlist": 1024}, "search": {"nprobe": 16}},
+    "IVF_SQ8": {"build": {"nlist": 1024}, "search": {"nprobe": 16}},
+    "FLAT": {"build": {}, "search": {}},
+}
+# 建立INVERTED标量索引的字段（常用过滤条件）
+SCALAR_INDEX_FIELDS = ("user_id", "username", "message_type")
+# 读操作可选的一致性级别：Strong等待最新写入可见；Session保证本客户端的写入对自己可见；
+# Bounded允许有界延迟；Eventually不等待
+CONSISTENCY_LEVELS = ("Strong", "Bounded", "Session", "Eventually")
 
 # 定义DoubaoEmbeddings类
 class DoubaoEmbeddings(Embeddings):
-    def __init__(self, api_key=None, model="doubao-embedding-text-240715"):
+    def __init__(self, api_key=None, model="doubao-embedding-text-240715", use_cache=True, cache: EmbeddingCache = None):
         print("初始化豆包嵌入模型")
         if not api_key:
             api_key = os.getenv("Doubao_API_KEY")
@@ -33,37 +50,291 @@ class DoubaoEmbeddings(Embeddings):
         )
         self.model = model
         self.vector_dim = 768  # 明确向量维度
+        # 嵌入缓存：相同文本（如重复弹幕、固定问候）不再重复请求API
+        self.cache = (cache or get_default_embedding_cache()) if use_cache else None
+    
+    def _request_embeddings(self, texts):
+        """调用豆包API生成向量，失败时抛出异常"""
+        response = self.client.embeddings.create(
+            model=self.model,
+            input=texts,
+            dimensions=self.vector_dim
+        )
+        return [item.embedding for item in response.data]
+    
+    def _embed(self, texts):
+        """经过缓存生成向量，只有API真实返回的结果才会写入缓存"""
+        if self.cache is None:
+            return self._request_embeddings(texts)
+        return self.cache.embed(self.model, self.vector_dim, texts, self._request_embeddings)
     
     def embed_documents(self, texts):
         """为文档列表生成嵌入向量"""
         try:
-            response = self.client.embeddings.create(
-                model=self.model,
-                input=texts,
-                dimensions=self.vector_dim
-            )
-            return [item.embedding for item in response.data]
+            return self._embed(list(texts))
         except Exception as e:
             logger.error(f"豆包生成文档嵌入失败: {str(e)}")
             # 如果API调用失败，返回随机向量作为备选
             return [np.random.random(self.vector_dim).tolist() for _ in texts]
     
+    def embed_documents_strict(self, texts):
+        """为文档列表生成嵌入向量，失败时抛出异常（用于需要持久化的向量，不返回随机向量）"""
+        return self._embed(list(texts))
+    
     def embed_query(self, text):
         """为单个查询生成嵌入向量"""
         try:
-            response = self.client.embeddings.create(
-                model=self.model,
-                input=[text],
-                dimensions=self.vector_dim
-            )
-            return response.data[0].embedding
+            return self._embed([text])[0]
         except Exception as e:
             logger.error(f"豆包生成查询嵌入失败: {str(e)}")
             # 如果API调用失败，返回随机向量作为备选
             return np.random.random(self.vector_dim).tolist()
 
+class MilvusWriteBuffer:
+    """
+    MilvusRAG的异步写缓冲
+
+    消息先进入有界队列，由后台线程攒够max_batch条或等待flush_interval秒后，
+    对缺少向量的行做一次批量嵌入，再一次性多行插入。
+    队列满时put会阻塞（背压），close时会把剩余数据全部写入。
+
+    嵌入和插入都按指数退避重试；重试用尽的批次追加到溢出文件（JSONL）而不是丢弃，
+    后台线程空闲时定期把溢出文件中的行重新写入（upsert，重复写入不会产生重复行）。
+    嵌入失败时不会写入随机向量。
+    """
+
+    def __init__(self, rag: "MilvusRAG", max_batch: int = 32, flush_interval: float = 0.2,
+                 max_pending: int = 1000, max_retries: int = 3, spill_path: Optional[str] = None,
+                 spill_retry_interval: float = 30.0):
+        """
+        初始化写缓冲
+
+        Args:
+            rag (MilvusRAG): 所属的MilvusRAG实例
+            max_batch (int): 每批最多插入的行数，默认为32
+            flush_interval (float): 收到首行后最多等待的秒数，默认为0.2
+            max_pending (int): 队列中最多等待的行数，超过后写入方阻塞，默认为1000
+            max_retries (int): 单批嵌入或写入失败后的最大重试次数，默认为3
+            spill_path (str, optional): 溢出文件路径，默认为本目录下的milvus_spill.jsonl
+            spill_retry_interval (float): 重新写入溢出文件的最短间隔秒数，默认为30
+        """
+        self.rag = rag
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.spill_path = spill_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), "milvus_spill.jsonl")
+        self.spill_retry_interval = spill_retry_interval
+        self._queue: Queue = Queue(maxsize=max_pending)
+        self._closed = False
+        self._spill_lock = threading.Lock()
+        # 启动时立即尝试写入上次遗留的溢出数据
+        self._last_replay = 0.0
+
+        self.flushed_rows = 0
+        self.flushed_batches = 0
+        self.dropped_rows = 0
+        self.spilled_rows = 0
+        self.replayed_rows = 0
+
+        self._thread = threading.Thread(target=self._run, name="MilvusWriteBuffer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, data: Dict[str, Any], timeout: Optional[float] = None):
+        """
+        放入一行待写入数据，队列满时阻塞
+
+        Args:
+            data (Dict[str, Any]): 行数据，vector_field可以为None（由后台批量嵌入）
+            timeout (float, optional): 最长阻塞秒数，None表示一直等待
+
+        Raises:
+            RuntimeError: 写缓冲已关闭
+            queue.Full: 超时仍无法放入
+        """
+        if self._closed:
+            raise RuntimeError("写缓冲已关闭")
+        self._queue.put(data, timeout=timeout)
+
+    def pending(self) -> int:
+        """
+        获取等待写入的行数
+
+        Returns:
+            int: 队列中的行数
+        """
+        return self._queue.qsize()
+
+    def _collect_batch(self) -> List[Dict[str, Any]]:
+        """阻塞等待首行，然后在时间窗口内尽量攒满一批"""
+        try:
+            first = self._queue.get(timeout=0.5)
+        except Empty:
+            return []
+        batch = [first]
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _with_retry(self, action: str, fn):
+        """执行fn，失败时指数退避重试，重试用尽后抛出最后一次的异常"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return fn()
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                wait = 0.5 * (2 ** attempt)
+                logger.warning(f"{action}失败，{wait:.1f}秒后重试: {e}")
+                time.sleep(wait)
+
+    def _embed_rows(self, rows: List[Dict[str, Any]]):
+        """为缺少向量的行批量生成向量（失败时抛出异常，不使用随机向量）"""
+        missing = [row for row in rows if row.get("vector_field") is None]
+        if not missing:
+            return
+        model = self.rag.embedding_model
+        embed = getattr(model, "embed_documents_strict", model.embed_documents)
+        texts = [row["content"] for row in missing]
+        vectors = self._with_retry("批量生成消息向量", lambda: embed(texts))
+        for row, vector in zip(missing, vectors):
+            row["vector_field"] = vector
+
+    def _write_batch(self, batch: List[Dict[str, Any]], upsert: bool = False) -> bool:
+        """
+        批量嵌入缺少向量的行并一次性写入，重试用尽后写入溢出文件
+
+        Args:
+            batch (List[Dict[str, Any]]): 行数据
+            upsert (bool): 是否以upsert写入（重新写入溢出数据时使用）
+
+        Returns:
+            bool: 是否已写入Milvus
+        """
+        try:
+            self._embed_rows(batch)
+            self._with_retry("批量写入Milvus", lambda: self.rag.add_messages(batch, upsert=upsert))
+        except Exception as e:
+            logger.error(f"批量写入Milvus失败，{len(batch)}条消息转存到溢出文件: {e}")
+            self._spill(batch)
+            return False
+        self.flushed_rows += len(batch)
+        self.flushed_batches += 1
+        return True
+
+    def _spill(self, rows: List[Dict[str, Any]]):
+        """把写入失败的行追加到溢出文件，溢出文件也写不进去时才丢弃"""
+        try:
+            with self._spill_lock:
+                with open(self.spill_path, 'a', encoding='utf-8') as f:
+                    for row in rows:
+                        f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.spilled_rows += len(rows)
+        except Exception as e:
+            self.dropped_rows += len(rows)
+            logger.error(f"写入溢出文件失败，丢弃{len(rows)}条消息: {e}")
+
+    def replay_spill(self) -> int:
+        """
+        把溢出文件中的行重新写入Milvus，仍然失败的行会重新追加到溢出文件
+
+        Returns:
+            int: 成功写入的行数
+        """
+        self._last_replay = time.time()
+        replaying = self.spill_path + ".replaying"
+        with self._spill_lock:
+            if not os.path.exists(replaying):
+                if not os.path.exists(self.spill_path):
+                    return 0
+                os.replace(self.spill_path, replaying)
+        rows = []
+        with open(replaying, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 追加到一半时崩溃留下的残行
+                    logger.warning("溢出文件中有不完整的行，已跳过")
+        logger.info(f"重新写入溢出文件中的{len(rows)}条消息")
+        written = 0
+        for start in range(0, len(rows), self.max_batch):
+            batch = rows[start:start + self.max_batch]
+            if self._write_batch(batch, upsert=True):
+                written += len(batch)
+        # 失败的行已重新追加到溢出文件
+        os.remove(replaying)
+        self.replayed_rows += written
+        return written
+
+    def _run(self):
+        """后台写入线程"""
+        while not (self._closed and self._queue.empty()):
+            batch = self._collect_batch()
+            if not batch:
+                if time.time() - self._last_replay >= self.spill_retry_interval:
+                    try:
+                        self.replay_spill()
+                    except Exception as e:
+                        logger.error(f"重新写入溢出文件时出错: {e}")
+                continue
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                logger.error(f"处理写缓冲批次时出错: {e}")
+                self._spill(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """等待当前队列中的数据全部写入"""
+        self._queue.join()
+
+    def close(self):
+        """停止接收新数据，写完剩余数据后结束后台线程"""
+        if self._closed:
+            return
+        self._closed = True
+        self._thread.join()
+        logger.info(f"写缓冲已关闭，共写入{self.flushed_rows}条（{self.flushed_batches}批），"
+                    f"转存溢出文件{self.spilled_rows}条，丢弃{self.dropped_rows}条")
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取写缓冲统计信息
+
+        Returns:
+            Dict[str, int]: 待写入、已写入、批次数、转存溢出文件、重新写入和丢弃行数
+        """
+        return {
+            'pending': self.pending(),
+            'flushed_rows': self.flushed_rows,
+            'flushed_batches': self.flushed_batches,
+            'spilled_rows': self.spilled_rows,
+            'replayed_rows': self.replayed_rows,
+            'dropped_rows': self.dropped_rows
+        }
+
 class MilvusRAG:
-    def __init__(self, uri="http://localhost:19530", token="root:Milvus", dbname="vtuber", embedding_model=DoubaoEmbeddings()):
+    def __init__(self, uri="http://localhost:19530", token="root:Milvus", dbname="vtuber", embedding_model=DoubaoEmbeddings(),
+                 write_batch_size: int = 0, write_flush_interval: float = 0.2, write_max_pending: int = 1000,
+                 index_type: str = "HNSW", index_params: Optional[Dict[str, Any]] = None,
+                 search_params: Optional[Dict[str, Any]] = None, metric_type: str = "COSINE",
+                 consistency_level: str = "Session", consistency_overrides: Optional[Dict[str, str]] = None,
+                 partition_key: bool = True, num_partitions: int = 64, write_spill_path: Optional[str] = None):
         """
         初始化Milvus RAG类（使用新版MilvusClient API）
         
@@ -72,9 +343,37 @@ class MilvusRAG:
             token (str): 连接令牌，默认为root:Milvus
             dbname (str): 数据库名称，默认为vtuber
             embedding_model: 嵌入模型实例，用于生成文本向量
+            write_batch_size (int): 大于0时启用异步写缓冲，每批最多插入的行数；默认为0（同步逐条插入）
+            write_flush_interval (float): 写缓冲攒批的最长等待秒数，默认为0.2
+            write_max_pending (int): 写缓冲队列上限，超过后写入方阻塞，默认为1000
+            index_type (str): 向量索引类型，可选HNSW、IVF_FLAT、IVF_SQ8、FLAT，默认为HNSW
+            index_params (Dict[str, Any], optional): 向量索引构建参数（如M/efConstruction或nlist），默认按索引类型取值
+            search_params (Dict[str, Any], optional): 默认检索参数（如ef或nprobe），可在每次检索时覆盖
+            metric_type (str): 向量距离类型，默认为COSINE
+            consistency_level (str): 读操作的默认一致性级别，可选Strong、Bounded、Session、Eventually，默认为Session
+            consistency_overrides (Dict[str, str], optional): 按方法名覆盖一致性级别，如{"get_chat_history": "Strong"}
+            partition_key (bool): 新建集合时是否以user_id为分区键，按用户过滤的读写只访问该用户所在分区，默认为True
+            num_partitions (int): 分区键模式下的分区数，默认为64
+            write_spill_path (str, optional): 写缓冲重试用尽后转存消息的溢出文件，默认为本目录下的milvus_spill.jsonl
         """
         logger.info("初始化MilvusRAG类...")
         
+        index_type = index_type.upper()
+        if index_type not in VECTOR_INDEX_DEFAULTS:
+            raise ValueError(f"不支持的向量索引类型: {index_type}，可选: {list(VECTOR_INDEX_DEFAULTS)}")
+        self.index_type = index_type
+        self.index_params = index_params if index_params is not None else dict(VECTOR_INDEX_DEFAULTS[index_type]["build"])
+        self.search_params = search_params if search_params is not None else dict(VECTOR_INDEX_DEFAULTS[index_type]["search"])
+        self.metric_type = metric_type
+        self.consistency_level = self._check_consistency_level(consistency_level)
+        self.consistency_overrides = {
+            method: self._check_consistency_level(level) for method, level in (consistency_overrides or {}).items()
+        }
+        self.partition_key = partition_key
+        self.num_partitions = num_partitions
+        # 实际集合是否以user_id为分区键（已有的旧集合可能没有，需要迁移）
+        self.partition_key_enabled = False
+        
         try:
             # 使用新版MilvusClient连接到Milvus服务
             self.client = MilvusClient(
@@ -96,77 +395,327 @@ class MilvusRAG:
             # 创建或加载集合
             self._create_or_load_collection()
             
+            # 异步写缓冲（可选）：攒批嵌入、多行插入
+            self.write_buffer = None
+            if write_batch_size > 0:
+                self.write_buffer = MilvusWriteBuffer(
+                    self,
+                    max_batch=write_batch_size,
+                    flush_interval=write_flush_interval,
+                    max_pending=write_max_pending,
+                    spill_path=write_spill_path
+                )
+                logger.info(f"启用异步写缓冲，每批最多{write_batch_size}条")
+            
             logger.info("MilvusRAG类初始化完成")
             
         except Exception as e:
             logger.error(f"初始化MilvusRAG失败: {str(e)}")
             raise
     
+    def _build_schema(self, partition_key: bool = False):
+        """
+        构建聊天历史集合的schema
+        
+        Args:
+            partition_key (bool): 是否以user_id为分区键
+            
+        Returns:
+            CollectionSchema: 集合schema
+        """
+        schema = MilvusClient.create_schema(auto_id=False, enable_dynamic_field=False, description="聊天历史集合")
+        schema.add_field(field_name="message_id", datatype=DataType.VARCHAR, max_length=36, is_primary=True,
+                         description="消息ID")
+        schema.add_field(field_name="user_id", datatype=DataType.VARCHAR, max_length=100, description="用户ID",
+                         is_partition_key=partition_key)
+        schema.add_field(field_name="username", datatype=DataType.VARCHAR, max_length=100, description="用户名")
+        schema.add_field(field_name="content", datatype=DataType.VARCHAR, max_length=10000, description="消息内容")
+        schema.add_field(field_name="timestamp", datatype=DataType.DOUBLE, description="时间戳")
+        schema.add_field(field_name="message_type", datatype=DataType.VARCHAR, max_length=10,
+                         description="消息类型：query或response")
+        schema.add_field(field_name="vector_field", datatype=DataType.FLOAT_VECTOR, dim=768, description="消息向量")
+        return schema
+    
+    def _build_index_params(self, fields: Optional[List[str]] = None):
+        """
+        构建索引参数：向量字段按index_type建索引，常用过滤字段建INVERTED标量索引
+        
+        Args:
+            fields (List[str], optional): 只为这些字段构建索引，默认为全部
+            
+        Returns:
+            IndexParams: 索引参数
+        """
+        index_params = MilvusClient.prepare_index_params()
+        if fields is None or "vector_field" in fields:
+            index_params.add_index(
+                field_name="vector_field",
+                index_name="vector_field",
+                index_type=self.index_type,
+                metric_type=self.metric_type,
+                params=self.index_params
+            )
+        for field in SCALAR_INDEX_FIELDS:
+            if fields is None or field in fields:
+                index_params.add_index(field_name=field, index_name=field, index_type="INVERTED")
+        return index_params
+    
     def _create_or_load_collection(self):
         """
         创建或加载聊天历史集合（使用新版MilvusClient API）
+        
+        新建集合时同时建立索引并加载；已有集合会补建缺失的索引，并确保集合已加载
         """
         # 检查集合是否存在
         if not self.client.has_collection(collection_name=self.chat_history_collection_name):
-            # 定义集合字段（新版API格式）
-            fields = [
-                {
-                    "name": "message_id",
-                    "data_type": "VARCHAR",
-                    "max_length": 36,
-                    "is_primary": True,
-                    "description": "消息ID"
-                },
-                {
-                    "name": "user_id",
-                    "data_type": "VARCHAR",
-                    "max_length": 100,
-                    "description": "用户ID"
-                },
-                {
-                    "name": "username",
-                    "data_type": "VARCHAR",
-                    "max_length": 100,
-                    "description": "用户名"
-                },
-                {
-                    "name": "content",
-                    "data_type": "VARCHAR",
-                    "max_length": 10000,
-                    "description": "消息内容"
-                },
-                {
-                    "name": "timestamp",
-                    "data_type": "DOUBLE",
-                    "description": "时间戳"
-                },
-                {
-                    "name": "message_type",
-                    "data_type": "VARCHAR",
-                    "max_length": 10,
-                    "description": "消息类型：query或response"
-                },
-                {
-                    "name": "vector_field",
-                    "data_type": "FLOAT_VECTOR",
-                    "dim": 768,
-                    "description": "消息向量"
-                }
-            ]
-            
-            # 创建集合（修复：直接传递fields参数，不使用schema字典）
-            self.client.create_collection(
-                collection_name=self.chat_history_collection_name,
-                description="聊天历史集合",
-                fields=fields
-            )
-            logger.info(f"创建聊天历史集合: {self.chat_history_collection_name}")
+            # 带索引参数创建集合，创建后自动加载
+            self._create_collection(self.chat_history_collection_name, self.partition_key)
+            logger.info(f"创建聊天历史集合: {self.chat_history_collection_name}，向量索引: {self.index_type}")
         else:
             logger.info(f"加载聊天历史集合: {self.chat_history_collection_name}")
+            self.ensure_indexes()
+        self.partition_key_enabled = self._has_partition_key(self.chat_history_collection_name)
+        if self.partition_key and not self.partition_key_enabled:
+            logger.warning("聊天历史集合没有以user_id为分区键，按用户的查询会扫描整个集合；"
+                           "可运行 tool/migrate_chat_history.py 迁移")
+        self.ensure_loaded()
+    
+    def _create_collection(self, collection_name: str, partition_key: bool):
+        """
+        按当前schema和索引配置创建集合
+        
+        Args:
+            collection_name (str): 集合名称
+            partition_key (bool): 是否以user_id为分区键
+        """
+        kwargs = {"num_partitions": self.num_partitions} if partition_key else {}
+        self.client.create_collection(
+            collection_name=collection_name,
+            schema=self._build_schema(partition_key),
+            index_params=self._build_index_params(),
+            **kwargs
+        )
+    
+    def _has_partition_key(self, collection_name: str) -> bool:
+        """集合的user_id字段是否为分区键"""
+        description = self.client.describe_collection(collection_name=collection_name)
+        return any(field.get("name") == "user_id" and field.get("is_partition_key")
+                   for field in description.get("fields", []))
+    
+    @staticmethod
+    def _user_filter(user_id: str) -> str:
+        """
+        按用户过滤的表达式；user_id为分区键时Milvus据此只访问该用户所在的分区
+        
+        Args:
+            user_id (str): 用户ID
+            
+        Returns:
+            str: 过滤表达式
+        """
+        return f"user_id == '{user_id}'"
+    
+    def migrate_to_partition_key(self, batch_size: int = 1000, keep_backup: bool = True) -> int:
+        """
+        把旧的（无分区键）聊天历史集合迁移为以user_id为分区键的新集合
+        
+        先把全部数据（含向量）分批复制到临时集合，校验条数一致后再交换集合名称。
+        迁移期间不应有其他进程写入。
+        
+        Args:
+            batch_size (int): 每批复制的行数，默认为1000
+            keep_backup (bool): 是否把旧集合重命名为备份保留，为False时删除旧集合，默认为True
+            
+        Returns:
+            int: 迁移的行数
+        """
+        name = self.chat_history_collection_name
+        if self._has_partition_key(name):
+            logger.info("聊天历史集合已经以user_id为分区键，无需迁移")
+            self.partition_key_enabled = True
+            return 0
+        
+        self.flush()
+        temp_name = f"{name}_partitioned"
+        if self.client.has_collection(collection_name=temp_name):
+            # 上次迁移中断留下的临时集合
+            self.client.drop_collection(collection_name=temp_name)
+        self._create_collection(temp_name, partition_key=True)
+        
+        start = time.time()
+        copied = 0
+        iterator = self.client.query_iterator(
+            collection_name=name,
+            batch_size=batch_size,
+            filter="",
+            output_fields=["message_id", "user_id", "username", "content", "timestamp", "message_type",
+                           "vector_field"]
+        )
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    break
+                self.client.insert(collection_name=temp_name, data=rows)
+                copied += len(rows)
+                logger.info(f"已迁移{copied}条")
+        finally:
+            iterator.close()
+        
+        def count(collection_name: str) -> int:
+            result = self.client.query(collection_name=collection_name, filter="", output_fields=["count(*)"],
+                                       consistency_level="Strong")
+            return result[0]["count(*)"] if result else 0
+        
+        source_count, target_count = count(name), count(temp_name)
+        if source_count != target_count:
+            raise RuntimeError(f"迁移校验失败: 原集合{source_count}条，新集合{target_count}条，原集合未改动")
+        
+        self.client.release_collection(collection_name=name)
+        if keep_backup:
+            backup_name = f"{name}_backup_{int(time.time())}"
+            self.client.rename_collection(old_name=name, new_name=backup_name)
+            logger.info(f"旧集合已重命名为: {backup_name}")
+        else:
+            self.client.drop_collection(collection_name=name)
+        self.client.rename_collection(old_name=temp_name, new_name=name)
+        self.partition_key_enabled = True
+        self.ensure_loaded()
+        logger.info(f"迁移完成，共{copied}条，耗时{time.time() - start:.2f}秒")
+        return copied
+    
+    def _is_loaded(self) -> bool:
+        """集合是否已加载到内存"""
+        state = self.client.get_load_state(collection_name=self.chat_history_collection_name).get("state")
+        return getattr(state, "name", str(state)) == "Loaded"
+    
+    def ensure_indexes(self) -> List[str]:
+        """
+        补建缺失的向量索引和标量索引（需要时先释放集合，建完后重新加载）
+        
+        Returns:
+            List[str]: 本次新建索引的字段
+        """
+        existing = set(self.client.list_indexes(collection_name=self.chat_history_collection_name))
+        missing = [field for field in ("vector_field",) + SCALAR_INDEX_FIELDS if field not in existing]
+        if not missing:
+            return []
+        
+        was_loaded = self._is_loaded()
+        if was_loaded:
+            self.client.release_collection(collection_name=self.chat_history_collection_name)
+        self.client.create_index(
+            collection_name=self.chat_history_collection_name,
+            index_params=self._build_index_params(missing)
+        )
+        logger.info(f"补建索引: {missing}")
+        if was_loaded:
+            self.client.load_collection(collection_name=self.chat_history_collection_name)
+        return missing
+    
+    def ensure_loaded(self):
+        """
+        检查集合加载状态，未加载时加载（阻塞到加载完成）
+        """
+        if self._is_loaded():
+            return
+        start = time.time()
+        self.client.load_collection(collection_name=self.chat_history_collection_name)
+        logger.info(f"聊天历史集合已加载，耗时{time.time() - start:.2f}秒")
+    
+    def rebuild_vector_index(self, index_type: str, index_params: Optional[Dict[str, Any]] = None,
+                             search_params: Optional[Dict[str, Any]] = None):
+        """
+        更换向量索引类型或参数：释放集合、删除旧索引、建新索引并重新加载
+        
+        Args:
+            index_type (str): 新的向量索引类型
+            index_params (Dict[str, Any], optional): 索引构建参数，默认按索引类型取值
+            search_params (Dict[str, Any], optional): 新的默认检索参数，默认按索引类型取值
+        """
+        index_type = index_type.upper()
+        if index_type not in VECTOR_INDEX_DEFAULTS:
+            raise ValueError(f"不支持的向量索引类型: {index_type}，可选: {list(VECTOR_INDEX_DEFAULTS)}")
+        self.flush()
+        self.client.release_collection(collection_name=self.chat_history_collection_name)
+        if "vector_field" in self.client.list_indexes(collection_name=self.chat_history_collection_name):
+            self.client.drop_index(collection_name=self.chat_history_collection_name, index_name="vector_field")
+        self.index_type = index_type
+        self.index_params = index_params if index_params is not None else dict(VECTOR_INDEX_DEFAULTS[index_type]["build"])
+        self.search_params = search_params if search_params is not None else dict(VECTOR_INDEX_DEFAULTS[index_type]["search"])
+        self.client.create_index(
+            collection_name=self.chat_history_collection_name,
+            index_params=self._build_index_params(["vector_field"])
+        )
+        self.client.load_collection(collection_name=self.chat_history_collection_name)
+        logger.info(f"向量索引已重建为{index_type}，参数: {self.index_params}")
+    
+    def index_info(self) -> Dict[str, Any]:
+        """
+        获取各字段的索引信息
+        
+        Returns:
+            Dict[str, Any]: 索引名 -> 索引描述
+        """
+        return {
+            name: self.client.describe_index(collection_name=self.chat_history_collection_name, index_name=name)
+            for name in self.client.list_indexes(collection_name=self.chat_history_collection_name)
+        }
+    
+    @staticmethod
+    def _check_consistency_level(level: str) -> str:
+        """校验一致性级别名称"""
+        if level not in CONSISTENCY_LEVELS:
+            raise ValueError(f"不支持的一致性级别: {level}，可选: {list(CONSISTENCY_LEVELS)}")
+        return level
+    
+    def set_consistency_level(self, level: str, method: Optional[str] = None):
+        """
+        设置读操作的一致性级别
+        
+        Args:
+            level (str): 一致性级别
+            method (str, optional): 方法名，指定时只修改该方法，否则修改全局默认值
+        """
+        level = self._check_consistency_level(level)
+        if method is None:
+            self.consistency_level = level
+        else:
+            self.consistency_overrides[method] = level
+    
+    def _consistency_for(self, method: str, level: Optional[str] = None) -> str:
+        """
+        确定一次读操作的一致性级别：调用参数 > 方法级设置 > 全局默认值
+        
+        Args:
+            method (str): 方法名
+            level (str, optional): 本次调用指定的一致性级别
+            
+        Returns:
+            str: 一致性级别
+        """
+        if level is not None:
+            return self._check_consistency_level(level)
+        return self.consistency_overrides.get(method, self.consistency_level)
+    
+    def _build_search_params(self, search_params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        合并默认检索参数和本次调用的检索参数
+        
+        Args:
+            search_params (Dict[str, Any], optional): 本次调用的检索参数（如{"ef": 128}或{"nprobe": 32}）
+            
+        Returns:
+            Dict[str, Any]: 传给client.search的search_params
+        """
+        params = dict(self.search_params)
+        if search_params:
+            params.update(search_params)
+        return {"metric_type": self.metric_type, "params": params}
     
     def _generate_vector(self, content: str) -> List[float]:
         """
-        使用DoubaoEmbeddings生成向量
+        使用DoubaoEmbeddings生成向量，失败时抛出异常（不使用随机向量，避免写入或检索无意义的向量）
         
         Args:
             content (str): 内容文本
@@ -174,9 +723,13 @@ class MilvusRAG:
         Returns:
             List[float]: 生成的向量
         """
-        return self.embedding_model.embed_query(content)
+        embed = getattr(self.embedding_model, "embed_documents_strict", None)
+        if embed is None:
+            return self.embedding_model.embed_query(content)
+        return embed([content])[0]
     
-    def construct_data_input(self, user_id: str, username: str, content: str, message_type: str) -> Dict[str, Any]:
+    def construct_data_input(self, user_id: str, username: str, content: str, message_type: str,
+                             vector: Optional[List[float]] = None, defer_vector: bool = False) -> Dict[str, Any]:
         """
         构造数据输入
         
@@ -185,15 +738,18 @@ class MilvusRAG:
             username (str): 用户名
             content (str): 消息内容
             message_type (str): 消息类型（query或response）
+            vector (List[float], optional): 预先计算好的内容向量，为None时重新生成
+            defer_vector (bool): 为True且未提供向量时不生成向量，留给写缓冲批量嵌入
             
         Returns:
-            Dict[str, Any]: 构造的数据字典
+            Dict[str, Any]: 构造的数据字典；需要生成向量但嵌入失败时抛出异常
         """
         message_id = str(uuid.uuid4())
         timestamp = int(time.time())
         
-        # 生成向量
-        vector = self._generate_vector(content)
+        # 生成向量（已有向量时直接复用）
+        if vector is None and not defer_vector:
+            vector = self._generate_vector(content)
         
         data = {
             "message_id": message_id,
@@ -227,7 +783,45 @@ class MilvusRAG:
         logger.info(f"添加消息成功: {data['message_id']}")
         return data
     
-    def add_user_message(self, user_id: str, username: str, content: str) -> Dict[str, Any]:
+    def add_messages(self, rows: List[Dict[str, Any]], upsert: bool = False) -> List[Dict[str, Any]]:
+        """
+        一次性插入多条消息到Milvus
+        
+        Args:
+            rows (List[Dict[str, Any]]): 消息数据列表（需包含向量）
+            upsert (bool): 是否以upsert写入（按message_id覆盖，重复写入不产生重复行），默认为False
+            
+        Returns:
+            List[Dict[str, Any]]: 添加的消息信息列表
+        """
+        if not rows:
+            return rows
+        write = self.client.upsert if upsert else self.client.insert
+        write(
+            collection_name=self.chat_history_collection_name,
+            data=rows
+        )
+        logger.info(f"批量添加消息成功，共{len(rows)}条")
+        return rows
+    
+    def _store_message(self, user_id: str, username: str, content: str, message_type: str,
+                       vector: Optional[List[float]] = None) -> Dict[str, Any]:
+        """
+        写入一条消息：启用写缓冲时放入缓冲队列（向量可稍后批量生成），否则同步插入
+        
+        Returns:
+            Dict[str, Any]: 添加的消息信息（写缓冲模式下vector_field可能尚未生成）
+        """
+        if self.write_buffer is not None:
+            data = self.construct_data_input(user_id, username, content, message_type,
+                                             vector=vector, defer_vector=True)
+            self.write_buffer.put(data)
+            return data
+        data = self.construct_data_input(user_id, username, content, message_type, vector=vector)
+        return self.add_message(data)
+    
+    def add_user_message(self, user_id: str, username: str, content: str,
+                         vector: Optional[List[float]] = None) -> Dict[str, Any]:
         """
         添加用户消息到Milvus
         
@@ -235,14 +829,15 @@ class MilvusRAG:
             user_id (str): 用户ID
             username (str): 用户名
             content (str): 消息内容
+            vector (List[float], optional): 预先计算好的内容向量
             
         Returns:
             Dict[str, Any]: 添加的消息信息
         """
-        data = self.construct_data_input(user_id, username, content, "query")
-        return self.add_message(data)
+        return self._store_message(user_id, username, content, "query", vector=vector)
     
-    def add_llm_response(self, user_id: str, username: str, content: str) -> Dict[str, Any]:
+    def add_llm_response(self, user_id: str, username: str, content: str,
+                         vector: Optional[List[float]] = None) -> Dict[str, Any]:
         """
         添加LLM回复到Milvus
         
@@ -250,14 +845,47 @@ class MilvusRAG:
             user_id (str): 用户ID
             username (str): 用户名
             content (str): 回复内容
+            vector (List[float], optional): 预先计算好的内容向量
             
         Returns:
             Dict[str, Any]: 添加的回复信息
         """
-        data = self.construct_data_input(user_id, username, content, "response")
-        return self.add_message(data)
+        return self._store_message(user_id, username, content, "response", vector=vector)
+    
+    def search_and_add_user_message(self, user_id: str, username: str, content: str, top_k: int = 5,
+                                    search_user_id: str = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        先用消息内容做语义检索，再把该消息写入Milvus，两步共用同一个向量（只嵌入一次）
+        
+        先检索后写入，检索结果不会包含这条消息本身。嵌入失败时跳过检索（返回空列表），
+        消息不带向量放入写缓冲，由缓冲稍后批量嵌入或写入溢出文件
+        
+        Args:
+            user_id (str): 用户ID
+            username (str): 用户名
+            content (str): 消息内容
+            top_k (int): 返回结果数量，默认为5
+            search_user_id (str, optional): 检索时只查该用户的消息
+            
+        Returns:
+            Tuple[List[Dict[str, Any]], Dict[str, Any]]: (相似消息列表, 添加的消息信息)
+        """
+        try:
+            vector = self._generate_vector(content)
+        except Exception as e:
+            logger.error(f"生成消息向量失败，跳过本次检索: {e}")
+            vector = None
+            similar_messages = []
+        else:
+            similar_messages = self.semantic_similarity_search(content, top_k=top_k, user_id=search_user_id,
+                                                               query_vector=vector)
+        data = self.add_user_message(user_id, username, content, vector=vector)
+        return similar_messages, data
     
-    def semantic_similarity_search(self, query: str, top_k: int = 5, user_id: str = None) -> List[Dict[str, Any]]:
+    def semantic_similarity_search(self, query: str, top_k: int = 5, user_id: str = None,
+                                   query_vector: Optional[List[float]] = None,
+                                   search_params: Optional[Dict[str, Any]] = None,
+                                   consistency_level: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         语义相似度查询
         
@@ -265,17 +893,26 @@ class MilvusRAG:
             query (str): 查询文本
             top_k (int): 返回结果数量，默认为5
             user_id (str, optional): 用户ID，用于筛选特定用户的消息
+            query_vector (List[float], optional): 预先计算好的查询向量，为None时重新生成
+            search_params (Dict[str, Any], optional): 本次检索的索引参数（如{"ef": 128}或{"nprobe": 32}）
+            consistency_level (str, optional): 本次检索的一致性级别，默认按方法级或全局设置
             
         Returns:
-            List[Dict[str, Any]]: 相似的消息列表
+            List[Dict[str, Any]]: 相似的消息列表，生成查询向量失败时为空列表
         """
         logger.info(f"执行语义相似度查询: {query}，返回前{top_k}个结果")
         
-        # 生成查询向量
-        query_vector = self._generate_vector(query)
+        # 生成查询向量（已有向量时直接复用）
+        if query_vector is None:
+            try:
+                query_vector = self._generate_vector(query)
+            except Exception as e:
+                # 嵌入失败时跳过检索，不用兜底向量搜出无关结果
+                logger.error(f"生成查询向量失败，跳过本次检索: {e}")
+                return []
         
         # 构建过滤条件
-        filter_expr = f"user_id == '{user_id}'" if user_id else ""
+        filter_expr = self._user_filter(user_id) if user_id else ""
         
         # 执行向量搜索
         results = self.client.search(
@@ -283,28 +920,92 @@ class MilvusRAG:
             data=[query_vector],
             limit=top_k,
             output_fields=["message_id", "user_id", "username", "content", "timestamp", "message_type"],
-            search_params={"metric_type": "COSINE", "params": {}},
-            filter=filter_expr
+            search_params=self._build_search_params(search_params),
+            filter=filter_expr,
+            consistency_level=self._consistency_for("semantic_similarity_search", consistency_level)
         )
         
         # 处理结果
-        similar_messages = []
-        for result in results[0]:
-            similar_messages.append({
-                "message_id": result["entity"]["message_id"],
-                "user_id": result["entity"]["user_id"],
-                "username": result["entity"]["username"],
-                "content": result["entity"]["content"],
-                "timestamp": result["entity"]["timestamp"],
-                "message_type": result["entity"]["message_type"],
-                "distance": result["distance"],
-                "similarity": 1 - result["distance"]  # 余弦距离转换为相似度
-            })
+        similar_messages = [self._format_hit(result) for result in results[0]]
         
         logger.info(f"语义相似度查询完成，共返回{len(similar_messages)}条记录")
         return similar_messages
     
-    def search_by_username(self, username: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+    def semantic_similarity_search_batch(self, queries: List[str], top_k: int = 5,
+                                         user_ids: Optional[List[Optional[str]]] = None,
+                                         search_params: Optional[Dict[str, Any]] = None,
+                                         consistency_level: Optional[str] = None) -> List[List[Dict[str, Any]]]:
+        """
+        批量语义相似度查询：所有查询一次批量嵌入生成向量，作为多向量请求一次检索
+        
+        Milvus一次search只能带一个过滤条件，因此按user_id分组，每个不同的用户一次search；
+        不按用户过滤（user_ids为None）时所有查询只需一次search。
+        
+        Args:
+            queries (List[str]): 查询文本列表
+            top_k (int): 每个查询返回的结果数量，默认为5
+            user_ids (List[Optional[str]], optional): 与queries一一对应的用户ID，元素为None表示不过滤
+            search_params (Dict[str, Any], optional): 本次检索的索引参数
+            consistency_level (str, optional): 本次检索的一致性级别，默认按方法级或全局设置
+            
+        Returns:
+            List[List[Dict[str, Any]]]: 与queries顺序一致的相似消息列表，生成查询向量失败时每项均为空列表
+        """
+        if not queries:
+            return []
+        if user_ids is None:
+            user_ids = [None] * len(queries)
+        if len(user_ids) != len(queries):
+            raise ValueError("user_ids的长度必须与queries一致")
+        
+        start = time.time()
+        embed = getattr(self.embedding_model, "embed_documents_strict", self.embedding_model.embed_documents)
+        try:
+            vectors = embed(list(queries))
+        except Exception as e:
+            # 嵌入失败时整批返回空结果，不用兜底向量检索
+            logger.error(f"批量生成查询向量失败，跳过本批检索: {e}")
+            return [[] for _ in queries]
+        
+        # 按过滤条件分组：filter_expr -> 查询下标列表
+        groups: Dict[str, List[int]] = {}
+        for i, user_id in enumerate(user_ids):
+            groups.setdefault(self._user_filter(user_id) if user_id else "", []).append(i)
+        
+        results: List[List[Dict[str, Any]]] = [[] for _ in queries]
+        for filter_expr, indices in groups.items():
+            hits = self.client.search(
+                collection_name=self.chat_history_collection_name,
+                data=[vectors[i] for i in indices],
+                limit=top_k,
+                output_fields=["message_id", "user_id", "username", "content", "timestamp", "message_type"],
+                search_params=self._build_search_params(search_params),
+                filter=filter_expr,
+                consistency_level=self._consistency_for("semantic_similarity_search_batch", consistency_level)
+            )
+            for i, query_hits in zip(indices, hits):
+                results[i] = [self._format_hit(hit) for hit in query_hits]
+        
+        logger.info(f"批量语义相似度查询完成，{len(queries)}个查询，{len(groups)}次检索，"
+                    f"耗时{time.time() - start:.2f}秒")
+        return results
+    
+    @staticmethod
+    def _format_hit(result: Dict[str, Any]) -> Dict[str, Any]:
+        """把一条检索命中转换为消息字典"""
+        return {
+            "message_id": result["entity"]["message_id"],
+            "user_id": result["entity"]["user_id"],
+            "username": result["entity"]["username"],
+            "content": result["entity"]["content"],
+            "timestamp": result["entity"]["timestamp"],
+            "message_type": result["entity"]["message_type"],
+            "distance": result["distance"],
+            "similarity": 1 - result["distance"]  # 余弦距离转换为相似度
+        }
+    
+    def search_by_username(self, username: str, limit: int = 20, offset: int = 0,
+                           consistency_level: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         用户名称查询
         
@@ -312,6 +1013,7 @@ class MilvusRAG:
             username (str): 用户名
             limit (int): 返回结果数量，默认为20
             offset (int): 结果偏移量，默认为0
+            consistency_level (str, optional): 本次查询的一致性级别，默认按方法级或全局设置
             
         Returns:
             List[Dict[str, Any]]: 查询到的消息列表
@@ -328,20 +1030,22 @@ class MilvusRAG:
             limit=limit,
             offset=offset,
             output_fields=["message_id", "user_id", "username", "content", "timestamp", "message_type"],
-            consistency_level="Strong",
+            consistency_level=self._consistency_for("search_by_username", consistency_level),
             order_by="timestamp DESC"
         )
         
         logger.info(f"按用户名查询完成，共返回{len(results)}条记录")
         return results
     
-    def search_recent_questions(self, user_id: str = None, limit: int = 20) -> List[Dict[str, Any]]:
+    def search_recent_questions(self, user_id: str = None, limit: int = 20,
+                                consistency_level: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         最近问题查询
         
         Args:
             user_id (str, optional): 用户ID，用于筛选特定用户的问题
             limit (int): 返回结果数量，默认为20
+            consistency_level (str, optional): 本次查询的一致性级别，默认按方法级或全局设置
             
         Returns:
             List[Dict[str, Any]]: 最近的问题列表
@@ -350,7 +1054,7 @@ class MilvusRAG:
         
         # 构建查询条件
         if user_id:
-            query_expr = f"user_id == '{user_id}' && message_type == 'query'"
+            query_expr = f"{self._user_filter(user_id)} && message_type == 'query'"
         else:
             query_expr = "message_type == 'query'"
         
@@ -360,14 +1064,15 @@ class MilvusRAG:
             filter=query_expr,
             limit=limit,
             output_fields=["message_id", "user_id", "username", "content", "timestamp"],
-            consistency_level="Strong",
+            consistency_level=self._consistency_for("search_recent_questions", consistency_level),
             order_by="timestamp DESC"
         )
         
         logger.info(f"最近问题查询完成，共返回{len(results)}条记录")
         return results
     
-    def get_chat_history(self, user_id: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+    def get_chat_history(self, user_id: str, limit: int = 20, offset: int = 0,
+                         consistency_level: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         获取指定用户的聊天历史
         
@@ -375,6 +1080,7 @@ class MilvusRAG:
             user_id (str): 用户ID
             limit (int): 返回结果的数量限制，默认为20
             offset (int): 结果偏移量，默认为0
+            consistency_level (str, optional): 本次查询的一致性级别，默认按方法级或全局设置
             
         Returns:
             List[Dict[str, Any]]: 聊天历史记录列表
@@ -382,7 +1088,7 @@ class MilvusRAG:
         logger.info(f"获取用户{user_id}的聊天历史，限制{limit}条，偏移{offset}")
         
         # 构建查询条件
-        query_expr = f"user_id == '{user_id}'"
+        query_expr = self._user_filter(user_id)
         
         # 执行查询，按时间戳排序
         results = self.client.query(
@@ -391,14 +1097,15 @@ class MilvusRAG:
             limit=limit,
             offset=offset,
             output_fields=["message_id", "user_id", "username", "content", "timestamp", "message_type"],
-            consistency_level="Strong",
+            consistency_level=self._consistency_for("get_chat_history", consistency_level),
             order_by="timestamp DESC"
         )
         
         logger.info(f"获取聊天历史成功，共返回{len(results)}条记录")
         return results
     
-    def get_chat_history_by_time_range(self, user_id: str, start_time: float, end_time: float) -> List[Dict[str, Any]]:
+    def get_chat_history_by_time_range(self, user_id: str, start_time: float, end_time: float,
+                                       consistency_level: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         获取指定用户在时间范围内的聊天历史
         
@@ -406,6 +1113,7 @@ class MilvusRAG:
             user_id (str): 用户ID
             start_time (float): 开始时间戳（Unix时间）
             end_time (float): 结束时间戳（Unix时间）
+            consistency_level (str, optional): 本次查询的一致性级别，默认按方法级或全局设置
             
         Returns:
             List[Dict[str, Any]]: 聊天历史记录列表
@@ -413,14 +1121,14 @@ class MilvusRAG:
         logger.info(f"获取用户{user_id}在时间范围[{start_time}, {end_time}]内的聊天历史")
         
         # 构建查询条件
-        query_expr = f"user_id == '{user_id}' && timestamp >= {start_time} && timestamp <= {end_time}"
+        query_expr = f"{self._user_filter(user_id)} && timestamp >= {start_time} && timestamp <= {end_time}"
         
         # 执行查询，按时间戳排序
         results = self.client.query(
             collection_name=self.chat_history_collection_name,
             filter=query_expr,
             output_fields=["message_id", "user_id", "username", "content", "timestamp", "message_type"],
-            consistency_level="Strong",
+            consistency_level=self._consistency_for("get_chat_history_by_time_range", consistency_level),
             order_by="timestamp ASC"
         )
         
@@ -463,19 +1171,20 @@ class MilvusRAG:
         # 执行删除操作
         result = self.client.delete(
             collection_name=self.chat_history_collection_name,
-            filter=f"user_id == '{user_id}'"
+            filter=self._user_filter(user_id)
         )
         #print(result)
         
         logger.info(f"删除用户聊天历史成功，影响行数: {result['delete_count']}")
         return result['delete_count'] > 0
     
-    def count_messages(self, user_id: str) -> int:
+    def count_messages(self, user_id: str, consistency_level: Optional[str] = None) -> int:
         """
         统计指定用户的消息数量
         
         Args:
             user_id (str): 用户ID
+            consistency_level (str, optional): 本次查询的一致性级别，默认按方法级或全局设置
             
         Returns:
             int: 消息数量
@@ -485,8 +1194,9 @@ class MilvusRAG:
         # 执行统计
         count = self.client.query(
             collection_name=self.chat_history_collection_name,
-            filter=f"user_id == '{user_id}'",
-            output_fields=["count(*)"]
+            filter=self._user_filter(user_id),
+            output_fields=["count(*)"],
+            consistency_level=self._consistency_for("count_messages", consistency_level)
         )
         
         # 提取统计结果
@@ -494,10 +1204,19 @@ class MilvusRAG:
         logger.info(f"用户{user_id}共有{msg_count}条消息")
         return msg_count
     
+    def flush(self):
+        """
+        等待写缓冲中的数据全部写入Milvus（未启用写缓冲时无操作）
+        """
+        if self.write_buffer is not None:
+            self.write_buffer.flush()
+    
     def close(self):
         """
-        关闭Milvus连接（新版API不需要显式关闭连接）
+        写完缓冲中的剩余数据，关闭Milvus连接（新版API不需要显式关闭连接）
         """
+        if self.write_buffer is not None:
+            self.write_buffer.close()
         logger.info("Milvus连接已关闭（新版API自动管理连接）")
 
 # 示例使用代码
@@ -2,7 +2,10 @@
 import os
 import logging
 import sys
-from typing import Dict, Any, List  # 确保类型提示始终可用
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from typing import Dict, Any, List, Callable, Iterator, Optional, Tuple  # 确保类型提示始终可用
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -12,7 +15,14 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 logger = logging.getLogger(__name__)
 
 from tool.config_load import load_config_to_env
+from LLM_base.embedding_cache import EmbeddingCache, get_default_embedding_cache, text_digest
+from LLM_base.faiss_store import IncrementalFAISSStore
+from LLM_base.ingest_manifest import IngestManifest, FILE_UNCHANGED
+from LLM_base.faiss_index import (INDEX_TYPES, build_index, evaluate_index, choose_search_param,
+                                  set_search_param, faiss_metric, index_bytes)
+import faiss
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
 # 替换HuggingFaceEmbeddings为ZhipuAiClient
 from zai import ZhipuAiClient
 from openai import OpenAI
@@ -37,19 +47,31 @@ logger = logging.getLogger(__name__)
 
 # 创建一个自定义的Embeddings类，适配LangChain的接口
 class ZhipuAIEmbeddings(Embeddings):
-    def __init__(self, api_key, model="embedding-3"):
+    def __init__(self, api_key, model="embedding-3", use_cache=True, cache: EmbeddingCache = None):
         self.client = ZhipuAiClient(api_key=api_key)
         self.model = model
+        # 嵌入缓存：相同的文本块和查询不再重复请求API
+        self.cache = (cache or get_default_embedding_cache()) if use_cache else None
+    
+    def _request_embeddings(self, texts):
+        """调用智谱API生成向量"""
+        response = self.client.embeddings.create(
+            model=self.model,
+            input=texts
+        )
+        # 假设response中包含embeddings字段，每个元素有embedding属性
+        return [item.embedding for item in response.data]
+    
+    def _embed(self, texts):
+        """经过缓存生成向量"""
+        if self.cache is None:
+            return self._request_embeddings(texts)
+        return self.cache.embed(self.model, None, texts, self._request_embeddings)
     
     def embed_documents(self, texts):
         """为文档列表生成嵌入向量"""
         try:
-            response = self.client.embeddings.create(
-                model=self.model,
-                input=texts
-            )
-            # 假设response中包含embeddings字段，每个元素有embedding属性
-            return [item.embedding for item in response.data]
+            return self._embed(list(texts))
         except Exception as e:
             logger.error(f"生成文档嵌入失败: {str(e)}")
             raise
@@ -57,32 +79,40 @@ class ZhipuAIEmbeddings(Embeddings):
     def embed_query(self, text):
         """为单个查询生成嵌入向量"""
         try:
-            response = self.client.embeddings.create(
-                model=self.model,
-                input=[text]
-            )
-            return response.data[0].embedding
+            return self._embed([text])[0]
         except Exception as e:
             logger.error(f"生成查询嵌入失败: {str(e)}")
             raise
 
 # 创建豆包模型的Embeddings类
 class DoubaoEmbeddings(Embeddings):
-    def __init__(self, api_key, model="doubao-embedding-text-240715"):
+    def __init__(self, api_key, model="doubao-embedding-text-240715", use_cache=True, cache: EmbeddingCache = None):
         self.client = OpenAI(
             base_url="https://ark.cn-beijing.volces.com/api/v3",
             api_key=api_key
         )
         self.model = model
+        # 嵌入缓存：相同的文本块和查询不再重复请求API
+        self.cache = (cache or get_default_embedding_cache()) if use_cache else None
+    
+    def _request_embeddings(self, texts):
+        """调用豆包API生成向量"""
+        response = self.client.embeddings.create(
+            model=self.model,
+            input=texts
+        )
+        return [item.embedding for item in response.data]
+    
+    def _embed(self, texts):
+        """经过缓存生成向量"""
+        if self.cache is None:
+            return self._request_embeddings(texts)
+        return self.cache.embed(self.model, None, texts, self._request_embeddings)
     
     def embed_documents(self, texts):
         """为文档列表生成嵌入向量"""
         try:
-            response = self.client.embeddings.create(
-                model=self.model,
-                input=texts
-            )
-            return [item.embedding for item in response.data]
+            return self._embed(list(texts))
         except Exception as e:
             logger.error(f"豆包生成文档嵌入失败: {str(e)}")
             raise
@@ -90,22 +120,92 @@ class DoubaoEmbeddings(Embeddings):
     def embed_query(self, text):
         """为单个查询生成嵌入向量"""
         try:
-            response = self.client.embeddings.create(
-                model=self.model,
-                input=[text]
-            )
-            return response.data[0].embedding
+            return self._embed([text])[0]
         except Exception as e:
             logger.error(f"豆包生成查询嵌入失败: {str(e)}")
             raise
 
+# 支持加入向量库的文件类型
+SUPPORTED_EXTENSIONS = ('.txt', '.pdf', '.docx', '.doc')
+# 默认的文档分块参数
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_CHUNK_OVERLAP = 50
+
+
+def load_and_split_file(file_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                        chunk_overlap: int = DEFAULT_CHUNK_OVERLAP) -> List[Document]:
+    """
+    按文件类型加载文档并分块（模块级函数，可在进程池中执行）
+    
+    Args:
+        file_path (str): 文件路径
+        chunk_size (int): 分块长度，默认为500
+        chunk_overlap (int): 分块重叠长度，默认为50
+        
+    Returns:
+        List[Document]: 文档块列表
+        
+    Raises:
+        ValueError: 不支持的文件类型
+    """
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext == '.txt':
+        loader = TextLoader(file_path, encoding='utf-8')
+    elif file_ext == '.pdf':
+        loader = PyPDFLoader(file_path)
+    elif file_ext in ['.docx', '.doc']:
+        loader = Docx2txtLoader(file_path)
+    else:
+        raise ValueError(f"不支持的文件类型: {file_ext}")
+    
+    documents = loader.load()
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+    return text_splitter.split_documents(documents)
+
+
+def iter_embedding_batches(documents: List[Document], batch_size: int = 64,
+                           max_batch_chars: int = 20000) -> Iterator[List[Document]]:
+    """
+    把文档块切成条数和总字数都不超过上限的嵌入批次
+    
+    Args:
+        documents (List[Document]): 文档块列表
+        batch_size (int): 每批最多条数，默认为64
+        max_batch_chars (int): 每批最多总字数，默认为20000
+        
+    Yields:
+        List[Document]: 一个嵌入批次
+    """
+    batch = []
+    batch_chars = 0
+    for doc in documents:
+        length = len(doc.page_content)
+        if batch and (len(batch) >= batch_size or batch_chars + length > max_batch_chars):
+            yield batch
+            batch = []
+            batch_chars = 0
+        batch.append(doc)
+        batch_chars += length
+    if batch:
+        yield batch
+
+
 class RAG:
-    def __init__(self, modeltype="doubao"):
+    def __init__(self, modeltype="doubao", merge_threshold=16, index_type="flat", index_params=None,
+                 mmap_index=False):
         """
         初始化RAG类，加载配置并设置默认参数
         
         Args:
             modeltype (str): 模型类型，可选值为"doubao"或"zhipu"，默认为"doubao"
+            merge_threshold (int): 向量库增量日志累计多少条后在后台合并为新的快照，默认为16
+            index_type (str): rebuild_index默认构建的索引类型，可选值为"flat"、"ivf_flat"、"hnsw"、"ivf_pq"，默认为"flat"
+            index_params (dict, optional): 索引构建参数（如nlist、pq_m、pq_nbits、hnsw_m），缺省按数据规模取默认值
+            mmap_index (bool): 是否以内存映射只读模式加载向量库（文档从SQLite按需读取），
+                适合只检索的服务进程，第一次写入时自动切换为内存模式，默认为False
         """
         logger.info(f"初始化RAG类，模型类型: {modeltype}...")
         
@@ -139,10 +239,16 @@ class RAG:
         else:
             raise ValueError(f"不支持的模型类型: {modeltype}，可选值为'doubao'或'zhipu'")
         
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"不支持的索引类型: {index_type}，可选值为{INDEX_TYPES}")
+        self.index_type = index_type
+        self.index_params = index_params or {}
+        
         self.vectorstore_info = {
             'path': self.vectorstore_path,
             'embedding_model': self.embedding_model,
             'type': 'FAISS',
+            'index_type': self.index_type,
             'documents_path': self.documents_path,
             'modeltype': self.modeltype
         }
@@ -173,6 +279,12 @@ class RAG:
         # 空的缓存检索句柄类属性
         self.vectorstore = None
         self.embeddings = None
+        # 向量库的增量持久化：添加文档只写入新增的向量段和文档日志
+        self.merge_threshold = merge_threshold
+        self.mmap_index = mmap_index
+        self.faiss_store = None
+        # 导入清单：记录已导入文件和文档块的内容摘要，用于跳过未变化的文件
+        self.ingest_manifest = None
         
         logger.info("RAG类初始化完成")
 
@@ -209,13 +321,16 @@ class RAG:
                 logger.info(f"初始化智谱AI嵌入模型: {model}")
                 self.embeddings = ZhipuAIEmbeddings(api_key=self.api_key, model=model)
             
-            # 创建空的向量库（需要至少一个文档）
-            # 这里创建一个示例文档作为占位符
-            dummy_doc = Document(page_content="向量库初始化文档", metadata={"source": "dummy"})
-            
-            # 创建向量库
+            # 创建空的Flat向量库，只需探测一次向量维度；
+            # 近似索引需要训练数据，导入文档后再用rebuild_index构建
             logger.info("创建空向量库...")
-            vectorstore = FAISS.from_documents([dummy_doc], self.embeddings)
+            dimension = len(self.embeddings.embed_query("向量维度探测"))
+            vectorstore = FAISS(
+                embedding_function=self.embeddings,
+                index=faiss.IndexFlatL2(dimension),
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={}
+            )
             
             # 保存向量库
             vectorstore.save_local(path)
@@ -261,13 +376,11 @@ class RAG:
                     logger.info(f"初始化智谱AI嵌入模型: {self.embedding_model}")
                     self.embeddings = ZhipuAIEmbeddings(api_key=self.api_key, model=self.embedding_model)
             
-            # 加载向量库
+            # 加载向量库（基线快照 + 重放增量日志）
             logger.info(f"加载向量库: {self.vectorstore_path}")
-            self.vectorstore = FAISS.load_local(
-                self.vectorstore_path,
-                self.embeddings,
-                allow_dangerous_deserialization=True  # 注意：生产环境中应谨慎使用
-            )
+            self.faiss_store = IncrementalFAISSStore(self.vectorstore_path, merge_threshold=self.merge_threshold)
+            self.vectorstore = self.faiss_store.load(self.embeddings, mmap=self.mmap_index)
+            self.ingest_manifest = IngestManifest(self.vectorstore_path)
             
             logger.info("向量库加载成功")
             return self.vectorstore
@@ -343,12 +456,16 @@ class RAG:
             logger.error(f"检查向量库失败: {str(e)}")
             return False
     
-    def add_document_to_vectorstore(self, file_path):
+    def add_document_to_vectorstore(self, file_path, force=False):
         """
         先检查向量库是否存在，存在则将指定文件加入向量库
         
+        内容未变化的文件直接跳过；文件有变化时只删除失效的文档块、添加新的文档块；
+        与已导入文档块文本相同的块复用已有向量，不再重复生成。
+        
         Args:
             file_path (str): 要添加的文件路径
+            force (bool): 文件未变化时是否仍重新导入，默认为False
             
         Returns:
             bool: 添加是否成功
@@ -372,37 +489,51 @@ class RAG:
                 logger.error("无法获取向量库实例")
                 return False
             
-            # 根据文件类型选择合适的加载器
+            # 检查文件类型
             file_ext = os.path.splitext(file_path)[1].lower()
-            if file_ext == '.txt':
-                loader = TextLoader(file_path, encoding='utf-8')
-            elif file_ext == '.pdf':
-                loader = PyPDFLoader(file_path)
-            elif file_ext in ['.docx', '.doc']:
-                loader = Docx2txtLoader(file_path)
-            else:
+            if file_ext not in SUPPORTED_EXTENSIONS:
                 logger.error(f"不支持的文件类型: {file_ext}")
                 return False
             
-            # 加载文档
-            logger.info(f"加载文档: {file_path}")
-            documents = loader.load()
+            # 对比导入清单，未变化的文件直接跳过
+            self._adopt_legacy_chunks()
+            status, digest = self.ingest_manifest.check(file_path)
+            if status == FILE_UNCHANGED and not force:
+                self.ingest_manifest.save()
+                logger.info(f"文件未变化，跳过: {file_path}")
+                return True
             
-            # 分割文档
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=500,
-                chunk_overlap=50
-            )
-            logger.info("分割文档...")
-            split_docs = text_splitter.split_documents(documents)
+            # 加载并分割文档
+            logger.info(f"加载文档: {file_path}")
+            split_docs = load_and_split_file(file_path)
             logger.info(f"文档分割完成，共{len(split_docs)}个chunk")
             
-            # 添加到向量库
-            logger.info("将文档添加到向量库...")
-            vectorstore.add_documents(split_docs)
+            # 与上次导入的文档块对比：文本相同的保留，失效的删除，只为新增的块生成向量
+            kept, stale_ids, new_entries = self._plan_file_update(split_docs, self.ingest_manifest.chunks(file_path))
+            vectors_by_hash = self._lookup_vectors({chunk_hash for _, chunk_hash, _ in new_entries})
+            missing = {}
+            for doc, chunk_hash, _ in new_entries:
+                if chunk_hash not in vectors_by_hash:
+                    missing.setdefault(chunk_hash, doc)
+            for batch in iter_embedding_batches(list(missing.values())):
+                vectors = self._embed_with_retry([doc.page_content for doc in batch])
+                for doc, vector in zip(batch, vectors):
+                    vectors_by_hash[text_digest(doc.page_content)] = vector
+            logger.info(f"保留{len(kept)}个chunk，删除{len(stale_ids)}个失效chunk，新增{len(new_entries)}个chunk"
+                        f"（新生成向量{len(missing)}个）")
             
-            # 保存更新后的向量库
-            vectorstore.save_local(self.vectorstore_path)
+            # 只把本文件变化的向量和文档块追加到磁盘
+            logger.info("将文档添加到向量库...")
+            self.faiss_store.delete(stale_ids)
+            self.faiss_store.add_embedded(
+                [doc for doc, _, _ in new_entries],
+                [vectors_by_hash[chunk_hash] for _, chunk_hash, _ in new_entries],
+                ids=[doc_id for _, _, doc_id in new_entries]
+            )
+            self.ingest_manifest.record(
+                file_path, digest, kept + [{'id': doc_id, 'hash': chunk_hash} for _, chunk_hash, doc_id in new_entries]
+            )
+            self.ingest_manifest.save()
             logger.info(f"文件成功添加到向量库并保存: {file_path}")
             
             return True
@@ -411,6 +542,362 @@ class RAG:
             logger.error(f"添加文件到向量库失败: {str(e)}")
             return False
     
+    def _chunks_by_source(self) -> Dict[str, List[Dict[str, str]]]:
+        """
+        按来源文件汇总向量库中的文档块（需遍历整个docstore），用于导入清单出现之前就已导入的文件
+        
+        Returns:
+            Dict[str, List[Dict[str, str]]]: 来源文件绝对路径 -> [{'id', 'hash'}, ...]
+        """
+        chunks = {}
+        docstore = self.vectorstore.docstore
+        for doc_id in self.vectorstore.index_to_docstore_id.values():
+            doc = docstore.search(doc_id)
+            if isinstance(doc, Document) and doc.metadata.get('source'):
+                source = os.path.abspath(doc.metadata['source'])
+                chunks.setdefault(source, []).append({'id': doc_id, 'hash': text_digest(doc.page_content)})
+        return chunks
+    
+    def _adopt_legacy_chunks(self):
+        """
+        导入清单文件还不存在时（清单功能之前创建的向量库），按来源扫描一次向量库，
+        把已导入文件的文档块登记进清单并保存；之后每次导入只查清单，不再遍历docstore
+        """
+        if self.ingest_manifest.exists:
+            return
+        start = time.time()
+        chunks_by_source = self._chunks_by_source()
+        self.ingest_manifest.adopt(chunks_by_source)
+        self.ingest_manifest.save()
+        logger.info(f"导入清单不存在，已从向量库登记{len(chunks_by_source)}个已导入文件，耗时{time.time() - start:.2f}秒")
+    
+    @staticmethod
+    def _plan_file_update(split_docs: List[Document], previous_chunks: List[Dict[str, str]]
+                          ) -> Tuple[List[Dict[str, str]], List[str], List[Tuple[Document, str, str]]]:
+        """
+        对比文件新的分块与上次导入的文档块
+        
+        Args:
+            split_docs (List[Document]): 新的分块
+            previous_chunks (List[Dict[str, str]]): 上次导入的文档块
+            
+        Returns:
+            Tuple: (保留的文档块, 失效的文档ID, 新增的(文档块, 文本摘要, 文档ID))
+        """
+        available = {}
+        for chunk in previous_chunks:
+            available.setdefault(chunk['hash'], []).append(chunk['id'])
+        kept, new_entries = [], []
+        for doc in split_docs:
+            chunk_hash = text_digest(doc.page_content)
+            ids = available.get(chunk_hash)
+            if ids:
+                kept.append({'id': ids.pop(), 'hash': chunk_hash})
+            else:
+                new_entries.append((doc, chunk_hash, str(uuid.uuid4())))
+        stale_ids = [doc_id for ids in available.values() for doc_id in ids]
+        return kept, stale_ids, new_entries
+    
+    def _lookup_vectors(self, hashes, known_ids: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """
+        为文本摘要查找已存入向量库的相同文本块，取回其向量
+        
+        Args:
+            hashes (Iterable[str]): 文本摘要
+            known_ids (Dict[str, str], optional): 额外的 文本摘要 -> 文档ID 映射（本次导入已加入的块）
+            
+        Returns:
+            Dict[str, Any]: 找到向量的 文本摘要 -> 向量
+        """
+        candidates = {}
+        for chunk_hash in hashes:
+            doc_id = (known_ids or {}).get(chunk_hash) or self.ingest_manifest.find_chunk(chunk_hash)
+            if doc_id:
+                candidates[chunk_hash] = doc_id
+        if not candidates:
+            return {}
+        vectors = self.faiss_store.get_vectors(list(candidates.values()))
+        return {chunk_hash: vector for chunk_hash, vector in zip(candidates, vectors) if vector is not None}
+    
+    def _embed_with_retry(self, texts: List[str], max_retries: int = 3) -> List[List[float]]:
+        """
+        生成一批文本的向量，失败时指数退避重试
+        
+        Args:
+            texts (List[str]): 文本列表
+            max_retries (int): 最多重试次数，默认为3
+            
+        Returns:
+            List[List[float]]: 向量列表
+        """
+        for attempt in range(max_retries + 1):
+            try:
+                return self.embeddings.embed_documents(texts)
+            except Exception as e:
+                if attempt >= max_retries:
+                    raise
+                wait_seconds = 0.5 * (2 ** attempt)
+                logger.warning(f"生成向量失败，{wait_seconds:.1f}秒后重试: {e}")
+                time.sleep(wait_seconds)
+    
+    def ingest_directory(self, path, recursive=True, max_workers=None, batch_size=64, max_batch_chars=20000,
+                         embed_concurrency=4, max_retries=3, block_size=2048, force=False,
+                         progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        批量导入目录中的文档：进程池并行加载和分块，分批并发生成向量，
+        按大块加入内存中的向量库，全部完成后只保存一次
+        
+        与add_document_to_vectorstore一样按导入清单跳过未变化的文件、替换失效的文档块，
+        本次导入中文本相同的块只生成一次向量。
+        
+        Args:
+            path (str): 文档目录
+            recursive (bool): 是否包含子目录，默认为True
+            max_workers (int, optional): 加载分块的进程数，默认为CPU核数
+            batch_size (int): 每个嵌入请求最多条数，默认为64
+            max_batch_chars (int): 每个嵌入请求最多总字数，默认为20000
+            embed_concurrency (int): 同时进行的嵌入请求数，默认为4
+            max_retries (int): 嵌入请求失败的重试次数，默认为3
+            block_size (int): 攒够多少个向量加入一次向量库，默认为2048
+            force (bool): 是否重新导入未变化的文件，默认为False
+            progress_callback (Callable, optional): 进度回调，参数为当前统计信息
+            
+        Returns:
+            dict or None: 导入统计信息，向量库不可用时返回None
+        """
+        logger.info(f"准备批量导入目录: {path}")
+        if not os.path.isdir(path):
+            logger.error(f"目录不存在: {path}")
+            return None
+        if not self.check_vectorstore_exists():
+            logger.error("向量库不存在，请先创建向量库")
+            return None
+        if self.get_vectorstore() is None:
+            logger.error("无法获取向量库实例")
+            return None
+        
+        start = time.time()
+        stats = {
+            'files': 0, 'files_skipped': 0, 'files_loaded': 0, 'files_failed': 0,
+            'chunks': 0, 'chunks_kept': 0, 'chunks_removed': 0, 'chunks_reused': 0,
+            'chunks_embedded': 0, 'chunks_failed': 0, 'embed_requests': 0, 'vectors_added': 0
+        }
+        
+        # 收集文件，按导入清单跳过未变化的文件
+        self._adopt_legacy_chunks()
+        files = {}
+        for root, dirs, names in os.walk(path):
+            for name in sorted(names):
+                if os.path.splitext(name)[1].lower() not in SUPPORTED_EXTENSIONS:
+                    continue
+                file_path = os.path.join(root, name)
+                stats['files'] += 1
+                status, digest = self.ingest_manifest.check(file_path)
+                if status == FILE_UNCHANGED and not force:
+                    stats['files_skipped'] += 1
+                    continue
+                files[file_path] = (status, digest)
+            if not recursive:
+                break
+        last_report = [start]
+        
+        def report(force_report=False):
+            now = time.time()
+            if not force_report and now - last_report[0] < 2.0:
+                return
+            last_report[0] = now
+            elapsed = max(now - start, 1e-6)
+            stats['seconds'] = round(elapsed, 2)
+            stats['chunks_per_second'] = round(stats['chunks_embedded'] / elapsed, 1)
+            logger.info(f"导入进度: 文件{stats['files_loaded'] + stats['files_failed']}/{len(files)}，"
+                        f"已嵌入{stats['chunks_embedded']}块，{stats['chunks_per_second']}块/秒")
+            if progress_callback is not None:
+                progress_callback(dict(stats))
+        
+        # 本次导入的文档块：文件 -> (保留的块, 新增的(文档块, 摘要, ID))；已加入向量库的ID
+        file_plans = {}
+        added_ids = set()
+        # 本次已加入向量库的 摘要 -> 文档ID；已生成、尚未加入的 摘要 -> 向量；等待向量的 摘要 -> [(文档块, ID)]
+        run_ids = {}
+        fresh = {}
+        waiting = {}
+        failed_files = set()
+        # 各文件失效的文档块在全部加入后一次删除，删除前仍可复用其向量
+        stale = []
+        block = []
+        
+        def add_block(force_add=False):
+            if block and (force_add or len(block) >= block_size):
+                self.faiss_store.add_in_memory([doc for doc, _, _ in block], [vector for _, _, vector in block],
+                                               ids=[doc_id for _, doc_id, _ in block])
+                for doc, doc_id, _ in block:
+                    added_ids.add(doc_id)
+                    run_ids.setdefault(text_digest(doc.page_content), doc_id)
+                stats['vectors_added'] += len(block)
+                block.clear()
+                fresh.clear()
+        
+        in_flight = {}
+        
+        def collect(done):
+            for future in done:
+                batch_hashes, batch = in_flight.pop(future)
+                try:
+                    vectors = future.result()
+                except Exception as e:
+                    for chunk_hash in batch_hashes:
+                        for doc, _ in waiting.pop(chunk_hash, []):
+                            stats['chunks_failed'] += 1
+                            failed_files.add(doc.metadata.get('source'))
+                    logger.error(f"嵌入请求重试后仍失败，丢弃{len(batch)}个chunk: {e}")
+                    continue
+                for chunk_hash, vector in zip(batch_hashes, vectors):
+                    fresh[chunk_hash] = vector
+                    for doc, doc_id in waiting.pop(chunk_hash, []):
+                        block.append((doc, doc_id, vector))
+                stats['chunks_embedded'] += len(batch)
+            add_block()
+            report()
+        
+        with ProcessPoolExecutor(max_workers=max_workers) as load_pool, \
+                ThreadPoolExecutor(max_workers=embed_concurrency, thread_name_prefix="RAGEmbed") as embed_pool:
+            load_futures = {load_pool.submit(load_and_split_file, file_path): file_path for file_path in files}
+            for load_future in as_completed(load_futures):
+                file_path = load_futures[load_future]
+                try:
+                    split_docs = load_future.result()
+                except Exception as e:
+                    stats['files_failed'] += 1
+                    logger.error(f"加载文件失败: {file_path}: {e}")
+                    continue
+                stats['files_loaded'] += 1
+                stats['chunks'] += len(split_docs)
+                
+                # 删除失效的文档块，新增的块先复用已有向量，其余排队生成
+                kept, stale_ids, new_entries = self._plan_file_update(split_docs, self.ingest_manifest.chunks(file_path))
+                file_plans[file_path] = (kept, new_entries)
+                stats['chunks_kept'] += len(kept)
+                stats['chunks_removed'] += len(stale_ids)
+                stale.extend(stale_ids)
+                
+                lookup = {chunk_hash for _, chunk_hash, _ in new_entries
+                          if chunk_hash not in waiting and chunk_hash not in fresh}
+                reused = self._lookup_vectors(lookup, run_ids)
+                to_embed = {}
+                for doc, chunk_hash, doc_id in new_entries:
+                    vector = fresh.get(chunk_hash)
+                    if vector is None:
+                        vector = reused.get(chunk_hash)
+                        if vector is not None:
+                            stats['chunks_reused'] += 1
+                    if vector is not None:
+                        block.append((doc, doc_id, vector))
+                    elif chunk_hash in waiting:
+                        waiting[chunk_hash].append((doc, doc_id))
+                    else:
+                        waiting[chunk_hash] = [(doc, doc_id)]
+                        to_embed[chunk_hash] = doc
+                add_block()
+                
+                for batch in iter_embedding_batches(list(to_embed.values()), batch_size, max_batch_chars):
+                    # 限制同时在途的嵌入请求数，避免一次性提交全部批次
+                    while len(in_flight) >= embed_concurrency:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    batch_hashes = [text_digest(doc.page_content) for doc in batch]
+                    future = embed_pool.submit(self._embed_with_retry, [doc.page_content for doc in batch], max_retries)
+                    in_flight[future] = (batch_hashes, batch)
+                    stats['embed_requests'] += 1
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+        
+        add_block(force_add=True)
+        self.faiss_store.delete_in_memory(stale)
+        # 全部加入后只保存一次
+        self.faiss_store.merge()
+        
+        # 记录导入清单；有块嵌入失败的文件不记录摘要，下次导入时按有变化处理
+        for file_path, (kept, new_entries) in file_plans.items():
+            status, digest = files[file_path]
+            chunks = kept + [{'id': doc_id, 'hash': chunk_hash}
+                             for _, chunk_hash, doc_id in new_entries if doc_id in added_ids]
+            self.ingest_manifest.record(file_path, None if file_path in failed_files else digest, chunks)
+        self.ingest_manifest.save()
+        
+        report(force_report=True)
+        logger.info(f"批量导入完成: {stats}")
+        return stats
+    
+    def rebuild_index(self, index_type=None, index_params=None, sample_size=100000, evaluate=True,
+                      target_recall=0.95, k=10):
+        """
+        用指定的索引类型重建向量库索引：在抽样向量上训练后加入全部向量，
+        评估不同检索参数下的召回率和延迟，选出达到目标召回率的最小参数后保存
+        
+        Args:
+            index_type (str, optional): 索引类型，默认为初始化时的index_type
+            index_params (dict, optional): 索引构建参数，默认为初始化时的index_params
+            sample_size (int): 训练抽样数，默认为100000
+            evaluate (bool): 是否评估召回率和延迟，默认为True
+            target_recall (float): 选择检索参数的目标recall@k，默认为0.95
+            k (int): 评估时的k，默认为10
+            
+        Returns:
+            dict or None: 重建报告（索引描述、大小、评估结果、选中的检索参数），失败返回None
+        """
+        index_type = index_type or self.index_type
+        if index_type not in INDEX_TYPES:
+            logger.error(f"不支持的索引类型: {index_type}，可选值为{INDEX_TYPES}")
+            return None
+        vectorstore = self.get_vectorstore()
+        if vectorstore is None:
+            logger.error("无法获取向量库实例")
+            return None
+        
+        # 重建需要读写完整的索引和文档
+        self.faiss_store.ensure_writable()
+        # 旧版本创建向量库时写入的占位文档
+        placeholder_ids = [doc_id for doc_id, doc in vectorstore.docstore._dict.items()
+                           if doc.metadata.get("source") == "dummy" and doc.page_content == "向量库初始化文档"]
+        if placeholder_ids:
+            self.faiss_store.delete(placeholder_ids)
+            logger.info("已删除向量库初始化占位文档")
+        
+        metric = faiss_metric(vectorstore)
+        report = {'index_type': index_type, 'old_bytes': index_bytes(vectorstore.index)}
+        
+        def build(vectors):
+            index = build_index(index_type, vectors, metric, sample_size, index_params or self.index_params)
+            report['vectors'] = int(vectors.shape[0])
+            report['bytes'] = index_bytes(index)
+            if evaluate:
+                rows = evaluate_index(index, vectors, metric, k=k)
+                chosen = choose_search_param(rows, target_recall)
+                report['evaluation'] = rows
+                report['chosen'] = chosen
+                for row in rows:
+                    logger.info(f"  {row['param'] or 'exact'}={row['value']}: recall@{k}={row['recall']:.4f}，"
+                                f"单次检索{row['latency_ms']:.3f}ms")
+                if chosen and chosen['value'] is not None:
+                    set_search_param(index, chosen['value'])
+                    logger.info(f"选用{chosen['param']}={chosen['value']}（recall@{k}={chosen['recall']:.4f}）")
+            return index
+        
+        start = time.time()
+        try:
+            self.faiss_store.replace_index(build)
+        except Exception as e:
+            logger.error(f"重建索引失败: {str(e)}")
+            return None
+        report['seconds'] = round(time.time() - start, 2)
+        self.index_type = index_type
+        self.vectorstore_info['index_type'] = index_type
+        logger.info(f"索引重建完成: {index_type}，{report['vectors']}条向量，"
+                    f"{report['old_bytes'] / 1024 / 1024:.1f}MB -> {report['bytes'] / 1024 / 1024:.1f}MB，"
+                    f"耗时{report['seconds']}秒")
+        return report
+    
     def search_knowledge_base(self, query, k=3):
         """
         检索知识库，返回与查询相关的文档和来源文件
@@ -468,6 +955,17 @@ class RAG:
         except Exception as e:
             logger.error(f"检索知识库失败: {str(e)}")
             return None
+    
+    def close(self, merge=True):
+        """
+        等待后台合并结束，并把剩余的增量日志合并进向量库快照
+        
+        Args:
+            merge (bool): 是否在关闭前合并剩余日志，默认为True
+        """
+        if self.faiss_store is not None:
+            self.faiss_store.close(merge=merge)
+            logger.info(f"向量库已关闭: {self.faiss_store.stats()}")
 
 # 添加新函数：将RAG包装成langgraph的图节点
 def rag_node(state: Dict[str, Any], rag_instance: RAG = None, k: int = 3) -> Dict[str, Any]:
@@ -157,12 +157,14 @@ def test_memory_persistence():
     memory_file = os.path.join(agent1.memory_dir, f"{conversation_id}.json")
     assert os.path.exists(memory_file), "记忆文件未创建"
     
-    # 检查文件内容
+    # 检查文件内容（快照+追加日志）
     try:
         with open(memory_file, 'r', encoding='utf-8') as f:
             data = json.load(f)
         assert 'conversations' in data, "记忆文件格式错误"
-        assert len(data['conversations']) > 0, "记忆文件内容为空"
+        agent1.memory_journal.flush()
+        conversations = agent1.memory_journal.load(conversation_id)
+        assert len(conversations) > 0, "记忆文件内容为空"
         logger.info("记忆文件创建和内容验证通过")
     except Exception as e:
         logger.error(f"记忆文件验证失败: {e}")
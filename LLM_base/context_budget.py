@@ -0,0 +1,211 @@
+import os
+import json
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# tiktoken用于统计token数，未安装时按字符数估算
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    logging.warning("tiktoken库未安装，将按字符数估算token")
+    TIKTOKEN_AVAILABLE = False
+
+
+def format_turns(conversations: List[Dict[str, str]]) -> str:
+    """
+    将对话列表格式化为与ConversationBufferMemory一致的history文本
+
+    Args:
+        conversations (List[Dict[str, str]]): {'Human': ..., 'AI': ...} 列表
+
+    Returns:
+        str: history文本
+    """
+    return "\n".join(f"Human: {conv['Human']}\nAI: {conv['AI']}" for conv in conversations)
+
+
+class ContextBudgeter:
+    """
+    按token预算构建对话历史
+
+    最近的若干轮对话原样保留，更早的对话按批折叠进滚动摘要。
+    摘要保存在记忆文件旁的 {conversation_id}.summary.json 中，重新加载时无需重算。
+    """
+
+    def __init__(self, memory_dir: str, max_history_tokens: int = 2000, keep_recent_turns: int = 6,
+                 summary_batch_turns: int = 4, encoding_name: str = "cl100k_base"):
+        """
+        初始化上下文预算器
+
+        Args:
+            memory_dir (str): 记忆文件目录，摘要文件保存在此
+            max_history_tokens (int): history部分的token上限，默认为2000
+            keep_recent_turns (int): 原样保留的最近对话轮数，默认为6
+            summary_batch_turns (int): 窗口外累积多少轮后折叠进摘要，默认为4
+            encoding_name (str): tiktoken编码名称，默认为cl100k_base
+        """
+        self.memory_dir = memory_dir
+        self.max_history_tokens = max_history_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.summary_batch_turns = summary_batch_turns
+
+        self._encoding = None
+        if TIKTOKEN_AVAILABLE:
+            try:
+                self._encoding = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                logger.warning(f"加载tiktoken编码失败，将按字符数估算token: {e}")
+
+        self._lock = threading.Lock()
+        # conversation_id -> {'summary': str, 'summarized_turns': int}
+        self._summaries: Dict[str, Dict] = {}
+
+    def count_tokens(self, text: str) -> int:
+        """
+        统计文本的token数
+
+        Args:
+            text (str): 文本
+
+        Returns:
+            int: token数
+        """
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        # 中文约每字一个token
+        return len(text)
+
+    def _summary_path(self, conversation_id: str) -> str:
+        return os.path.join(self.memory_dir, f"{conversation_id}.summary.json")
+
+    def get_summary(self, conversation_id: str) -> Dict:
+        """
+        获取对话的滚动摘要，首次访问时从文件加载
+
+        Args:
+            conversation_id (str): 对话ID
+
+        Returns:
+            Dict: {'summary': str, 'summarized_turns': int}
+        """
+        with self._lock:
+            state = self._summaries.get(conversation_id)
+            if state is not None:
+                return state
+            state = {'summary': '', 'summarized_turns': 0}
+            file_path = self._summary_path(conversation_id)
+            if os.path.exists(file_path):
+                try:
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    state = {
+                        'summary': data.get('summary', ''),
+                        'summarized_turns': int(data.get('summarized_turns', 0))
+                    }
+                except Exception as e:
+                    logger.error(f"加载对话摘要失败: {file_path}: {e}")
+            self._summaries[conversation_id] = state
+            return state
+
+    def _save_summary(self, conversation_id: str, state: Dict):
+        """原子性写入摘要文件"""
+        file_path = self._summary_path(conversation_id)
+        temp_file = file_path + '.tmp'
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(temp_file, file_path)
+        except Exception as e:
+            logger.error(f"保存对话摘要失败: {file_path}: {e}")
+
+    def forget(self, conversation_id: str):
+        """
+        释放内存中的摘要（文件保留）
+
+        Args:
+            conversation_id (str): 对话ID
+        """
+        with self._lock:
+            self._summaries.pop(conversation_id, None)
+
+    def build_history(self, conversation_id: str, conversations: List[Dict[str, str]]) -> str:
+        """
+        在token预算内构建history文本：摘要 + 尚未折叠的对话（超预算时从最早处丢弃）
+
+        Args:
+            conversation_id (str): 对话ID
+            conversations (List[Dict[str, str]]): 完整对话列表
+
+        Returns:
+            str: history文本
+        """
+        state = self.get_summary(conversation_id)
+        summarized = state['summarized_turns']
+        if summarized > len(conversations):
+            # 记忆文件被清理过，摘要失效
+            logger.warning(f"对话摘要与记忆不一致，忽略摘要: {conversation_id}")
+            summarized = 0
+            summary = ''
+        else:
+            summary = state['summary']
+
+        parts = []
+        budget = self.max_history_tokens
+        if summary:
+            summary_text = f"【之前的对话摘要】{summary}"
+            budget -= self.count_tokens(summary_text)
+            parts.append(summary_text)
+
+        # 从最新一轮往前取，直到用完预算；至少保留最近一轮
+        recent = []
+        for conv in reversed(conversations[summarized:]):
+            turn_text = format_turns([conv])
+            cost = self.count_tokens(turn_text)
+            if recent and cost > budget:
+                break
+            recent.append(turn_text)
+            budget -= cost
+        if len(recent) < len(conversations) - summarized:
+            logger.info(f"history超出token预算，丢弃了{len(conversations) - summarized - len(recent)}轮较早对话")
+        parts.extend(reversed(recent))
+        return "\n".join(parts)
+
+    def maybe_fold(self, conversation_id: str, conversations: List[Dict[str, str]],
+                   summarize_fn: Callable[[str, List[Dict[str, str]]], Optional[str]]) -> bool:
+        """
+        窗口外的对话累积到一批时，增量折叠进滚动摘要并持久化
+
+        Args:
+            conversation_id (str): 对话ID
+            conversations (List[Dict[str, str]]): 完整对话列表
+            summarize_fn (Callable): 摘要函数，参数为(旧摘要, 待折叠对话)，返回新摘要，失败返回None
+
+        Returns:
+            bool: 是否更新了摘要
+        """
+        state = self.get_summary(conversation_id)
+        summarized = state['summarized_turns']
+        previous = state['summary']
+        if summarized > len(conversations):
+            summarized, previous = 0, ''
+        fold_end = len(conversations) - self.keep_recent_turns
+        if fold_end - summarized < self.summary_batch_turns:
+            return False
+
+        new_summary = summarize_fn(previous, conversations[summarized:fold_end])
+        if not new_summary:
+            return False
+
+        new_state = {'summary': new_summary.strip(), 'summarized_turns': fold_end}
+        with self._lock:
+            self._summaries[conversation_id] = new_state
+        self._save_summary(conversation_id, new_state)
+        logger.info(f"对话摘要已更新: {conversation_id}，已折叠{fold_end}轮")
+        return True
@@ -0,0 +1,83 @@
+import os
+import sys
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM_base.context_budget import ContextBudgeter, format_turns
+
+CONVERSATION = "budget_test"
+
+
+def make_budgeter(tmp_path, **kwargs) -> ContextBudgeter:
+    """按字符数计token，结果不依赖tiktoken是否安装"""
+    budgeter = ContextBudgeter(str(tmp_path), **kwargs)
+    budgeter._encoding = None
+    return budgeter
+
+
+def turns(n, start=0):
+    return [{'Human': f"q{i}", 'AI': f"a{i}"} for i in range(start, start + n)]
+
+
+def test_history_within_budget_is_unchanged(tmp_path):
+    budgeter = make_budgeter(tmp_path)
+    conversations = turns(3)
+    assert budgeter.build_history(CONVERSATION, conversations) == format_turns(conversations)
+
+
+def test_oldest_turns_are_dropped_over_budget(tmp_path):
+    turn_tokens = len(format_turns(turns(1)))
+    budgeter = make_budgeter(tmp_path, max_history_tokens=turn_tokens * 2)
+    conversations = turns(5)
+    assert budgeter.build_history(CONVERSATION, conversations) == format_turns(conversations[-2:])
+
+
+def test_latest_turn_is_kept_even_if_too_long(tmp_path):
+    budgeter = make_budgeter(tmp_path, max_history_tokens=5)
+    conversations = turns(2) + [{'Human': "长" * 20, 'AI': "答" * 20}]
+    assert budgeter.build_history(CONVERSATION, conversations) == format_turns(conversations[-1:])
+
+
+def test_fold_waits_for_a_full_batch(tmp_path):
+    budgeter = make_budgeter(tmp_path, keep_recent_turns=2, summary_batch_turns=3)
+    calls = []
+
+    def summarize(previous, batch):
+        calls.append((previous, [conv['Human'] for conv in batch]))
+        return "摘要" + "".join(conv['Human'] for conv in batch)
+
+    assert not budgeter.maybe_fold(CONVERSATION, turns(4), summarize)
+    assert calls == []
+    assert budgeter.maybe_fold(CONVERSATION, turns(5), summarize)
+    assert calls == [('', ["q0", "q1", "q2"])]
+
+    # 下一批只折叠新超出窗口的对话，并带上旧摘要
+    assert budgeter.maybe_fold(CONVERSATION, turns(8), summarize)
+    assert calls[-1] == ("摘要q0q1q2", ["q3", "q4", "q5"])
+
+
+def test_summary_is_persisted_and_used(tmp_path):
+    budgeter = make_budgeter(tmp_path, keep_recent_turns=2, summary_batch_turns=3)
+    conversations = turns(5)
+    budgeter.maybe_fold(CONVERSATION, conversations, lambda previous, batch: "早先聊了天气")
+
+    reopened = make_budgeter(tmp_path, keep_recent_turns=2, summary_batch_turns=3)
+    assert reopened.get_summary(CONVERSATION) == {'summary': "早先聊了天气", 'summarized_turns': 3}
+    assert reopened.build_history(CONVERSATION, conversations) == \
+        "【之前的对话摘要】早先聊了天气\n" + format_turns(conversations[3:])
+
+
+def test_failed_summary_keeps_previous_state(tmp_path):
+    budgeter = make_budgeter(tmp_path, keep_recent_turns=2, summary_batch_turns=3)
+    assert not budgeter.maybe_fold(CONVERSATION, turns(5), lambda previous, batch: None)
+    assert budgeter.get_summary(CONVERSATION) == {'summary': '', 'summarized_turns': 0}
+    assert not os.path.exists(os.path.join(str(tmp_path), f"{CONVERSATION}.summary.json"))
+
+
+def test_stale_summary_is_ignored(tmp_path):
+    budgeter = make_budgeter(tmp_path, keep_recent_turns=2, summary_batch_turns=3)
+    budgeter.maybe_fold(CONVERSATION, turns(8), lambda previous, batch: "旧摘要")
+    # 记忆被清理后只剩两轮，摘要覆盖的轮数超过现有对话
+    conversations = turns(2, start=100)
+    assert budgeter.build_history(CONVERSATION, conversations) == format_turns(conversations)
@@ -0,0 +1,238 @@
+import os
+import sqlite3
+import logging
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# xxhash用于计算文本摘要，未安装时退回blake2b
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    logging.warning("xxhash库未安装，嵌入缓存将使用blake2b计算键")
+    XXHASH_AVAILABLE = False
+
+# 默认的磁盘缓存位置
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'embeddings.sqlite')
+
+
+def text_digest(text: str) -> str:
+    """
+    计算文本的内容摘要
+
+    Args:
+        text (str): 文本
+
+    Returns:
+        str: 十六进制摘要
+    """
+    data = text.encode('utf-8')
+    if XXHASH_AVAILABLE:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    以 (模型, 维度, 文本摘要) 为键的两级嵌入向量缓存
+
+    内存层为按条数限制的LRU；磁盘层为SQLite，向量以float32二进制存储，
+    进程重启后仍可复用。disk_path为None时只使用内存层。
+    """
+
+    def __init__(self, disk_path: Optional[str] = DEFAULT_CACHE_PATH, max_memory_entries: int = 10000):
+        """
+        初始化嵌入缓存
+
+        Args:
+            disk_path (str, optional): SQLite缓存文件路径，None表示不落盘
+            max_memory_entries (int): 内存层最多缓存的向量数，默认为10000
+        """
+        self.disk_path = disk_path
+        self.max_memory_entries = max_memory_entries
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._conn = None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if disk_path:
+            try:
+                os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+                self._conn = sqlite3.connect(disk_path, check_same_thread=False)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+                )
+                self._conn.commit()
+                logger.info(f"嵌入缓存磁盘层已打开: {disk_path}")
+            except Exception as e:
+                logger.error(f"打开嵌入缓存磁盘层失败，仅使用内存缓存: {e}")
+                self._conn = None
+
+    @staticmethod
+    def make_key(model: str, dims: Optional[int], text: str) -> str:
+        """
+        构造缓存键
+
+        Args:
+            model (str): 嵌入模型名称
+            dims (int, optional): 向量维度，None表示模型默认维度
+            text (str): 文本
+
+        Returns:
+            str: 缓存键
+        """
+        return f"{model}:{dims or 0}:{text_digest(text)}"
+
+    def _remember(self, key: str, vector: List[float]):
+        """放入内存层并按容量淘汰（调用方需持有锁）"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """
+        批量查询向量，先查内存层再查磁盘层
+
+        Args:
+            keys (List[str]): 缓存键列表
+
+        Returns:
+            List[Optional[List[float]]]: 与keys一一对应，未命中为None
+        """
+        results: List[Optional[List[float]]] = [None] * len(keys)
+        with self._lock:
+            disk_lookup: Dict[str, List[int]] = {}
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = vector
+                    self.memory_hits += 1
+                else:
+                    disk_lookup.setdefault(key, []).append(i)
+
+            if disk_lookup and self._conn is not None:
+                lookup_keys = list(disk_lookup)
+                # SQLite单条语句的参数个数有限，分批查询
+                for start in range(0, len(lookup_keys), 500):
+                    batch = lookup_keys[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    try:
+                        rows = self._conn.execute(
+                            f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                        ).fetchall()
+                    except Exception as e:
+                        logger.error(f"读取嵌入缓存失败: {e}")
+                        rows = []
+                    for key, blob in rows:
+                        vector = array('f', blob).tolist()
+                        self._remember(key, vector)
+                        for i in disk_lookup.pop(key):
+                            results[i] = vector
+                            self.disk_hits += 1
+
+            self.misses += sum(len(indexes) for indexes in disk_lookup.values())
+        return results
+
+    def put_many(self, keys: List[str], vectors: List[List[float]]):
+        """
+        批量写入向量到内存层和磁盘层
+
+        Args:
+            keys (List[str]): 缓存键列表
+            vectors (List[List[float]]): 向量列表
+        """
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                self._remember(key, list(vector))
+            if self._conn is not None:
+                try:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                        [(key, array('f', vector).tobytes()) for key, vector in zip(keys, vectors)]
+                    )
+                    self._conn.commit()
+                except Exception as e:
+                    logger.error(f"写入嵌入缓存失败: {e}")
+
+    def embed(self, model: str, dims: Optional[int], texts: List[str],
+              embed_fn: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """
+        带缓存的批量嵌入：命中的直接返回，未命中的（去重后）一次性交给embed_fn
+
+        Args:
+            model (str): 嵌入模型名称
+            dims (int, optional): 向量维度
+            texts (List[str]): 文本列表
+            embed_fn (Callable): 实际生成向量的函数，失败时应抛出异常（失败结果不会被缓存）
+
+        Returns:
+            List[List[float]]: 与texts一一对应的向量
+        """
+        keys = [self.make_key(model, dims, text) for text in texts]
+        vectors = self.get_many(keys)
+
+        # 未命中的文本去重后一次请求
+        missing: Dict[str, str] = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None and key not in missing:
+                missing[key] = text
+        if missing:
+            missing_keys = list(missing)
+            new_vectors = embed_fn([missing[key] for key in missing_keys])
+            self.put_many(missing_keys, new_vectors)
+            fresh = dict(zip(missing_keys, new_vectors))
+            vectors = [vector if vector is not None else fresh[key] for key, vector in zip(keys, vectors)]
+        return vectors
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取缓存统计信息
+
+        Returns:
+            Dict[str, int]: 内存命中、磁盘命中、未命中次数和内存层大小
+        """
+        with self._lock:
+            return {
+                'memory_entries': len(self._memory),
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses
+            }
+
+    def close(self):
+        """关闭磁盘层连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_default_cache: Optional[EmbeddingCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_embedding_cache() -> EmbeddingCache:
+    """
+    获取进程内共享的默认嵌入缓存（MilvusRAG和RAG共用）
+
+    Returns:
+        EmbeddingCache: 默认缓存实例
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache()
+        return _default_cache
@@ -0,0 +1,85 @@
+import os
+import sys
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM_base.embedding_cache import EmbeddingCache
+
+MODEL = "test-model"
+
+
+class CountingEmbedder:
+    """记录每次请求的文本，向量由文本长度确定"""
+
+    def __init__(self):
+        self.calls = []
+        self.available = True
+
+    def __call__(self, texts):
+        if not self.available:
+            raise ConnectionError("embedding API down")
+        self.calls.append(list(texts))
+        return [[float(len(text)), 0.5] for text in texts]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = EmbeddingCache(disk_path=str(tmp_path / "embeddings.sqlite"))
+    yield cache
+    cache.close()
+
+
+def test_missing_texts_are_embedded_once(cache):
+    embedder = CountingEmbedder()
+    vectors = cache.embed(MODEL, 2, ["ab", "cde", "ab"], embedder)
+    assert vectors == [[2.0, 0.5], [3.0, 0.5], [2.0, 0.5]]
+    # 批内重复的文本只请求一次
+    assert embedder.calls == [["ab", "cde"]]
+
+    assert cache.embed(MODEL, 2, ["cde", "f"], embedder) == [[3.0, 0.5], [1.0, 0.5]]
+    assert embedder.calls[-1] == ["f"]
+    assert cache.stats()['memory_hits'] == 1
+
+
+def test_key_includes_model_and_dims():
+    assert EmbeddingCache.make_key(MODEL, 2, "hi") != EmbeddingCache.make_key("other", 2, "hi")
+    assert EmbeddingCache.make_key(MODEL, 2, "hi") != EmbeddingCache.make_key(MODEL, 4, "hi")
+    assert EmbeddingCache.make_key(MODEL, None, "hi") == EmbeddingCache.make_key(MODEL, 0, "hi")
+
+
+def test_disk_layer_survives_restart(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    first = EmbeddingCache(disk_path=path)
+    first.embed(MODEL, 2, ["hello"], CountingEmbedder())
+    first.close()
+
+    embedder = CountingEmbedder()
+    reopened = EmbeddingCache(disk_path=path)
+    assert reopened.embed(MODEL, 2, ["hello"], embedder) == [[5.0, 0.5]]
+    assert embedder.calls == []
+    assert reopened.stats()['disk_hits'] == 1
+    reopened.close()
+
+
+def test_memory_layer_is_bounded():
+    cache = EmbeddingCache(disk_path=None, max_memory_entries=2)
+    embedder = CountingEmbedder()
+    cache.embed(MODEL, 2, ["a", "bb", "ccc"], embedder)
+    assert cache.stats()['memory_entries'] == 2
+    # 最早的条目已被淘汰，没有磁盘层时需要重新请求
+    cache.embed(MODEL, 2, ["a"], embedder)
+    assert embedder.calls[-1] == ["a"]
+
+
+def test_failed_embedding_is_not_cached(cache):
+    embedder = CountingEmbedder()
+    embedder.available = False
+    with pytest.raises(ConnectionError):
+        cache.embed(MODEL, 2, ["hello"], embedder)
+
+    embedder.available = True
+    assert cache.embed(MODEL, 2, ["hello"], embedder) == [[5.0, 0.5]]
+    assert embedder.calls == [["hello"]]
@@ -0,0 +1,470 @@
+import copy
+import math
+import time
+import uuid
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 可选的索引类型：flat为精确检索；ivf_flat按聚类分桶只搜索部分桶；
+# hnsw为图索引；ivf_pq在分桶基础上用乘积量化压缩向量，内存约为flat的 pq_m*pq_nbits/8 / (4*维度)
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+# 各类索引检索参数的扫描范围（用于召回率-延迟评估）
+SEARCH_PARAM_SWEEPS = {
+    "nprobe": [1, 2, 4, 8, 16, 32, 64, 128, 256],
+    "efSearch": [16, 32, 64, 128, 256, 512],
+}
+
+
+def faiss_metric(vectorstore: FAISS) -> int:
+    """
+    获取向量库距离策略对应的FAISS度量
+
+    Args:
+        vectorstore (FAISS): 向量库
+
+    Returns:
+        int: faiss.METRIC_L2 或 faiss.METRIC_INNER_PRODUCT
+    """
+    if vectorstore.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT:
+        return faiss.METRIC_INNER_PRODUCT
+    return faiss.METRIC_L2
+
+
+def default_index_params(index_type: str, n_vectors: int, dimension: int) -> Dict[str, int]:
+    """
+    按数据规模给出索引的默认构建参数
+
+    Args:
+        index_type (str): 索引类型
+        n_vectors (int): 向量数
+        dimension (int): 向量维度
+
+    Returns:
+        Dict[str, int]: 构建参数
+    """
+    # 经验值：聚类数约为4*sqrt(N)，且保证每个聚类至少有约39个训练样本
+    nlist = max(1, min(int(4 * math.sqrt(max(n_vectors, 1))), n_vectors // 39 or 1))
+    if index_type == "ivf_flat":
+        return {"nlist": nlist}
+    if index_type == "hnsw":
+        return {"hnsw_m": 32, "ef_construction": 200}
+    if index_type == "ivf_pq":
+        # 子量化器数需整除维度，每个子向量约8维
+        pq_m = max(1, dimension // 8)
+        while dimension % pq_m:
+            pq_m -= 1
+        # 每个码本需要约39*2^nbits个训练样本，数据较少时减少码本位数
+        pq_nbits = max(4, min(8, int(math.log2(max(n_vectors, 1) / 39)) if n_vectors >= 39 else 4))
+        return {"nlist": nlist, "pq_m": pq_m, "pq_nbits": pq_nbits}
+    return {}
+
+
+def index_factory_string(index_type: str, params: Dict[str, int]) -> str:
+    """
+    生成faiss.index_factory的描述字符串
+
+    Args:
+        index_type (str): 索引类型
+        params (Dict[str, int]): 构建参数
+
+    Returns:
+        str: 描述字符串，如"IVF1024,Flat"
+    """
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf_flat":
+        return f"IVF{params['nlist']},Flat"
+    if index_type == "hnsw":
+        return f"HNSW{params['hnsw_m']},Flat"
+    if index_type == "ivf_pq":
+        return f"IVF{params['nlist']},PQ{params['pq_m']}x{params['pq_nbits']}"
+    raise ValueError(f"不支持的索引类型: {index_type}，可选值为{INDEX_TYPES}")
+
+
+def search_param_name(index) -> Optional[str]:
+    """
+    获取索引的主要检索参数名
+
+    Args:
+        index (faiss.Index): 索引
+
+    Returns:
+        Optional[str]: "nprobe"、"efSearch"，精确索引返回None
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "efSearch"
+    try:
+        faiss.extract_index_ivf(index)
+        return "nprobe"
+    except RuntimeError:
+        return None
+
+
+def set_search_param(index, value: int):
+    """
+    设置索引的检索参数（IVF的nprobe或HNSW的efSearch），会随索引一起保存
+
+    Args:
+        index (faiss.Index): 索引
+        value (int): 参数值
+    """
+    name = search_param_name(index)
+    if name == "nprobe":
+        faiss.extract_index_ivf(index).nprobe = int(value)
+    elif name == "efSearch":
+        faiss.downcast_index(index).hnsw.efSearch = int(value)
+
+
+def is_flat(index) -> bool:
+    """索引是否为精确的Flat索引（支持按位置删除并自动重新编号）"""
+    return isinstance(faiss.downcast_index(index), faiss.IndexFlat)
+
+
+def is_lossy(index) -> bool:
+    """索引是否只保存量化后的近似向量（如PQ），此时reconstruct取回的不是原始向量，不能用来重建或评估"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexFlat):
+        return False
+    if isinstance(index, faiss.IndexHNSW):
+        return not isinstance(faiss.downcast_index(index.storage), faiss.IndexFlat)
+    try:
+        ivf = faiss.downcast_index(faiss.extract_index_ivf(index))
+    except RuntimeError:
+        return True
+    return not isinstance(ivf, faiss.IndexIVFFlat)
+
+
+def _extract_ivf(index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def ensure_direct_map(index):
+    """
+    为IVF索引建立哈希表形式的direct map，使reconstruct可按标签取回已存向量；
+    数组形式的direct map要求标签连续，不支持remove_ids
+    """
+    ivf = _extract_ivf(index)
+    if ivf is not None and ivf.direct_map.type != faiss.DirectMap.Hashtable:
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+
+def reconstruct_all(index, labels: Iterable[int]) -> np.ndarray:
+    """
+    按标签取回索引中的向量（PQ索引取回的是量化后的近似值）
+
+    Args:
+        index (faiss.Index): 索引
+        labels (Iterable[int]): 标签，通常为sorted(index_to_docstore_id)
+
+    Returns:
+        np.ndarray: 形状为(len(labels), d)的float32数组
+    """
+    labels = np.fromiter(labels, dtype=np.int64)
+    if len(labels) == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    ensure_direct_map(index)
+    return index.reconstruct_batch(labels)
+
+
+def build_index(index_type: str, vectors: np.ndarray, metric: int = faiss.METRIC_L2,
+                sample_size: int = 100000, params: Optional[Dict[str, int]] = None):
+    """
+    创建索引：在随机抽样的向量上训练，然后按原顺序加入全部向量
+
+    Args:
+        index_type (str): 索引类型
+        vectors (np.ndarray): 全部向量，形状为(n, d)
+        metric (int): FAISS度量，默认为L2
+        sample_size (int): 训练抽样数，默认为100000
+        params (Dict[str, int], optional): 构建参数，缺省的按数据规模取默认值
+
+    Returns:
+        faiss.Index: 已训练并加入向量的索引
+    """
+    n_vectors, dimension = vectors.shape
+    merged = default_index_params(index_type, n_vectors, dimension)
+    merged.update(params or {})
+    description = index_factory_string(index_type, merged)
+    start = time.time()
+    index = faiss.index_factory(dimension, description, metric)
+    if index_type == "hnsw":
+        faiss.downcast_index(index).hnsw.efConstruction = merged.get("ef_construction", 200)
+
+    if not index.is_trained:
+        if n_vectors == 0:
+            raise ValueError(f"{description}索引需要训练数据，向量库为空")
+        rng = np.random.default_rng(0)
+        sample = vectors if n_vectors <= sample_size else vectors[rng.choice(n_vectors, sample_size, replace=False)]
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+    index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    ensure_direct_map(index)
+    logger.info(f"索引构建完成: {description}，{n_vectors}条向量，耗时{time.time() - start:.2f}秒")
+    return index
+
+
+def index_bytes(index) -> int:
+    """
+    获取索引序列化后的大小
+
+    Args:
+        index (faiss.Index): 索引
+
+    Returns:
+        int: 字节数
+    """
+    return int(faiss.serialize_index(index).size)
+
+
+def evaluate_index(index, vectors: np.ndarray, metric: int = faiss.METRIC_L2, k: int = 10,
+                   n_queries: int = 200, values: Optional[List[int]] = None,
+                   queries: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+    """
+    评估近似索引的召回率与延迟：以原始向量上的精确检索结果为基准，扫描不同的检索参数
+
+    查询向量默认从库中抽样，抽样的向量自身总是精确检索的最近邻，会抬高召回率，
+    因此基准和索引结果都多取一个并去掉查询自身（留一法）；也可以传入不在库中的查询向量。
+
+    Args:
+        index (faiss.Index): 待评估的索引
+        vectors (np.ndarray): 索引中的原始向量（未量化，与索引位置一一对应），用于计算基准
+        metric (int): FAISS度量，默认为L2
+        k (int): 计算recall@k，默认为10
+        n_queries (int): 抽样查询数，默认为200
+        values (List[int], optional): 检索参数的取值，默认按SEARCH_PARAM_SWEEPS
+        queries (np.ndarray, optional): 留出的查询向量（如真实查询的向量），为None时从vectors中抽样
+
+    Returns:
+        List[Dict[str, Any]]: 每个参数取值一行 {'param', 'value', 'recall', 'latency_ms'}
+    """
+    n_vectors = vectors.shape[0]
+    if queries is None:
+        # 留一法：去掉自身后至少还要剩一个近邻
+        if n_vectors < 2:
+            return []
+        rng = np.random.default_rng(1)
+        sources = rng.choice(n_vectors, min(n_queries, n_vectors), replace=False)
+        queries = vectors[sources]
+    else:
+        if n_vectors == 0 or len(queries) == 0:
+            return []
+        sources = np.full(len(queries), -1)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    k = min(k, n_vectors - int(sources[0] >= 0))
+    fetch = k + int(sources[0] >= 0)
+    exact = faiss.IndexFlat(vectors.shape[1], metric)
+    exact.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    _, truth = exact.search(queries, fetch)
+    truth = [[label for label in row if label != source][:k] for row, source in zip(truth, sources)]
+
+    name = search_param_name(index)
+    if name is None:
+        sweep = [None]
+    else:
+        sweep = values or SEARCH_PARAM_SWEEPS[name]
+        if name == "nprobe":
+            nlist = faiss.extract_index_ivf(index).nlist
+            sweep = [value for value in sweep if value <= nlist] or [nlist]
+
+    rows = []
+    for value in sweep:
+        if value is not None:
+            set_search_param(index, value)
+        start = time.perf_counter()
+        _, found = index.search(queries, fetch)
+        elapsed = time.perf_counter() - start
+        hits = sum(len(set([label for label in row if label != source][:k]) & set(expected))
+                   for row, source, expected in zip(found, sources, truth))
+        rows.append({
+            'param': name,
+            'value': value,
+            'recall': round(hits / (len(queries) * k), 4),
+            'latency_ms': round(elapsed * 1000 / len(queries), 4)
+        })
+    return rows
+
+
+def choose_search_param(rows: List[Dict[str, Any]], target_recall: float = 0.95) -> Optional[Dict[str, Any]]:
+    """
+    选择达到目标召回率的最小检索参数，都达不到时选召回率最高的一行
+
+    Args:
+        rows (List[Dict[str, Any]]): evaluate_index的结果
+        target_recall (float): 目标召回率，默认为0.95
+
+    Returns:
+        Optional[Dict[str, Any]]: 选中的一行
+    """
+    if not rows:
+        return None
+    for row in rows:
+        if row['recall'] >= target_recall:
+            return row
+    return max(rows, key=lambda row: row['recall'])
+
+
+class _TombstoneSearch:
+    """检索时跳过墓碑标签的HNSW索引视图，其余属性转发给原索引"""
+
+    def __init__(self, index, selector):
+        self._index = index
+        self._selector = selector
+
+    def search(self, x, k):
+        ef_search = faiss.downcast_index(self._index).hnsw.efSearch
+        params = faiss.SearchParametersHNSW(sel=self._selector, efSearch=ef_search)
+        return self._index.search(x, k, params=params)
+
+    def __getattr__(self, name):
+        return getattr(self._index, name)
+
+
+class LabeledFAISS(FAISS):
+    """
+    支持近似索引增删的FAISS向量库
+
+    FAISS把新向量的标签记为len(index_to_docstore_id)、删除后重新编号，只适用于Flat索引。
+    这里把index_to_docstore_id的键作为索引中的标签：
+        Flat    沿用FAISS.delete，按位置删除并重新编号
+        IVF     用add_with_ids写入自增标签，删除时用remove_ids按标签移除，其余标签不变
+        HNSW    不支持删除，被删除的标签作为墓碑留在图中，检索时跳过，由compact()重建清除
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.refresh_labels()
+
+    def refresh_labels(self):
+        """整体替换index或index_to_docstore_id后重新计算墓碑和下一个标签"""
+        self._next_label: Optional[int] = None
+        self._tombstones: Set[int] = set()
+        self._selector = None
+        if len(self.index_to_docstore_id) < self.index.ntotal and _extract_ivf(self.index) is None:
+            self._tombstones = set(range(self.index.ntotal)) - set(self.index_to_docstore_id)
+
+    @property
+    def tombstones(self) -> int:
+        """墓碑数（已删除但仍留在HNSW图中的向量）"""
+        return len(self._tombstones)
+
+    def next_label(self) -> int:
+        """下一次加入的第一个向量的标签"""
+        if _extract_ivf(self.index) is None:
+            return self.index.ntotal
+        if self._next_label is None:
+            self._next_label = max(self.index_to_docstore_id, default=-1) + 1
+        return self._next_label
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, **kwargs) -> List[str]:
+        text_embeddings = list(text_embeddings)
+        texts, embeddings = zip(*text_embeddings) if text_embeddings else ((), ())
+        return self._add_labeled(list(texts), embeddings, metadatas, ids)
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs) -> List[str]:
+        texts = list(texts)
+        return self._add_labeled(texts, self._embed_documents(texts), metadatas, ids)
+
+    def _add_labeled(self, texts: List[str], embeddings, metadatas=None, ids=None) -> List[str]:
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        if len(ids) != len(texts):
+            raise ValueError(f"ids数{len(ids)}与文本数{len(texts)}不一致")
+        if len(ids) != len(set(ids)):
+            raise ValueError("Duplicate ids found in the ids list.")
+        if not ids:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = np.array(embeddings, dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vectors)
+        start = self.next_label()
+        labels = np.arange(start, start + len(ids), dtype=np.int64)
+        if _extract_ivf(self.index) is not None:
+            self.index.add_with_ids(vectors, labels)
+            self._next_label = start + len(ids)
+        else:
+            self.index.add(vectors)
+        self.docstore.add({doc_id: Document(id=doc_id, page_content=text, metadata=metadata)
+                           for doc_id, text, metadata in zip(ids, texts, metadatas)})
+        self.index_to_docstore_id.update(zip(labels.tolist(), ids))
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs) -> Optional[bool]:
+        """
+        按文档ID删除，一批ID只扫描一次映射
+
+        Args:
+            ids (List[str]): 文档ID（须都存在）
+
+        Returns:
+            Optional[bool]: 删除成功返回True
+        """
+        if ids is None:
+            raise ValueError("No ids provided to delete.")
+        if is_flat(self.index):
+            return super().delete(ids, **kwargs)
+        delete_set = set(ids)
+        labels = [label for label, doc_id in self.index_to_docstore_id.items() if doc_id in delete_set]
+        if len(labels) != len(delete_set):
+            missing = delete_set - {self.index_to_docstore_id[label] for label in labels}
+            raise ValueError(f"Some specified ids do not exist in the current store. Ids not found: {missing}")
+        if _extract_ivf(self.index) is not None:
+            self.index.remove_ids(np.array(labels, dtype=np.int64))
+        else:
+            self._tombstones.update(labels)
+            self._selector = None
+        for label in labels:
+            del self.index_to_docstore_id[label]
+        self.docstore.delete(list(delete_set))
+        return True
+
+    def compact(self, vectors: Optional[np.ndarray] = None):
+        """
+        重建HNSW图清除墓碑，标签重新编号为连续位置
+
+        Args:
+            vectors (np.ndarray, optional): 按sorted(index_to_docstore_id)排列的原始向量，为None时从索引取回
+        """
+        if not self._tombstones:
+            return
+        start = time.time()
+        labels = sorted(self.index_to_docstore_id)
+        if vectors is None:
+            vectors = reconstruct_all(self.index, labels)
+        index = faiss.clone_index(self.index)
+        index.reset()
+        index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+        tombstones = len(self._tombstones)
+        self.index = index
+        self.index_to_docstore_id = {i: self.index_to_docstore_id[label] for i, label in enumerate(labels)}
+        self.refresh_labels()
+        logger.info(f"已重建索引清除{tombstones}个墓碑，剩余{len(labels)}条，耗时{time.time() - start:.2f}秒")
+
+    def _search_view(self) -> FAISS:
+        """有墓碑时返回检索时跳过墓碑的浅拷贝，不影响并发的其他检索"""
+        if not self._tombstones:
+            return self
+        if self._selector is None:
+            batch = faiss.IDSelectorBatch(np.fromiter(self._tombstones, dtype=np.int64))
+            # IDSelectorNot不持有batch的引用，一起保存避免被回收
+            self._selector = (batch, faiss.IDSelectorNot(batch))
+        view = copy.copy(self)
+        view.index = _TombstoneSearch(self.index, self._selector[1])
+        return view
+
+    def similarity_search_with_score_by_vector(self, *args, **kwargs):
+        return FAISS.similarity_search_with_score_by_vector(self._search_view(), *args, **kwargs)
+
+    def max_marginal_relevance_search_with_score_by_vector(self, *args, **kwargs):
+        return FAISS.max_marginal_relevance_search_with_score_by_vector(self._search_view(), *args, **kwargs)
@@ -0,0 +1,113 @@
+import os
+import sys
+
+import numpy as np
+import faiss
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.embeddings import FakeEmbeddings
+
+from LLM_base.faiss_index import LabeledFAISS, build_index, evaluate_index, is_lossy, reconstruct_all
+
+DIMENSION = 16
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    return rng.random((600, DIMENSION)).astype(np.float32)
+
+
+def make_vectorstore(index_type, vectors):
+    """在vectors上训练指定类型的索引，再通过向量库加入全部向量，文档ID为doc{位置}"""
+    index = build_index(index_type, vectors)
+    index.reset()
+    vectorstore = LabeledFAISS(embedding_function=FakeEmbeddings(size=DIMENSION), index=index,
+                               docstore=InMemoryDocstore(), index_to_docstore_id={})
+    vectorstore.add_embeddings([(f"text{i}", vector) for i, vector in enumerate(vectors)],
+                               ids=[f"doc{i}" for i in range(len(vectors))])
+    return vectorstore
+
+
+def flat_index(vectors):
+    index = faiss.IndexFlatL2(DIMENSION)
+    index.add(vectors)
+    return index
+
+
+def top_ids(vectorstore, vector, k=5):
+    return [doc.id for doc, _ in vectorstore.similarity_search_with_score_by_vector(vector, k=k)]
+
+
+def test_is_lossy():
+    assert not is_lossy(faiss.IndexFlatL2(DIMENSION))
+    assert not is_lossy(faiss.index_factory(DIMENSION, "IVF4,Flat"))
+    assert not is_lossy(faiss.index_factory(DIMENSION, "HNSW16,Flat"))
+    assert is_lossy(faiss.index_factory(DIMENSION, "IVF4,PQ4x4"))
+
+
+def test_evaluate_excludes_query_itself(vectors):
+    rows = evaluate_index(flat_index(vectors), vectors, k=10)
+    assert rows[0]['recall'] == 1.0
+    # 查询自身总是第一个命中，不去掉时召回率虚高
+    index = build_index('ivf_flat', vectors, params={'nlist': 16})
+    rows = evaluate_index(index, vectors, k=10, values=[1])
+    queries = vectors[np.random.default_rng(1).choice(len(vectors), 200, replace=False)]
+    _, found = index.search(queries, 10)
+    _, truth = flat_index(vectors).search(queries, 10)
+    with_self = np.mean([len(set(f) & set(t)) / 10 for f, t in zip(found, truth)])
+    assert rows[0]['recall'] < with_self
+
+
+def test_evaluate_with_held_out_queries(vectors):
+    queries = np.random.default_rng(2).random((20, DIMENSION)).astype(np.float32)
+    rows = evaluate_index(flat_index(vectors), vectors, k=5, queries=queries)
+    assert [(row['param'], row['value'], row['recall']) for row in rows] == [(None, None, 1.0)]
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "ivf_pq"])
+def test_delete_then_add_keeps_labels_consistent(index_type, vectors):
+    vectorstore = make_vectorstore(index_type, vectors)
+    vectorstore.delete([f"doc{i}" for i in range(0, 600, 3)])
+    assert vectorstore.index.ntotal == len(vectorstore.index_to_docstore_id) == 400
+    assert vectorstore.tombstones == 0
+
+    extra = np.random.default_rng(3).random((5, DIMENSION)).astype(np.float32)
+    vectorstore.add_embeddings([(f"extra{i}", vector) for i, vector in enumerate(extra)],
+                               ids=[f"extra{i}" for i in range(5)])
+    assert top_ids(vectorstore, extra[2], k=1) == ["extra2"]
+    assert "doc3" not in top_ids(vectorstore, vectors[3], k=10)
+    if index_type != "ivf_pq":
+        labels = sorted(vectorstore.index_to_docstore_id)
+        np.testing.assert_allclose(reconstruct_all(vectorstore.index, labels[-5:]), extra, atol=1e-6)
+
+
+def test_hnsw_delete_leaves_tombstones(vectors):
+    vectorstore = make_vectorstore("hnsw", vectors)
+    vectorstore.delete(["doc3", "doc4"])
+    assert vectorstore.tombstones == 2
+    assert vectorstore.index.ntotal == 600
+    assert "doc3" not in top_ids(vectorstore, vectors[3], k=10)
+    assert len(top_ids(vectorstore, vectors[3], k=10)) == 10
+    assert len(vectorstore.max_marginal_relevance_search_by_vector(list(vectors[4]), k=4)) == 4
+
+    extra = np.random.default_rng(3).random((1, DIMENSION)).astype(np.float32)
+    vectorstore.add_embeddings([("extra", extra[0])], ids=["extra"])
+    assert top_ids(vectorstore, extra[0], k=1) == ["extra"]
+
+    vectorstore.compact()
+    assert vectorstore.tombstones == 0
+    assert vectorstore.index.ntotal == len(vectorstore.index_to_docstore_id) == 599
+    assert top_ids(vectorstore, vectors[10], k=1) == ["doc10"]
+    assert top_ids(vectorstore, extra[0], k=1) == ["extra"]
+
+
+def test_delete_missing_id_raises(vectors):
+    vectorstore = make_vectorstore("ivf_flat", vectors)
+    with pytest.raises(ValueError):
+        vectorstore.delete(["doc1", "missing"])
+    assert vectorstore.index.ntotal == 600
@@ -0,0 +1,792 @@
+import os
+import json
+import time
+import pickle
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import faiss
+from langchain_core.documents import Document
+
+from LLM_base.faiss_index import LabeledFAISS, ensure_direct_map, is_lossy, reconstruct_all
+from LLM_base.sqlite_docstore import (SQLITE_DOCSTORE_FILE, SQLiteDocstore, export_lock, export_sqlite_docstore,
+                                      open_sqlite_docstore, read_snapshot_identity, snapshot_identity)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+DOCSTORE_LOG_FILE = "docstore.log"
+MERGE_MARKER_FILE = "merge.json"
+SEGMENTS_DIR = "segments"
+RAW_VECTORS_FILE = "raw_vectors.npy"
+
+# 内存映射只读打开索引：Flat/HNSW的向量和IVF的倒排表直接映射文件，不读入内存
+MMAP_IO_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+class RawVectors:
+    """
+    按文档ID保存的原始float32向量
+
+    有损索引（如IVF-PQ）只保存量化后的近似向量，重建索引和评估召回率需要原始向量。
+    基线部分以内存映射方式读取raw_vectors.npy（行顺序与基线快照的索引位置一致），
+    之后追加的向量按块保存在内存中，合并时随基线快照一起写出。
+    """
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self._blocks: List[np.ndarray] = []
+        # 文档ID -> (块序号, 块内行号)
+        self._rows: Dict[str, Tuple[int, int]] = {}
+
+    @classmethod
+    def load(cls, file_path: str, ids: List[str]) -> "RawVectors":
+        """
+        内存映射读取原始向量文件
+
+        Args:
+            file_path (str): raw_vectors.npy路径
+            ids (List[str]): 与文件各行一一对应的文档ID
+
+        Returns:
+            RawVectors: 原始向量
+        """
+        array = np.load(file_path, mmap_mode='r')
+        if array.ndim != 2 or array.shape[0] != len(ids):
+            raise ValueError(f"原始向量文件有{array.shape[0]}行，与基线快照的{len(ids)}条文档不一致")
+        raw = cls(array.shape[1])
+        raw.add(ids, array)
+        return raw
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, ids: List[str], vectors: np.ndarray):
+        """加入一批向量，已存在的ID被覆盖"""
+        block = len(self._blocks)
+        self._blocks.append(vectors)
+        self._rows.update((doc_id, (block, row)) for row, doc_id in enumerate(ids))
+
+    def discard(self, ids: List[str]):
+        """删除向量，不存在的ID被忽略"""
+        for doc_id in ids:
+            self._rows.pop(doc_id, None)
+
+    def get(self, doc_id: str) -> Optional[np.ndarray]:
+        """取回单个向量，不存在时返回None"""
+        location = self._rows.get(doc_id)
+        if location is None:
+            return None
+        block, row = location
+        return np.array(self._blocks[block][row], dtype=np.float32)
+
+    def gather(self, ids: List[str]) -> np.ndarray:
+        """
+        按ids的顺序取出向量
+
+        Args:
+            ids (List[str]): 文档ID列表
+
+        Returns:
+            np.ndarray: 形状为(len(ids), dimension)的float32数组；缺少任一ID时抛出KeyError
+        """
+        result = np.empty((len(ids), self.dimension), dtype=np.float32)
+        by_block: Dict[int, Tuple[List[int], List[int]]] = {}
+        for i, doc_id in enumerate(ids):
+            block, row = self._rows[doc_id]
+            targets, rows = by_block.setdefault(block, ([], []))
+            targets.append(i)
+            rows.append(row)
+        for block, (targets, rows) in by_block.items():
+            result[targets] = self._blocks[block][rows]
+        return result
+
+    def block_count(self) -> int:
+        return len(self._blocks)
+
+    def rebase(self, base: np.ndarray, ids: List[str], blocks: int):
+        """
+        合并写出原始向量文件后改为从新文件读取，释放内存中的旧块
+
+        Args:
+            base (np.ndarray): 新写出的原始向量文件（内存映射）
+            ids (List[str]): 与base各行一一对应的文档ID
+            blocks (int): 写出时的块数；之后新增的块（合并期间的追加）保持不变
+        """
+        for row, doc_id in enumerate(ids):
+            location = self._rows.get(doc_id)
+            # 写出后被删除或重新加入的ID不改
+            if location is not None and location[0] < blocks:
+                self._rows[doc_id] = (-1, row)
+        self._blocks = [base] + self._blocks[blocks:]
+        for doc_id, (block, row) in self._rows.items():
+            self._rows[doc_id] = (block - blocks + 1 if block >= 0 else 0, row)
+
+
+class IncrementalFAISSStore:
+    """
+    FAISS向量库的增量持久化
+
+    目录结构（index.faiss/index.pkl与FAISS.save_local格式一致，作为基线快照）：
+        index.faiss / index.pkl   基线快照，覆盖到manifest中的base_seq
+        segments/{seq}.npy        每次追加的向量段（只写本次新增的向量）
+        docstore.log              追加日志，每行一条 {'seq': n, 'op': 'add'|'delete', ...}
+        manifest.json             已提交的 base_seq / last_seq 及待合并的向量段
+        raw_vectors.npy           有损索引（如IVF-PQ）的原始向量副本，与基线快照一起写出，用于重建和评估
+
+    每次追加只写入本次的向量段和一行日志，再原子替换manifest；加载时读取基线快照后
+    重放 base_seq < seq <= last_seq 的日志记录。待合并记录数达到阈值时由后台线程把内存中的
+    向量库写成新的基线快照并截断日志（合并），合并中途崩溃时下次打开会前滚或丢弃未完成的合并。
+    删除不重建索引：IVF按标签移除，HNSW记为墓碑，墓碑较多时在合并时重建清除（见LabeledFAISS）。
+
+    mmap模式下以内存映射只读打开index.faiss，文档从docstore.sqlite按需读取，启动耗时与库大小基本无关，
+    多个进程共享同一份页缓存；第一次写入前自动把索引和文档完整读入内存，切换为普通模式。
+    """
+
+    def __init__(self, path: str, merge_threshold: int = 16, background_merge: bool = True,
+                 compact_ratio: float = 0.1):
+        """
+        初始化增量存储
+
+        Args:
+            path (str): 向量库目录
+            merge_threshold (int): 待合并的日志记录数达到该值时触发合并，默认为16
+            background_merge (bool): 是否在后台线程中合并，为False时在追加的线程中同步合并，默认为True
+            compact_ratio (float): HNSW索引的墓碑（已删除的向量）占比达到该值时，合并时重建索引清除墓碑，默认为0.1
+        """
+        self.path = path
+        self.merge_threshold = merge_threshold
+        self.background_merge = background_merge
+        self.compact_ratio = compact_ratio
+        self.vectorstore: Optional[LabeledFAISS] = None
+
+        self._lock = threading.RLock()
+        # 同一时间只允许一个合并写临时文件
+        self._merge_lock = threading.Lock()
+        self._merge_thread: Optional[threading.Thread] = None
+        self._base_seq = 0
+        self._last_seq = 0
+        # 待合并的向量段文件名
+        self._segments: List[str] = []
+        # 是否有只加入内存、尚未写入磁盘的向量（批量导入）
+        self._unsaved = False
+        # 文档ID -> 索引位置，延迟构建，删除后失效
+        self._positions: Optional[Dict[str, int]] = None
+        # 原始向量副本，索引本身保存原始向量（Flat/HNSW/IVF-Flat）时为None
+        self._raw: Optional[RawVectors] = None
+        # 当前是否为内存映射只读模式
+        self.mmap_mode = False
+
+        self.appended_vectors = 0
+        self.appended_bytes = 0
+        self.merges = 0
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _segment_path(self, name: str) -> str:
+        return os.path.join(self.path, SEGMENTS_DIR, name)
+
+    @staticmethod
+    def _write_file(file_path: str, data: bytes):
+        """写入文件并fsync"""
+        with open(file_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_atomic(self, file_path: str, data: bytes):
+        """写临时文件并fsync后原子替换"""
+        temp_file = file_path + '.tmp'
+        self._write_file(temp_file, data)
+        os.replace(temp_file, file_path)
+
+    def _write_manifest(self):
+        """原子写入manifest（调用方需持有锁）"""
+        manifest = {
+            'version': 1,
+            'base_seq': self._base_seq,
+            'last_seq': self._last_seq,
+            'segments': self._segments,
+            'updated': time.time()
+        }
+        self._write_atomic(self._file(MANIFEST_FILE), json.dumps(manifest, ensure_ascii=False).encode('utf-8'))
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        manifest_file = self._file(MANIFEST_FILE)
+        if not os.path.exists(manifest_file):
+            # 旧版向量库只有基线快照
+            return {'base_seq': 0, 'last_seq': 0, 'segments': []}
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _read_log(self) -> List[Dict[str, Any]]:
+        """读取docstore日志，跳过末尾可能被截断的半行"""
+        log_file = self._file(DOCSTORE_LOG_FILE)
+        records = []
+        if not os.path.exists(log_file):
+            return records
+        with open(log_file, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"跳过损坏的docstore日志记录: 第{line_no}行")
+        return records
+
+    def _append_log(self, record: Dict[str, Any]):
+        """追加一行日志并fsync（调用方需持有锁）"""
+        log_file = self._file(DOCSTORE_LOG_FILE)
+        # 上次崩溃可能留下不完整的末行，先补换行避免与新记录粘连
+        prefix = ''
+        if os.path.exists(log_file) and os.path.getsize(log_file) > 0:
+            with open(log_file, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    prefix = '\n'
+        with open(log_file, 'a', encoding='utf-8') as f:
+            f.write(prefix + json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _recover_merge(self):
+        """处理上次未完成的合并：有合并标记则前滚，否则删除残留的临时文件"""
+        marker_file = self._file(MERGE_MARKER_FILE)
+        temp_files = [self._file('index.faiss.tmp'), self._file('index.pkl.tmp'),
+                      self._file(RAW_VECTORS_FILE + '.tmp')]
+        if os.path.exists(marker_file):
+            with open(marker_file, 'r', encoding='utf-8') as f:
+                marker = json.load(f)
+            merged_seq = int(marker['base_seq'])
+            for temp_file in temp_files:
+                if os.path.exists(temp_file):
+                    os.replace(temp_file, temp_file[:-4])
+            if not marker.get('raw_vectors', True) and os.path.exists(self._file(RAW_VECTORS_FILE)):
+                os.remove(self._file(RAW_VECTORS_FILE))
+            manifest = self._read_manifest()
+            self._base_seq = max(int(manifest.get('base_seq', 0)), merged_seq)
+            self._last_seq = max(int(manifest.get('last_seq', 0)), self._base_seq)
+            self._segments = list(manifest.get('segments', []))
+            self._finish_merge(merged_seq)
+            os.remove(marker_file)
+            logger.info(f"已前滚上次未完成的合并，基线覆盖到seq {merged_seq}")
+        else:
+            for temp_file in temp_files:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+
+    def load(self, embeddings, mmap: bool = False) -> LabeledFAISS:
+        """
+        加载基线快照并重放已提交的日志记录
+
+        Args:
+            embeddings (Embeddings): 嵌入模型
+            mmap (bool): 是否以内存映射只读模式打开；有待重放的日志时仍按普通模式加载，默认为False
+
+        Returns:
+            LabeledFAISS: 向量库实例
+        """
+        with self._lock:
+            start = time.time()
+            os.makedirs(self._file(SEGMENTS_DIR), exist_ok=True)
+            self._recover_merge()
+            manifest = self._read_manifest()
+            self._base_seq = int(manifest.get('base_seq', 0))
+            self._last_seq = int(manifest.get('last_seq', 0))
+            self._segments = list(manifest.get('segments', []))
+
+            if mmap:
+                if self._last_seq == self._base_seq:
+                    self.vectorstore = self._load_mmap(embeddings)
+                    self._positions = None
+                    logger.info(f"向量库以内存映射模式打开: {self.vectorstore.index.ntotal}条向量，"
+                                f"耗时{time.time() - start:.3f}秒")
+                    return self.vectorstore
+                logger.info("有尚未合并的增量日志，按普通模式加载（合并后下次启动可使用内存映射）")
+
+            self.mmap_mode = False
+            vectorstore = LabeledFAISS.load_local(self.path, embeddings, allow_dangerous_deserialization=True)
+            ensure_direct_map(vectorstore.index)
+            self._raw = self._load_raw_vectors(vectorstore.index, vectorstore.index_to_docstore_id)
+            base_vectors = vectorstore.index.ntotal
+            replayed = 0
+            records = self._read_log()
+            # 删除记录攒起来一次删除；之后追加的ID与待删除的重复时先删除，保证顺序语义
+            pending_deletes: Dict[str, None] = {}
+            for record in records:
+                seq = int(record.get('seq', 0))
+                # 已被基线覆盖，或日志已写入但manifest尚未提交（追加中途崩溃）
+                if seq <= self._base_seq or seq > self._last_seq:
+                    continue
+                if record.get('op') == 'delete':
+                    pending_deletes.update(dict.fromkeys(record['ids']))
+                else:
+                    if any(doc_id in pending_deletes for doc_id in record['ids']):
+                        self._delete_ids(vectorstore, list(pending_deletes))
+                        pending_deletes.clear()
+                    self._apply_add(vectorstore, record)
+                replayed += 1
+            self._delete_ids(vectorstore, list(pending_deletes))
+            if any(int(record.get('seq', 0)) > self._last_seq for record in records):
+                # 去掉未提交的记录，避免与之后追加的同seq记录混淆
+                committed = [record for record in records if int(record.get('seq', 0)) <= self._last_seq]
+                data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in committed)
+                self._write_atomic(self._file(DOCSTORE_LOG_FILE), data.encode('utf-8'))
+                logger.warning("已丢弃docstore日志中未提交的记录")
+            self.vectorstore = vectorstore
+            self._positions = None
+        logger.info(f"向量库加载完成: 基线{base_vectors}条向量，"
+                    f"重放日志{replayed}条，耗时{time.time() - start:.2f}秒")
+        return vectorstore
+
+    def _load_raw_vectors(self, index, index_to_docstore_id) -> Optional[RawVectors]:
+        """读取基线快照的原始向量副本，没有副本时返回None（调用方需持有锁）"""
+        raw_file = self._file(RAW_VECTORS_FILE)
+        if os.path.exists(raw_file):
+            ids = [index_to_docstore_id[position] for position in sorted(index_to_docstore_id)]
+            try:
+                return RawVectors.load(raw_file, ids)
+            except ValueError as e:
+                logger.error(f"原始向量副本与基线快照不一致，已忽略: {e}")
+        if is_lossy(index):
+            logger.warning("有损索引缺少原始向量副本，取回的向量只是近似值，无法用rebuild_index重建；"
+                           "需要重建时请重新导入文档")
+        return None
+
+    def _sqlite_path(self) -> str:
+        return self._file(SQLITE_DOCSTORE_FILE)
+
+    def _export_sqlite(self, docstore, index_to_docstore_id: Dict[int, str]):
+        """按当前基线快照导出SQLite docstore（调用方需持有export_lock）"""
+        export_sqlite_docstore(self._sqlite_path(), docstore, index_to_docstore_id,
+                               snapshot_identity(self._file('index.pkl')))
+
+    def _load_mmap(self, embeddings) -> LabeledFAISS:
+        """内存映射打开索引，文档改为从SQLite按需读取（调用方需持有锁）"""
+        snapshot = snapshot_identity(self._file('index.pkl'))
+        if read_snapshot_identity(self._sqlite_path()) != snapshot:
+            # 首次使用或基线已更新：从index.pkl导出一次，之后的启动都不再反序列化docstore；
+            # 多个进程同时启动时只由拿到锁的一个导出，其余等待后直接使用
+            with export_lock(self._sqlite_path()):
+                if read_snapshot_identity(self._sqlite_path()) != snapshot:
+                    logger.info("SQLite docstore不存在或已过期，从index.pkl重新导出")
+                    with open(self._file('index.pkl'), 'rb') as f:
+                        docstore, index_to_docstore_id = pickle.load(f)
+                    self._export_sqlite(docstore, index_to_docstore_id)
+        index = faiss.read_index(self._file('index.faiss'), MMAP_IO_FLAGS)
+        docstore, index_to_docstore_id = open_sqlite_docstore(self._sqlite_path())
+        self.mmap_mode = True
+        self._raw = None
+        return LabeledFAISS(embedding_function=embeddings, index=index, docstore=docstore,
+                            index_to_docstore_id=index_to_docstore_id)
+
+    def ensure_writable(self):
+        """
+        mmap模式下把索引和文档完整读入内存，切换为可写的普通模式（内存映射的索引不能追加或删除）
+        """
+        with self._lock:
+            if not self.mmap_mode:
+                return
+            start = time.time()
+            index = faiss.read_index(self._file('index.faiss'))
+            ensure_direct_map(index)
+            with open(self._file('index.pkl'), 'rb') as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+            self._raw = self._load_raw_vectors(index, index_to_docstore_id)
+            old_docstore = self.vectorstore.docstore
+            # 原地替换，调用方持有的向量库对象保持有效
+            self.vectorstore.index = index
+            self.vectorstore.docstore = docstore
+            self.vectorstore.index_to_docstore_id = index_to_docstore_id
+            self.vectorstore.refresh_labels()
+            self._positions = None
+            self.mmap_mode = False
+            if isinstance(old_docstore, SQLiteDocstore):
+                old_docstore.close()
+        logger.info(f"向量库已从内存映射模式切换为内存模式，耗时{time.time() - start:.2f}秒")
+
+    def _delete_ids(self, vectorstore: LabeledFAISS, ids: List[str]):
+        """从内存中的向量库删除一批文档（调用方需持有锁）"""
+        if not ids:
+            return
+        vectorstore.delete(ids)
+        if self._raw is not None:
+            self._raw.discard(ids)
+
+    def _apply_add(self, vectorstore: LabeledFAISS, record: Dict[str, Any]):
+        """把一条追加日志记录应用到内存中的向量库（调用方需持有锁）"""
+        vectors = np.load(self._segment_path(record['segment']))
+        vectorstore.add_embeddings(
+            text_embeddings=list(zip(record['texts'], vectors)),
+            metadatas=record['metadatas'],
+            ids=record['ids']
+        )
+        if self._raw is not None:
+            self._raw.add(record['ids'], vectors)
+
+    def add_embedded(self, documents: List[Document], vectors: List[List[float]],
+                     ids: Optional[List[str]] = None) -> List[str]:
+        """
+        添加已生成向量的文档：更新内存中的向量库，只把本次的向量段和文档写入磁盘
+
+        Args:
+            documents (List[Document]): 文档块
+            vectors (List[List[float]]): 与documents一一对应的向量
+            ids (List[str], optional): 指定的文档ID，为None时自动生成
+
+        Returns:
+            List[str]: 文档ID列表
+        """
+        if self.vectorstore is None:
+            raise RuntimeError("向量库尚未加载")
+        self.ensure_writable()
+        if not documents:
+            return []
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+        array = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            start_position = self.vectorstore.index.ntotal
+            ids = self.vectorstore.add_embeddings(text_embeddings=list(zip(texts, array)), metadatas=metadatas,
+                                                 ids=ids)
+            if self._positions is not None:
+                self._positions.update((doc_id, start_position + i) for i, doc_id in enumerate(ids))
+            if self._raw is not None:
+                self._raw.add(ids, array)
+            seq = self._last_seq + 1
+            segment = f"{seq:08d}.npy"
+            segment_path = self._segment_path(segment)
+            with open(segment_path, 'wb') as f:
+                np.save(f, array)
+                f.flush()
+                os.fsync(f.fileno())
+            self._append_log({'seq': seq, 'op': 'add', 'segment': segment, 'ids': ids,
+                              'texts': texts, 'metadatas': metadatas})
+            self._last_seq = seq
+            self._segments.append(segment)
+            self._write_manifest()
+            self.appended_vectors += len(ids)
+            self.appended_bytes += os.path.getsize(segment_path)
+        logger.info(f"增量写入{len(ids)}个向量，段文件: {segment}")
+        self._maybe_merge()
+        return ids
+
+    def add_in_memory(self, documents: List[Document], vectors: List[List[float]],
+                      ids: Optional[List[str]] = None) -> List[str]:
+        """
+        只把文档加入内存中的向量库，不写日志；用于批量导入，导入结束后调用merge()一次性保存
+
+        Args:
+            documents (List[Document]): 文档块
+            vectors (List[List[float]]): 与documents一一对应的向量
+            ids (List[str], optional): 指定的文档ID，为None时自动生成
+
+        Returns:
+            List[str]: 文档ID列表
+        """
+        if self.vectorstore is None:
+            raise RuntimeError("向量库尚未加载")
+        self.ensure_writable()
+        if not documents:
+            return []
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+        array = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            start_position = self.vectorstore.index.ntotal
+            ids = self.vectorstore.add_embeddings(text_embeddings=list(zip(texts, array)), metadatas=metadatas,
+                                                 ids=ids)
+            if self._positions is not None:
+                self._positions.update((doc_id, start_position + i) for i, doc_id in enumerate(ids))
+            if self._raw is not None:
+                self._raw.add(ids, array)
+            self._unsaved = True
+        return ids
+
+    def _position_map(self) -> Dict[str, int]:
+        """获取文档ID到索引位置的映射（调用方需持有锁）"""
+        if self._positions is None:
+            self._positions = {doc_id: position for position, doc_id in self.vectorstore.index_to_docstore_id.items()}
+        return self._positions
+
+    def _existing_ids(self, ids: List[str]) -> List[str]:
+        """过滤掉向量库中已不存在的ID（调用方需持有锁）"""
+        positions = self._position_map()
+        return [doc_id for doc_id in ids if doc_id in positions]
+
+    def delete(self, ids: List[str]) -> bool:
+        """
+        从向量库删除文档，记录为一条删除日志；不存在的ID被忽略
+
+        Args:
+            ids (List[str]): 文档ID列表
+
+        Returns:
+            bool: 是否删除成功
+        """
+        if self.vectorstore is None:
+            raise RuntimeError("向量库尚未加载")
+        self.ensure_writable()
+        with self._lock:
+            ids = self._existing_ids(ids)
+            if not ids:
+                return True
+            self._delete_ids(self.vectorstore, ids)
+            self._positions = None
+            seq = self._last_seq + 1
+            self._append_log({'seq': seq, 'op': 'delete', 'ids': list(ids)})
+            self._last_seq = seq
+            self._write_manifest()
+        self._maybe_merge()
+        return True
+
+    def delete_in_memory(self, ids: List[str]):
+        """
+        只从内存中的向量库删除文档，不写日志；用于批量导入，导入结束后调用merge()一次性保存
+
+        Args:
+            ids (List[str]): 文档ID列表，不存在的ID被忽略
+        """
+        if self.vectorstore is None:
+            raise RuntimeError("向量库尚未加载")
+        self.ensure_writable()
+        with self._lock:
+            ids = self._existing_ids(ids)
+            if ids:
+                self._delete_ids(self.vectorstore, ids)
+                self._positions = None
+                self._unsaved = True
+
+    def get_vectors(self, ids: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        取回已存文档的向量，用于相同文本复用向量而不必重新生成；有原始向量副本时从副本取回
+
+        Args:
+            ids (List[str]): 文档ID列表
+
+        Returns:
+            List[Optional[np.ndarray]]: 与ids一一对应的向量，不存在、索引不支持取回或只能取回近似值时为None
+        """
+        if self.vectorstore is None or not ids:
+            return [None] * len(ids)
+        with self._lock:
+            if self._raw is not None:
+                return [self._raw.get(doc_id) for doc_id in ids]
+            if is_lossy(self.vectorstore.index):
+                # 量化后的近似向量不能当作原始向量复用
+                return [None] * len(ids)
+            positions = self._position_map()
+            vectors = []
+            for doc_id in ids:
+                position = positions.get(doc_id)
+                if position is None:
+                    vectors.append(None)
+                    continue
+                try:
+                    vectors.append(self.vectorstore.index.reconstruct(int(position)))
+                except RuntimeError:
+                    # 部分索引类型（如未建立direct map的IVF）不支持取回
+                    vectors.append(None)
+            return vectors
+
+    def replace_index(self, build_fn: Callable[[np.ndarray], Any]):
+        """
+        用全部已存的原始向量构建新索引并替换（位置顺序不变），然后保存为新的基线快照
+
+        原始向量优先取自原始向量副本；没有副本时只有索引本身保存原始向量（Flat/HNSW/IVF-Flat）才能从索引取回，
+        有损索引（如IVF-PQ）取回的是量化后的近似值，用它重建会叠加误差，因此拒绝重建。
+        新索引是有损索引时保留原始向量副本，随基线快照一起保存。
+        替换期间持有锁，其他线程的追加会等待，避免新索引漏掉构建过程中加入的向量。
+
+        Args:
+            build_fn (Callable): 参数为按位置排列的全部原始向量，返回新的faiss索引
+        """
+        if self.vectorstore is None:
+            raise RuntimeError("向量库尚未加载")
+        self.ensure_writable()
+        with self._lock:
+            index_to_docstore_id = self.vectorstore.index_to_docstore_id
+            labels = sorted(index_to_docstore_id)
+            ids = [index_to_docstore_id[label] for label in labels]
+            if self._raw is not None:
+                vectors = self._raw.gather(ids)
+            elif is_lossy(self.vectorstore.index):
+                raise RuntimeError("当前索引只保存了量化后的近似向量且没有原始向量副本，无法重建；请重新导入文档")
+            else:
+                vectors = reconstruct_all(self.vectorstore.index, labels)
+            index = build_fn(vectors)
+            if index.ntotal != len(ids):
+                raise RuntimeError(f"新索引向量数{index.ntotal}与文档数{len(ids)}不一致")
+            # 新索引按位置连续编号，墓碑和IVF删除留下的标签空洞一并消除
+            self.vectorstore.index = index
+            self.vectorstore.index_to_docstore_id = dict(enumerate(ids))
+            self.vectorstore.refresh_labels()
+            self._positions = None
+            if not is_lossy(index):
+                self._raw = None
+            elif self._raw is None:
+                self._raw = RawVectors(vectors.shape[1])
+                self._raw.add(ids, vectors)
+            self._unsaved = True
+        self.merge()
+
+    def pending_records(self) -> int:
+        """
+        获取尚未合并进基线的日志记录数
+
+        Returns:
+            int: 记录数
+        """
+        with self._lock:
+            return self._last_seq - self._base_seq
+
+    def _maybe_merge(self):
+        """待合并记录数达到阈值时触发合并"""
+        if self.pending_records() < self.merge_threshold:
+            return
+        if not self.background_merge:
+            self.merge()
+            return
+        with self._lock:
+            if self._merge_thread is not None and self._merge_thread.is_alive():
+                return
+            self._merge_thread = threading.Thread(target=self._merge_safely, name="FAISSMerge")
+            self._merge_thread.daemon = True
+            self._merge_thread.start()
+
+    def _merge_safely(self):
+        try:
+            self.merge()
+        except Exception as e:
+            logger.error(f"后台合并向量库失败，日志保留待下次合并: {e}")
+
+    def merge(self):
+        """
+        把内存中的向量库写成新的基线快照并截断已合并的日志
+
+        只在序列化内存索引时持有锁，写盘期间前台仍可继续追加；合并完成前追加的记录
+        seq大于本次的基线，继续保留在日志中。
+        """
+        with self._merge_lock:
+            self._merge()
+
+    def _merge(self):
+        with self._lock:
+            if self.vectorstore is None or (self._last_seq == self._base_seq and not self._unsaved):
+                return
+            start = time.time()
+            merged_seq = self._last_seq
+            was_unsaved, self._unsaved = self._unsaved, False
+            vectorstore = self.vectorstore
+            if vectorstore.tombstones and vectorstore.tombstones >= self.compact_ratio * vectorstore.index.ntotal:
+                vectors = None
+                if self._raw is not None:
+                    vectors = self._raw.gather([vectorstore.index_to_docstore_id[label]
+                                                for label in sorted(vectorstore.index_to_docstore_id)])
+                vectorstore.compact(vectors)
+                self._positions = None
+            index_bytes = faiss.serialize_index(self.vectorstore.index).tobytes()
+            docstore_bytes = pickle.dumps((self.vectorstore.docstore, self.vectorstore.index_to_docstore_id))
+            raw = self._raw
+            if raw is not None:
+                index_to_docstore_id = self.vectorstore.index_to_docstore_id
+                raw_ids = [index_to_docstore_id[position] for position in sorted(index_to_docstore_id)]
+                raw_vectors = raw.gather(raw_ids)
+                raw_blocks = raw.block_count()
+
+        raw_file = self._file(RAW_VECTORS_FILE)
+        try:
+            self._write_file(self._file('index.faiss.tmp'), index_bytes)
+            self._write_file(self._file('index.pkl.tmp'), docstore_bytes)
+            if raw is not None:
+                with open(raw_file + '.tmp', 'wb') as f:
+                    np.save(f, raw_vectors)
+                    f.flush()
+                    os.fsync(f.fileno())
+        except Exception:
+            if was_unsaved:
+                self._unsaved = True
+            raise
+        # 合并标记写入后合并即视为提交，之后崩溃由下次加载前滚
+        marker = {'base_seq': merged_seq, 'raw_vectors': raw is not None}
+        self._write_atomic(self._file(MERGE_MARKER_FILE), json.dumps(marker).encode('utf-8'))
+        os.replace(self._file('index.faiss.tmp'), self._file('index.faiss'))
+        os.replace(self._file('index.pkl.tmp'), self._file('index.pkl'))
+        if raw is not None:
+            os.replace(raw_file + '.tmp', raw_file)
+            raw_vectors = None
+        elif os.path.exists(raw_file):
+            os.remove(raw_file)
+        if os.path.exists(self._sqlite_path()):
+            # 已启用过内存映射模式：同步刷新SQLite副本，下次启动无需再导出
+            try:
+                with export_lock(self._sqlite_path()):
+                    self._export_sqlite(*pickle.loads(docstore_bytes))
+            except Exception as e:
+                logger.error(f"刷新SQLite docstore失败，下次以内存映射模式启动时重新导出: {e}")
+
+        with self._lock:
+            self._base_seq = max(self._base_seq, merged_seq)
+            self._finish_merge(merged_seq)
+            if raw is not None and self._raw is raw:
+                # 内存中的原始向量改为从新文件映射读取
+                raw.rebase(np.load(raw_file, mmap_mode='r'), raw_ids, raw_blocks)
+        os.remove(self._file(MERGE_MARKER_FILE))
+        self.merges += 1
+        logger.info(f"向量库合并完成，基线覆盖到seq {merged_seq}，"
+                    f"快照{(len(index_bytes) + len(docstore_bytes)) / 1024 / 1024:.1f}MB，耗时{time.time() - start:.2f}秒")
+
+    def _finish_merge(self, merged_seq: int):
+        """重写日志只保留seq大于merged_seq的记录，删除已合并的向量段（调用方需持有锁）"""
+        remaining = [record for record in self._read_log() if int(record.get('seq', 0)) > merged_seq]
+        data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in remaining)
+        self._write_atomic(self._file(DOCSTORE_LOG_FILE), data.encode('utf-8'))
+        keep = {record['segment'] for record in remaining if record.get('op') == 'add'}
+        for segment in self._segments:
+            if segment not in keep:
+                try:
+                    os.remove(self._segment_path(segment))
+                except FileNotFoundError:
+                    pass
+        self._segments = [segment for segment in self._segments if segment in keep]
+        self._write_manifest()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取增量存储的统计信息
+
+        Returns:
+            Dict[str, Any]: 向量数、待合并记录数、本进程追加的字节数、合并次数、墓碑数、原始向量副本数和是否为内存映射模式
+        """
+        with self._lock:
+            return {
+                'vectors': self.vectorstore.index.ntotal if self.vectorstore is not None else 0,
+                'base_seq': self._base_seq,
+                'last_seq': self._last_seq,
+                'pending_records': self._last_seq - self._base_seq,
+                'appended_vectors': self.appended_vectors,
+                'appended_bytes': self.appended_bytes,
+                'merges': self.merges,
+                'tombstones': self.vectorstore.tombstones if self.vectorstore is not None else 0,
+                'raw_vectors': len(self._raw) if self._raw is not None else 0,
+                'mmap': self.mmap_mode
+            }
+
+    def close(self, merge: bool = False):
+        """
+        等待进行中的后台合并结束
+
+        Args:
+            merge (bool): 是否在关闭前把剩余日志合并进基线，默认为False
+        """
+        thread = self._merge_thread
+        if thread is not None:
+            thread.join()
+        if merge:
+            self.merge()
@@ -0,0 +1,280 @@
+import os
+import sys
+import json
+
+import numpy as np
+import faiss
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import FakeEmbeddings
+
+from LLM_base.faiss_index import LabeledFAISS, build_index
+from LLM_base.faiss_store import (DOCSTORE_LOG_FILE, MANIFEST_FILE, MERGE_MARKER_FILE, RAW_VECTORS_FILE,
+                                  IncrementalFAISSStore)
+
+DIMENSION = 8
+EMBEDDINGS = FakeEmbeddings(size=DIMENSION)
+
+
+def make_store(path, **kwargs) -> IncrementalFAISSStore:
+    """打开向量库目录，不存在时先创建空的Flat基线"""
+    if not os.path.exists(os.path.join(path, 'index.faiss')):
+        FAISS(embedding_function=EMBEDDINGS, index=faiss.IndexFlatL2(DIMENSION), docstore=InMemoryDocstore(),
+              index_to_docstore_id={}).save_local(path)
+    kwargs.setdefault('background_merge', False)
+    kwargs.setdefault('merge_threshold', 1000)
+    store = IncrementalFAISSStore(path, **kwargs)
+    store.load(EMBEDDINGS)
+    return store
+
+
+def add(store, names, seed=0):
+    """按名字加入文档，向量由名字确定，返回向量"""
+    rng = np.random.default_rng(seed)
+    vectors = rng.random((len(names), DIMENSION)).astype(np.float32)
+    store.add_embedded([Document(page_content=name) for name in names], vectors, ids=list(names))
+    return vectors
+
+
+def contents(store):
+    """向量库中的全部文档ID"""
+    return set(store.vectorstore.index_to_docstore_id.values())
+
+
+def read_log(path):
+    with open(os.path.join(path, DOCSTORE_LOG_FILE), 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_replay_skips_truncated_log_line(tmp_path):
+    path = str(tmp_path)
+    store = make_store(path)
+    add(store, ['a', 'b'])
+    add(store, ['c'], seed=1)
+    # 模拟追加日志写到一半时崩溃：末行只有半条记录，manifest未提交
+    with open(os.path.join(path, DOCSTORE_LOG_FILE), 'a', encoding='utf-8') as f:
+        f.write('{"seq": 3, "op": "add", "segm')
+
+    reopened = make_store(path)
+    assert contents(reopened) == {'a', 'b', 'c'}
+    # 之后的追加不能和残缺的末行粘连
+    add(reopened, ['d'], seed=2)
+    assert contents(make_store(path)) == {'a', 'b', 'c', 'd'}
+
+
+def test_uncommitted_record_is_dropped(tmp_path):
+    path = str(tmp_path)
+    store = make_store(path)
+    add(store, ['a'])
+    with open(os.path.join(path, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    add(store, ['b'], seed=1)
+    # 模拟日志和向量段已写入、manifest尚未替换时崩溃
+    with open(os.path.join(path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+    reopened = make_store(path)
+    assert contents(reopened) == {'a'}
+    assert [record['seq'] for record in read_log(path)] == [1]
+    # 重用同一seq的新记录不会与被丢弃的记录混淆
+    add(reopened, ['c'], seed=2)
+    assert contents(make_store(path)) == {'a', 'c'}
+
+
+def test_delete_records_replay_in_one_batch(tmp_path, monkeypatch):
+    path = str(tmp_path)
+    store = make_store(path)
+    add(store, ['a', 'b', 'c', 'd'])
+    store.delete(['a'])
+    store.delete(['b'])
+    add(store, ['e'], seed=1)
+    store.delete(['c'])
+
+    calls = []
+    original = LabeledFAISS.delete
+
+    def counting_delete(self, ids=None, **kwargs):
+        calls.append(list(ids))
+        return original(self, ids, **kwargs)
+
+    monkeypatch.setattr(LabeledFAISS, 'delete', counting_delete)
+    reopened = make_store(path)
+    assert contents(reopened) == {'d', 'e'}
+    assert calls == [['a', 'b', 'c']]
+
+
+def test_merge_rolls_forward_after_marker(tmp_path, monkeypatch):
+    path = str(tmp_path)
+    store = make_store(path)
+    add(store, ['a', 'b'])
+    store.merge()
+    add(store, ['c'], seed=1)
+    store.delete(['a'])
+
+    # 模拟合并标记写入后、替换基线文件前崩溃
+    real_replace = os.replace
+
+    def crash_on_index(src, dst):
+        if dst.endswith('index.faiss'):
+            raise KeyboardInterrupt("simulated crash")
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', crash_on_index)
+    with pytest.raises(KeyboardInterrupt):
+        store.merge()
+    monkeypatch.setattr(os, 'replace', real_replace)
+    assert os.path.exists(os.path.join(path, MERGE_MARKER_FILE))
+    assert os.path.exists(os.path.join(path, 'index.faiss.tmp'))
+
+    reopened = make_store(path)
+    assert contents(reopened) == {'b', 'c'}
+    assert not os.path.exists(os.path.join(path, MERGE_MARKER_FILE))
+    assert not os.path.exists(os.path.join(path, 'index.faiss.tmp'))
+    assert read_log(path) == []
+    assert reopened.stats()['base_seq'] == reopened.stats()['last_seq'] == 3
+
+
+def test_merge_without_marker_discards_temp_files(tmp_path, monkeypatch):
+    path = str(tmp_path)
+    store = make_store(path)
+    add(store, ['a'])
+    add(store, ['b'], seed=1)
+
+    # 模拟写临时文件时崩溃（合并标记尚未写入）
+    real_write = IncrementalFAISSStore._write_file
+
+    def crash_on_docstore(file_path, data):
+        if file_path.endswith('index.pkl.tmp'):
+            real_write(file_path, data[:10])
+            raise KeyboardInterrupt("simulated crash")
+        real_write(file_path, data)
+
+    monkeypatch.setattr(IncrementalFAISSStore, '_write_file', staticmethod(crash_on_docstore))
+    with pytest.raises(KeyboardInterrupt):
+        store.merge()
+    monkeypatch.undo()
+
+    reopened = make_store(path)
+    assert contents(reopened) == {'a', 'b'}
+    assert not os.path.exists(os.path.join(path, 'index.faiss.tmp'))
+    assert not os.path.exists(os.path.join(path, 'index.pkl.tmp'))
+    assert reopened.stats()['base_seq'] == 0
+
+
+def test_finish_merge_keeps_concurrent_appends(tmp_path, monkeypatch):
+    path = str(tmp_path)
+    store = make_store(path)
+    add(store, ['a'])
+
+    # 合并写盘期间（不持有锁）另一次追加和删除到达
+    real_write = IncrementalFAISSStore._write_file
+    appended = []
+
+    def write_and_append(file_path, data):
+        real_write(file_path, data)
+        if file_path.endswith('index.faiss.tmp') and not appended:
+            appended.append(True)
+            add(store, ['b'], seed=1)
+            store.delete(['a'])
+
+    monkeypatch.setattr(IncrementalFAISSStore, '_write_file', staticmethod(write_and_append))
+    store.merge()
+    monkeypatch.undo()
+
+    assert store.stats()['base_seq'] == 1
+    assert [record['seq'] for record in read_log(path)] == [2, 3]
+    segments = os.listdir(os.path.join(path, 'segments'))
+    assert segments == ['00000002.npy']
+    assert contents(make_store(path)) == {'b'}
+
+
+def test_raw_vectors_survive_roll_forward(tmp_path, monkeypatch):
+    path = str(tmp_path)
+    store = make_store(path)
+    rng = np.random.default_rng(0)
+    vectors = rng.random((300, DIMENSION)).astype(np.float32)
+    names = [f"doc{i}" for i in range(300)]
+    store.add_embedded([Document(page_content=name) for name in names], vectors, ids=names)
+    store.replace_index(lambda raw: build_index('ivf_pq', raw, params={'nlist': 4, 'pq_m': 2, 'pq_nbits': 4}))
+    extra = add(store, ['extra'], seed=1)
+
+    real_replace = os.replace
+
+    def crash_on_raw(src, dst):
+        if dst.endswith(RAW_VECTORS_FILE):
+            raise KeyboardInterrupt("simulated crash")
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', crash_on_raw)
+    with pytest.raises(KeyboardInterrupt):
+        store.merge()
+    monkeypatch.setattr(os, 'replace', real_replace)
+
+    reopened = make_store(path)
+    assert not os.path.exists(os.path.join(path, RAW_VECTORS_FILE + '.tmp'))
+    assert reopened.stats()['raw_vectors'] == 301
+    np.testing.assert_array_equal(reopened.get_vectors(['doc7'])[0], vectors[7])
+    np.testing.assert_array_equal(reopened.get_vectors(['extra'])[0], extra[0])
+
+
+def test_lossy_index_without_raw_vectors_refuses_rebuild(tmp_path):
+    path = str(tmp_path)
+    store = make_store(path)
+    rng = np.random.default_rng(0)
+    vectors = rng.random((300, DIMENSION)).astype(np.float32)
+    names = [f"doc{i}" for i in range(300)]
+    store.add_embedded([Document(page_content=name) for name in names], vectors, ids=names)
+    store.replace_index(lambda raw: build_index('ivf_pq', raw, params={'nlist': 4, 'pq_m': 2, 'pq_nbits': 4}))
+    os.remove(os.path.join(path, RAW_VECTORS_FILE))
+
+    reopened = make_store(path)
+    assert reopened.get_vectors(['doc7']) == [None]
+    with pytest.raises(RuntimeError):
+        reopened.replace_index(lambda raw: build_index('flat', raw))
+    assert contents(reopened) == set(names)
+
+
+def test_failed_build_keeps_current_index(tmp_path):
+    path = str(tmp_path)
+    store = make_store(path)
+    add(store, ['a', 'b'])
+
+    def failing_build(vectors):
+        raise ValueError("build failed")
+
+    with pytest.raises(ValueError):
+        store.replace_index(failing_build)
+    assert contents(store) == {'a', 'b'}
+    assert contents(make_store(path)) == {'a', 'b'}
+
+
+def test_hnsw_tombstones_are_compacted_at_merge(tmp_path):
+    path = str(tmp_path)
+    store = make_store(path, compact_ratio=0.2)
+    rng = np.random.default_rng(0)
+    vectors = rng.random((100, DIMENSION)).astype(np.float32)
+    names = [f"doc{i}" for i in range(100)]
+    store.add_embedded([Document(page_content=name) for name in names], vectors, ids=names)
+    store.replace_index(lambda raw: build_index('hnsw', raw))
+
+    store.delete(names[:10])
+    assert store.stats()['tombstones'] == 10
+    found = store.vectorstore.similarity_search_with_score_by_vector(vectors[3], k=5)
+    assert all(doc.page_content not in names[:10] for doc, _ in found)
+    # 墓碑占比未到阈值：合并不重建，墓碑随快照保存
+    store.merge()
+    reopened = make_store(path, compact_ratio=0.2)
+    assert reopened.stats()['tombstones'] == 10
+
+    reopened.delete(names[10:20])
+    reopened.merge()
+    assert reopened.stats()['tombstones'] == 0
+    assert reopened.vectorstore.index.ntotal == 80
+    doc, _ = reopened.vectorstore.similarity_search_with_score_by_vector(vectors[50], k=1)[0]
+    assert doc.page_content == 'doc50'
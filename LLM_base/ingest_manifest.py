@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+INGEST_MANIFEST_FILE = "ingest_manifest.json"
+
+# 文件状态
+FILE_NEW = "new"
+FILE_CHANGED = "changed"
+FILE_UNCHANGED = "unchanged"
+
+
+def file_digest(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """
+    计算文件内容的SHA-256摘要
+
+    Args:
+        file_path (str): 文件路径
+        block_size (int): 每次读取的字节数，默认为1MB
+
+    Returns:
+        str: 十六进制摘要
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    """
+    向量库旁的导入清单（ingest_manifest.json）
+
+    记录每个已导入文件的修改时间、大小、内容摘要，以及它在向量库中的每个文档块
+    （文档ID和文本摘要）：
+        {'files': {绝对路径: {'mtime', 'size', 'sha256', 'chunks': [{'id', 'hash'}, ...]}}}
+
+    修改时间和大小都没变的文件直接视为未变化，不重新计算摘要；摘要相同的文件只刷新修改时间。
+    """
+
+    def __init__(self, directory: str):
+        """
+        初始化导入清单
+
+        Args:
+            directory (str): 清单所在目录（向量库目录）
+        """
+        self.path = os.path.join(directory, INGEST_MANIFEST_FILE)
+        # 清单文件是否已存在；不存在说明向量库可能是清单功能之前创建的
+        self.exists = os.path.exists(self.path)
+        self._lock = threading.Lock()
+        self.files: Dict[str, Dict[str, Any]] = {}
+        # 文本摘要 -> 文档ID，延迟构建
+        self._chunk_index: Optional[Dict[str, str]] = None
+        self._dirty = False
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.files = json.load(f).get('files', {})
+                logger.info(f"加载导入清单: {self.path}，共{len(self.files)}个文件")
+            except Exception as e:
+                logger.error(f"读取导入清单失败，将按新文件重新导入: {e}")
+                self.files = {}
+
+    @staticmethod
+    def file_key(file_path: str) -> str:
+        return os.path.abspath(file_path)
+
+    def check(self, file_path: str) -> Tuple[str, Optional[str]]:
+        """
+        判断文件相对上次导入是否有变化
+
+        Args:
+            file_path (str): 文件路径
+
+        Returns:
+            Tuple[str, Optional[str]]: (状态, 内容摘要)，状态为"new"、"changed"或"unchanged"；
+                修改时间和大小未变时不计算摘要，返回记录中的摘要
+        """
+        key = self.file_key(file_path)
+        stat = os.stat(file_path)
+        with self._lock:
+            entry = self.files.get(key)
+        if entry is None:
+            return FILE_NEW, file_digest(file_path)
+        if entry.get('sha256') is None:
+            # 上次导入不完整（有文档块嵌入失败）
+            return FILE_CHANGED, file_digest(file_path)
+        if entry.get('mtime') == stat.st_mtime and entry.get('size') == stat.st_size:
+            return FILE_UNCHANGED, entry.get('sha256')
+        digest = file_digest(file_path)
+        if digest == entry.get('sha256'):
+            # 内容没变（例如只是被touch过），刷新修改时间以便下次走快速路径
+            with self._lock:
+                entry['mtime'] = stat.st_mtime
+                entry['size'] = stat.st_size
+                self._dirty = True
+            return FILE_UNCHANGED, digest
+        return FILE_CHANGED, digest
+
+    def chunks(self, file_path: str) -> List[Dict[str, str]]:
+        """
+        获取文件上次导入的文档块
+
+        Args:
+            file_path (str): 文件路径
+
+        Returns:
+            List[Dict[str, str]]: [{'id': 文档ID, 'hash': 文本摘要}, ...]
+        """
+        with self._lock:
+            entry = self.files.get(self.file_key(file_path))
+            return list(entry['chunks']) if entry else []
+
+    def record(self, file_path: str, digest: Optional[str], chunks: List[Dict[str, str]]):
+        """
+        记录文件本次导入的结果
+
+        Args:
+            file_path (str): 文件路径
+            digest (str): 文件内容摘要，为None表示本次导入不完整，下次按有变化处理
+            chunks (List[Dict[str, str]]): 文件在向量库中的全部文档块
+        """
+        stat = os.stat(file_path)
+        with self._lock:
+            self.files[self.file_key(file_path)] = {
+                'mtime': stat.st_mtime,
+                'size': stat.st_size,
+                'sha256': digest,
+                'chunks': chunks,
+                'ingested': time.time()
+            }
+            self._chunk_index = None
+            self._dirty = True
+
+    def adopt(self, chunks_by_source: Dict[str, List[Dict[str, str]]]):
+        """
+        登记清单出现之前就已导入的文件：只记录文档块、不记录摘要，
+        下次导入这些文件时按有变化处理，并以登记的块作为上次导入的文档块
+
+        Args:
+            chunks_by_source (Dict[str, List[Dict[str, str]]]): 来源文件绝对路径 -> [{'id', 'hash'}, ...]
+        """
+        with self._lock:
+            for key, chunks in chunks_by_source.items():
+                if key not in self.files:
+                    self.files[key] = {'mtime': None, 'size': None, 'sha256': None, 'chunks': chunks, 'ingested': None}
+            self._chunk_index = None
+            # 即使没有可登记的文件也写入清单，之后不再扫描向量库
+            self._dirty = True
+
+    def find_chunk(self, chunk_hash: str) -> Optional[str]:
+        """
+        查找已导入的、文本摘要相同的文档块
+
+        Args:
+            chunk_hash (str): 文本摘要
+
+        Returns:
+            Optional[str]: 文档ID，没有则返回None
+        """
+        with self._lock:
+            if self._chunk_index is None:
+                self._chunk_index = {
+                    chunk['hash']: chunk['id'] for entry in self.files.values() for chunk in entry['chunks']
+                }
+            return self._chunk_index.get(chunk_hash)
+
+    def save(self):
+        """原子写入清单文件（没有变化时不写）"""
+        with self._lock:
+            if not self._dirty:
+                return
+            temp_file = self.path + '.tmp'
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump({'version': 1, 'files': self.files}, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.path)
+            self._dirty = False
+            self.exists = True
@@ -0,0 +1,119 @@
+import os
+import sys
+import json
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM_base.ingest_manifest import (FILE_CHANGED, FILE_NEW, FILE_UNCHANGED, INGEST_MANIFEST_FILE,
+                                      IngestManifest, file_digest)
+
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return str(path)
+
+
+def test_record_and_reload(tmp_path):
+    source = write(tmp_path / "a.txt", "hello")
+    manifest = IngestManifest(str(tmp_path))
+    assert not manifest.exists
+    status, digest = manifest.check(source)
+    assert status == FILE_NEW
+    manifest.record(source, digest, [{'id': "doc1", 'hash': "h1"}])
+    manifest.save()
+
+    reopened = IngestManifest(str(tmp_path))
+    assert reopened.exists
+    assert reopened.check(source) == (FILE_UNCHANGED, digest)
+    assert reopened.chunks(source) == [{'id': "doc1", 'hash': "h1"}]
+    assert reopened.find_chunk("h1") == "doc1"
+
+
+def test_crash_before_save_keeps_previous_manifest(tmp_path):
+    source = write(tmp_path / "a.txt", "v1")
+    manifest = IngestManifest(str(tmp_path))
+    _, digest = manifest.check(source)
+    manifest.record(source, digest, [{'id': "old", 'hash': "h1"}])
+    manifest.save()
+
+    # 模拟向量已写入、清单尚未保存时崩溃：内存中的记录丢失
+    write(tmp_path / "a.txt", "v2 longer")
+    crashed = IngestManifest(str(tmp_path))
+    _, new_digest = crashed.check(source)
+    crashed.record(source, new_digest, [{'id': "new", 'hash': "h2"}])
+
+    reopened = IngestManifest(str(tmp_path))
+    status, _ = reopened.check(source)
+    assert status == FILE_CHANGED
+    # 下次导入以上次保存的块为基准删除失效的块
+    assert reopened.chunks(source) == [{'id': "old", 'hash': "h1"}]
+
+
+def test_leftover_temp_file_is_ignored(tmp_path):
+    source = write(tmp_path / "a.txt", "hello")
+    manifest = IngestManifest(str(tmp_path))
+    _, digest = manifest.check(source)
+    manifest.record(source, digest, [])
+    manifest.save()
+    # 模拟写临时文件时崩溃
+    with open(os.path.join(str(tmp_path), INGEST_MANIFEST_FILE + '.tmp'), 'w', encoding='utf-8') as f:
+        f.write('{"version": 1, "files": {')
+
+    reopened = IngestManifest(str(tmp_path))
+    assert reopened.check(source) == (FILE_UNCHANGED, digest)
+    reopened.record(source, digest, [{'id': "doc1", 'hash': "h1"}])
+    reopened.save()
+    with open(os.path.join(str(tmp_path), INGEST_MANIFEST_FILE), 'r', encoding='utf-8') as f:
+        assert json.load(f)['files'][IngestManifest.file_key(source)]['chunks'] == [{'id': "doc1", 'hash': "h1"}]
+
+
+def test_corrupt_manifest_treats_files_as_new(tmp_path):
+    source = write(tmp_path / "a.txt", "hello")
+    with open(os.path.join(str(tmp_path), INGEST_MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        f.write('{"files": ')
+
+    manifest = IngestManifest(str(tmp_path))
+    assert manifest.files == {}
+    assert manifest.check(source)[0] == FILE_NEW
+
+
+def test_incomplete_ingest_is_retried(tmp_path):
+    source = write(tmp_path / "a.txt", "hello")
+    manifest = IngestManifest(str(tmp_path))
+    # 有块嵌入失败时不记录摘要
+    manifest.record(source, None, [{'id': "doc1", 'hash': "h1"}])
+    manifest.save()
+
+    reopened = IngestManifest(str(tmp_path))
+    assert reopened.check(source) == (FILE_CHANGED, file_digest(source))
+    assert reopened.chunks(source) == [{'id': "doc1", 'hash': "h1"}]
+
+
+def test_touched_file_is_unchanged(tmp_path):
+    source = write(tmp_path / "a.txt", "hello")
+    manifest = IngestManifest(str(tmp_path))
+    _, digest = manifest.check(source)
+    manifest.record(source, digest, [])
+    manifest.save()
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    reopened = IngestManifest(str(tmp_path))
+    assert reopened.check(source) == (FILE_UNCHANGED, digest)
+    reopened.save()
+    # 刷新后的修改时间已保存，之后走快速路径
+    assert IngestManifest(str(tmp_path)).files[IngestManifest.file_key(source)]['mtime'] == os.stat(source).st_mtime
+
+
+def test_adopt_legacy_chunks(tmp_path):
+    source = write(tmp_path / "a.txt", "hello")
+    manifest = IngestManifest(str(tmp_path))
+    manifest.adopt({IngestManifest.file_key(source): [{'id': "doc1", 'hash': "h1"}]})
+    manifest.save()
+
+    reopened = IngestManifest(str(tmp_path))
+    assert reopened.exists
+    assert reopened.check(source)[0] == FILE_CHANGED
+    assert reopened.chunks(source) == [{'id': "doc1", 'hash': "h1"}]
@@ -0,0 +1,249 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def estimate_memory_bytes(memory: Any) -> int:
+    """
+    估算ConversationBufferMemory占用的字节数（按消息内容的UTF-8长度计）
+
+    Args:
+        memory: 记忆实例
+
+    Returns:
+        int: 估算的字节数
+    """
+    chat_memory = getattr(memory, 'chat_memory', None)
+    messages = getattr(chat_memory, 'messages', None) or []
+    total = 0
+    for message in messages:
+        content = getattr(message, 'content', '')
+        if not isinstance(content, str):
+            content = str(content)
+        total += len(content.encode('utf-8'))
+    return total
+
+
+class MemoryCache:
+    """
+    按条数、字节数和空闲时间限制的LRU记忆缓存
+
+    被淘汰的条目在锁内选出并移出缓存，释放锁后再交给on_evict回调（通常是落盘保存），
+    避免一个对话的落盘阻塞其他对话的读写；下次访问时由调用方重新从文件加载，
+    若该对话仍在落盘，get会等待落盘完成后再返回未命中。
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024,
+                 ttl: Optional[float] = None,
+                 on_evict: Optional[Callable[[str, Any], None]] = None,
+                 size_fn: Callable[[Any], int] = estimate_memory_bytes):
+        """
+        初始化记忆缓存
+
+        Args:
+            max_entries (int): 最多缓存的对话数，默认为256
+            max_bytes (int): 缓存总字节数上限，默认为64MB
+            ttl (float, optional): 空闲超过该秒数的对话将被淘汰，默认为None（不按时间淘汰）
+            on_evict (Callable, optional): 淘汰回调，参数为(conversation_id, memory)
+            size_fn (Callable): 计算单个记忆大小的函数
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.size_fn = size_fn
+
+        self._lock = threading.RLock()
+        # conversation_id -> [memory, 字节数, 最后访问时间]
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+        self._total_bytes = 0
+        # 已移出缓存、on_evict尚未完成的对话 -> 完成事件
+        self._evicting: Dict[str, threading.Event] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __contains__(self, conversation_id: str) -> bool:
+        with self._lock:
+            return conversation_id in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __getitem__(self, conversation_id: str) -> Any:
+        memory = self.get(conversation_id)
+        if memory is None:
+            raise KeyError(conversation_id)
+        return memory
+
+    def __setitem__(self, conversation_id: str, memory: Any):
+        self.put(conversation_id, memory)
+
+    def get(self, conversation_id: str) -> Optional[Any]:
+        """
+        获取缓存的记忆，命中时移到LRU末尾
+
+        Args:
+            conversation_id (str): 对话ID
+
+        Returns:
+            Optional[Any]: 记忆实例，未命中返回None
+        """
+        pending = None
+        with self._lock:
+            victims = self._expire(time.time())
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                self.misses += 1
+                pending = self._evicting.get(conversation_id)
+            else:
+                self.hits += 1
+                entry[2] = time.time()
+                self._entries.move_to_end(conversation_id)
+        self._run_evictions(victims)
+        if entry is None:
+            if pending is not None:
+                # 该对话正在落盘，等写完后再由调用方从文件加载，避免读到旧快照
+                pending.wait()
+            return None
+        return entry[0]
+
+    def put(self, conversation_id: str, memory: Any):
+        """
+        放入或更新记忆，并按容量淘汰最久未用的对话
+
+        Args:
+            conversation_id (str): 对话ID
+            memory (Any): 记忆实例
+        """
+        with self._lock:
+            size = self.size_fn(memory)
+            old = self._entries.pop(conversation_id, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+            self._entries[conversation_id] = [memory, size, time.time()]
+            self._total_bytes += size
+            victims = self._shrink(keep=conversation_id)
+        self._run_evictions(victims)
+
+    def refresh(self, conversation_id: str):
+        """
+        记忆内容增长后重新计算其大小并检查容量
+
+        Args:
+            conversation_id (str): 对话ID
+        """
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None:
+                return
+            size = self.size_fn(entry[0])
+            self._total_bytes += size - entry[1]
+            entry[1] = size
+            entry[2] = time.time()
+            self._entries.move_to_end(conversation_id)
+            victims = self._shrink(keep=conversation_id)
+        self._run_evictions(victims)
+
+    def pop(self, conversation_id: str, default: Any = None) -> Any:
+        """
+        移除记忆（不触发淘汰回调）
+
+        Args:
+            conversation_id (str): 对话ID
+            default: 不存在时的返回值
+
+        Returns:
+            Any: 被移除的记忆实例
+        """
+        with self._lock:
+            entry = self._entries.pop(conversation_id, None)
+            if entry is None:
+                return default
+            self._total_bytes -= entry[1]
+            return entry[0]
+
+    def _evict(self, conversation_id: str) -> Tuple[str, Any, threading.Event]:
+        """把单个条目移出缓存，返回待回调的淘汰项（调用方需持有锁）"""
+        memory, size, _ = self._entries.pop(conversation_id)
+        self._total_bytes -= size
+        self.evictions += 1
+        done = threading.Event()
+        self._evicting[conversation_id] = done
+        return conversation_id, memory, done
+
+    def _run_evictions(self, victims: List[Tuple[str, Any, threading.Event]]):
+        """在锁外依次执行淘汰回调"""
+        for conversation_id, memory, done in victims:
+            try:
+                if self.on_evict is not None:
+                    self.on_evict(conversation_id, memory)
+            except Exception as e:
+                logger.error(f"淘汰记忆时保存失败: {conversation_id}: {e}")
+            finally:
+                with self._lock:
+                    if self._evicting.get(conversation_id) is done:
+                        del self._evicting[conversation_id]
+                done.set()
+
+    def _expire(self, now: float) -> List[Tuple[str, Any, threading.Event]]:
+        """选出空闲超时的条目并移出缓存（调用方需持有锁）"""
+        victims = []
+        if self.ttl is None:
+            return victims
+        while self._entries:
+            conversation_id, entry = next(iter(self._entries.items()))
+            if now - entry[2] < self.ttl:
+                break
+            victims.append(self._evict(conversation_id))
+            self.expirations += 1
+        return victims
+
+    def _shrink(self, keep: Optional[str] = None) -> List[Tuple[str, Any, threading.Event]]:
+        """按条数和字节数上限选出淘汰条目，keep指定的条目最后才考虑（调用方需持有锁）"""
+        victims = self._expire(time.time())
+        while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            victim = next(iter(self._entries))
+            if victim == keep:
+                if len(self._entries) == 1:
+                    # 单个对话本身超过字节上限，仍保留在缓存中
+                    break
+                self._entries.move_to_end(keep)
+                continue
+            victims.append(self._evict(victim))
+        return victims
+
+    def evict_all(self):
+        """淘汰全部条目（例如关闭前落盘）"""
+        with self._lock:
+            victims = [self._evict(conversation_id) for conversation_id in list(self._entries)]
+        self._run_evictions(victims)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计信息
+
+        Returns:
+            Dict[str, Any]: 命中、未命中、淘汰计数及当前占用
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import threading
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM_base.memory_cache import MemoryCache
+
+
+def make_cache(**kwargs):
+    """记忆用字符串代替，大小按字符数计算；返回缓存和淘汰记录"""
+    evicted = []
+    kwargs.setdefault('size_fn', len)
+    cache = MemoryCache(on_evict=lambda cid, memory: evicted.append(cid), **kwargs)
+    return cache, evicted
+
+
+def test_evicts_least_recently_used_by_count():
+    cache, evicted = make_cache(max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+    cache.put("c", "3")
+    assert evicted == ["b"]
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_evicts_by_bytes_and_refresh():
+    cache, evicted = make_cache(max_bytes=10)
+    cache.put("a", "xxxx")
+    cache.put("b", "yyyy")
+    assert evicted == []
+    # 记忆在原地增长后refresh重新计算大小
+    cache._entries["b"][0] = "yyyyyyyy"
+    cache.refresh("b")
+    assert evicted == ["a"]
+    assert cache.stats()['bytes'] == 8
+
+
+def test_single_oversized_entry_is_kept():
+    cache, evicted = make_cache(max_bytes=4)
+    cache.put("a", "x" * 10)
+    assert evicted == []
+    assert cache.get("a") == "x" * 10
+
+
+def test_idle_entries_expire():
+    cache, evicted = make_cache(ttl=0.2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    time.sleep(0.12)
+    assert cache.get("b") == "2"
+    time.sleep(0.12)
+    # a空闲超时，b刚被访问过
+    assert cache.get("b") == "2"
+    assert evicted == ["a"]
+    assert cache.stats()['expirations'] == 1
+
+
+def test_pop_does_not_call_on_evict():
+    cache, evicted = make_cache()
+    cache.put("a", "1")
+    assert cache.pop("a") == "1"
+    assert cache.pop("a", "missing") == "missing"
+    assert evicted == []
+
+
+def test_get_waits_for_running_eviction():
+    started = threading.Event()
+    release = threading.Event()
+    saved = []
+
+    def slow_evict(cid, memory):
+        started.set()
+        release.wait(5)
+        saved.append(cid)
+
+    cache = MemoryCache(max_entries=1, size_fn=len, on_evict=slow_evict)
+    cache.put("a", "1")
+    evicting = threading.Thread(target=cache.put, args=("b", "2"))
+    evicting.start()
+    assert started.wait(5)
+    # 淘汰回调在锁外执行，其他对话的读写不受影响
+    assert cache.get("b") == "2"
+
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(cache.get("a")))
+    waiter.start()
+    waiter.join(0.1)
+    assert waiter.is_alive()
+    release.set()
+    waiter.join(5)
+    evicting.join(5)
+    # 落盘完成后才返回未命中，调用方不会读到旧快照
+    assert result == [None]
+    assert saved == ["a"]
@@ -0,0 +1,366 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class MemoryJournal:
+    """
+    对话记忆的追加式日志存储
+
+    每个conversation_id对应两个文件：
+        {conversation_id}.json   快照文件，格式与旧版一致 {'conversations': [...], 'last_seq': n}
+        {conversation_id}.jsonl  追加日志，每行一条 {'seq': n, 'Human': ..., 'AI': ...}
+
+    每轮对话只追加一行日志，fsync由后台线程成组提交；日志条数超过阈值时
+    由调用方重写快照并截断日志（压缩）。加载时读取快照后重放seq更大的日志记录，
+    因此压缩过程中途崩溃也不会产生重复记录。
+    """
+
+    def __init__(self, memory_dir: str, fsync_interval: float = 0.05,
+                 compact_threshold: int = 200, max_open_files: int = 64):
+        """
+        初始化日志存储
+
+        Args:
+            memory_dir (str): 记忆文件目录
+            fsync_interval (float): 成组fsync的时间窗口（秒），默认为0.05
+            compact_threshold (int): 日志记录数达到该值时建议压缩，默认为200
+            max_open_files (int): 同时保持打开的日志文件句柄上限，默认为64
+        """
+        self.memory_dir = memory_dir
+        self.fsync_interval = fsync_interval
+        self.compact_threshold = compact_threshold
+        self.max_open_files = max_open_files
+
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+        # 串行化成组fsync；fsync在_lock之外执行，期间append不被阻塞
+        self._flush_lock = threading.Lock()
+        # conversation_id -> 打开的日志文件句柄（LRU顺序）
+        self._handles: "OrderedDict[str, Any]" = OrderedDict()
+        # conversation_id -> 最后写入的seq
+        self._last_seq: Dict[str, int] = {}
+        # conversation_id -> 日志中尚未压缩的记录数
+        self._journal_records: Dict[str, int] = {}
+        # 等待fsync的conversation_id集合
+        self._dirty: set = set()
+        # 写入批次号与已持久化批次号，用于成组提交时等待
+        self._write_ticket = 0
+        self._synced_ticket = 0
+
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name="MemoryJournalFlusher")
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def snapshot_path(self, conversation_id: str) -> str:
+        """
+        获取快照文件路径
+
+        Args:
+            conversation_id (str): 对话ID
+
+        Returns:
+            str: 快照文件的完整路径
+        """
+        return os.path.join(self.memory_dir, f"{conversation_id}.json")
+
+    def journal_path(self, conversation_id: str) -> str:
+        """
+        获取追加日志文件路径
+
+        Args:
+            conversation_id (str): 对话ID
+
+        Returns:
+            str: 日志文件的完整路径
+        """
+        return os.path.join(self.memory_dir, f"{conversation_id}.jsonl")
+
+    def exists(self, conversation_id: str) -> bool:
+        """
+        检查对话是否已有持久化记录
+
+        Args:
+            conversation_id (str): 对话ID
+
+        Returns:
+            bool: 快照或日志任一存在即返回True
+        """
+        return os.path.exists(self.snapshot_path(conversation_id)) or \
+            os.path.exists(self.journal_path(conversation_id))
+
+    def _read_snapshot(self, conversation_id: str) -> Tuple[List[Dict[str, str]], int]:
+        """
+        读取快照文件，兼容旧版 {'conversations': [...]} 格式
+
+        Returns:
+            Tuple[List[Dict[str, str]], int]: 对话列表和快照覆盖到的seq
+        """
+        file_path = self.snapshot_path(conversation_id)
+        if not os.path.exists(file_path):
+            return [], 0
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        conversations = [
+            {'Human': conv['Human'], 'AI': conv['AI']}
+            for conv in data.get('conversations', [])
+            if 'Human' in conv and 'AI' in conv
+        ]
+        # 旧版文件没有last_seq，视为0
+        return conversations, int(data.get('last_seq', 0))
+
+    def _read_journal(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """
+        读取追加日志，跳过末尾可能被截断的半行
+
+        Returns:
+            List[Dict[str, Any]]: 日志记录列表
+        """
+        file_path = self.journal_path(conversation_id)
+        records = []
+        if not os.path.exists(file_path):
+            return records
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"跳过损坏的日志记录: {file_path} 第{line_no}行")
+                    continue
+                if 'Human' in record and 'AI' in record:
+                    records.append(record)
+        return records
+
+    def load(self, conversation_id: str) -> List[Dict[str, str]]:
+        """
+        加载快照并重放日志，返回完整对话列表
+
+        Args:
+            conversation_id (str): 对话ID
+
+        Returns:
+            List[Dict[str, str]]: 按时间顺序排列的 {'Human': ..., 'AI': ...} 列表
+        """
+        with self._lock:
+            conversations, last_seq = self._read_snapshot(conversation_id)
+            max_seq = last_seq
+            replayed = 0
+            for record in self._read_journal(conversation_id):
+                seq = int(record.get('seq', 0))
+                if seq <= last_seq:
+                    # 已被快照覆盖（压缩中途崩溃留下的旧记录）
+                    continue
+                conversations.append({'Human': record['Human'], 'AI': record['AI']})
+                max_seq = max(max_seq, seq)
+                replayed += 1
+            self._last_seq[conversation_id] = max_seq
+            self._journal_records[conversation_id] = replayed
+        logger.info(f"加载记忆: {conversation_id}，快照{len(conversations) - replayed}条，重放日志{replayed}条")
+        return conversations
+
+    def _ensure_seq_loaded(self, conversation_id: str):
+        """确保已知该对话的最后seq（调用方需持有锁）"""
+        if conversation_id in self._last_seq:
+            return
+        _, last_seq = self._read_snapshot(conversation_id)
+        records = self._read_journal(conversation_id)
+        max_seq = max([last_seq] + [int(r.get('seq', 0)) for r in records])
+        self._last_seq[conversation_id] = max_seq
+        self._journal_records[conversation_id] = sum(1 for r in records if int(r.get('seq', 0)) > last_seq)
+
+    def _get_handle(self, conversation_id: str):
+        """获取日志文件的追加句柄，超过上限时关闭最久未用的句柄（调用方需持有锁）"""
+        handle = self._handles.get(conversation_id)
+        if handle is not None:
+            self._handles.move_to_end(conversation_id)
+            return handle
+        while len(self._handles) >= self.max_open_files:
+            old_id, old_handle = self._handles.popitem(last=False)
+            self._sync_handle(old_id, old_handle)
+            old_handle.close()
+        journal_file = self.journal_path(conversation_id)
+        # 上次崩溃可能留下不完整的末行，先补换行避免与新记录粘连
+        needs_newline = False
+        if os.path.exists(journal_file) and os.path.getsize(journal_file) > 0:
+            with open(journal_file, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b'\n'
+        handle = open(journal_file, 'a', encoding='utf-8')
+        if needs_newline:
+            handle.write('\n')
+        self._handles[conversation_id] = handle
+        return handle
+
+    def _sync_handle(self, conversation_id: str, handle):
+        """对单个句柄执行fsync（调用方需持有锁）"""
+        if conversation_id in self._dirty:
+            handle.flush()
+            os.fsync(handle.fileno())
+            self._dirty.discard(conversation_id)
+
+    def append(self, conversation_id: str, human: str, ai: str, wait_durable: bool = False) -> int:
+        """
+        追加一轮对话到日志
+
+        Args:
+            conversation_id (str): 对话ID
+            human (str): 用户输入
+            ai (str): AI回复
+            wait_durable (bool): 是否等待本条记录随下一次成组fsync落盘，默认为False
+
+        Returns:
+            int: 该对话日志中尚未压缩的记录数
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("MemoryJournal已关闭")
+            self._ensure_seq_loaded(conversation_id)
+            seq = self._last_seq[conversation_id] + 1
+            record = {'seq': seq, 'ts': time.time(), 'Human': human, 'AI': ai}
+            handle = self._get_handle(conversation_id)
+            handle.write(json.dumps(record, ensure_ascii=False) + '\n')
+            handle.flush()
+            self._last_seq[conversation_id] = seq
+            self._journal_records[conversation_id] = self._journal_records.get(conversation_id, 0) + 1
+            self._dirty.add(conversation_id)
+            self._write_ticket += 1
+            ticket = self._write_ticket
+            if wait_durable:
+                while self._synced_ticket < ticket and not self._closed:
+                    self._synced.wait()
+            return self._journal_records[conversation_id]
+
+    def needs_compaction(self, conversation_id: str) -> bool:
+        """
+        判断日志是否达到压缩阈值
+
+        Args:
+            conversation_id (str): 对话ID
+
+        Returns:
+            bool: 是否需要压缩
+        """
+        with self._lock:
+            return self._journal_records.get(conversation_id, 0) >= self.compact_threshold
+
+    def write_snapshot(self, conversation_id: str, conversations: List[Dict[str, str]]):
+        """
+        原子性写入完整快照并截断日志（压缩）
+
+        Args:
+            conversation_id (str): 对话ID
+            conversations (List[Dict[str, str]]): 完整对话列表，需包含日志中的全部记录
+        """
+        file_path = self.snapshot_path(conversation_id)
+        temp_file = file_path + '.tmp'
+        with self._lock:
+            self._ensure_seq_loaded(conversation_id)
+            last_seq = self._last_seq[conversation_id]
+            try:
+                with open(temp_file, 'w', encoding='utf-8') as f:
+                    json.dump({'conversations': conversations, 'last_seq': last_seq}, f, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_file, file_path)
+            except Exception:
+                if os.path.exists(temp_file):
+                    try:
+                        os.remove(temp_file)
+                    except OSError:
+                        pass
+                raise
+
+            # 快照已覆盖last_seq之前的所有记录，日志可以安全截断
+            handle = self._handles.pop(conversation_id, None)
+            if handle is not None:
+                handle.close()
+            self._dirty.discard(conversation_id)
+            journal_file = self.journal_path(conversation_id)
+            if os.path.exists(journal_file):
+                os.remove(journal_file)
+            self._journal_records[conversation_id] = 0
+        logger.info(f"记忆快照已写入并压缩日志: {file_path}，共{len(conversations)}条对话")
+
+    def flush(self):
+        """
+        立即对所有待提交的日志执行fsync
+
+        在锁内取走脏句柄集合并复制文件描述符，fsync在锁外执行，
+        句柄在此期间被关闭或日志被压缩都不影响复制出的描述符。
+        """
+        with self._flush_lock:
+            with self._lock:
+                ticket = self._write_ticket
+                pending = []
+                for conversation_id in self._dirty:
+                    handle = self._handles.get(conversation_id)
+                    if handle is not None:
+                        pending.append((conversation_id, os.dup(handle.fileno())))
+                self._dirty.clear()
+
+            failed = []
+            for conversation_id, fd in pending:
+                try:
+                    os.fsync(fd)
+                except OSError as e:
+                    logger.error(f"日志fsync失败: {conversation_id}: {e}")
+                    failed.append(conversation_id)
+                finally:
+                    os.close(fd)
+
+            with self._lock:
+                # 失败的句柄留待下一次提交重试
+                self._dirty.update(cid for cid in failed if cid in self._handles)
+                self._synced_ticket = max(self._synced_ticket, ticket)
+                self._synced.notify_all()
+
+    def _flush_loop(self):
+        """后台成组提交线程"""
+        while True:
+            time.sleep(self.fsync_interval)
+            with self._lock:
+                if self._closed:
+                    return
+                if not self._dirty:
+                    continue
+            self.flush()
+
+    def forget(self, conversation_id: str):
+        """
+        释放某个对话在内存中的句柄和计数（数据保留在磁盘上）
+
+        Args:
+            conversation_id (str): 对话ID
+        """
+        with self._lock:
+            handle = self._handles.pop(conversation_id, None)
+            if handle is not None:
+                self._sync_handle(conversation_id, handle)
+                handle.close()
+            self._last_seq.pop(conversation_id, None)
+            self._journal_records.pop(conversation_id, None)
+
+    def close(self):
+        """刷新并关闭所有日志句柄"""
+        self.flush()
+        with self._lock:
+            if self._closed:
+                return
+            for conversation_id, handle in self._handles.items():
+                self._sync_handle(conversation_id, handle)
+                handle.close()
+            self._handles.clear()
+            self._closed = True
+            self._synced.notify_all()
+        logger.info("MemoryJournal已关闭")
@@ -0,0 +1,151 @@
+import os
+import sys
+import json
+import time
+import threading
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM_base.memory_journal import MemoryJournal
+
+CONVERSATION = "crash_test"
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = MemoryJournal(str(tmp_path))
+    yield journal
+    journal.close()
+
+
+def reopen(tmp_path) -> MemoryJournal:
+    """模拟进程重启：新的实例只从磁盘读取"""
+    return MemoryJournal(str(tmp_path))
+
+
+def turns(conversations):
+    return [conv['Human'] for conv in conversations]
+
+
+def test_truncated_last_line_is_skipped(tmp_path, journal):
+    journal.append(CONVERSATION, "q1", "a1")
+    journal.append(CONVERSATION, "q2", "a2")
+    journal.close()
+    # 模拟写到一半时崩溃
+    with open(journal.journal_path(CONVERSATION), 'a', encoding='utf-8') as f:
+        f.write('{"seq": 3, "Human": "q3", "A')
+
+    reopened = reopen(tmp_path)
+    assert turns(reopened.load(CONVERSATION)) == ["q1", "q2"]
+    # 新记录不会与残缺的末行粘连，seq接着已有的记录
+    reopened.append(CONVERSATION, "q3", "a3", wait_durable=True)
+    reopened.close()
+
+    again = reopen(tmp_path)
+    assert turns(again.load(CONVERSATION)) == ["q1", "q2", "q3"]
+    again.close()
+
+
+def test_crash_after_snapshot_before_truncation(tmp_path, journal):
+    for i in range(3):
+        journal.append(CONVERSATION, f"q{i}", f"a{i}")
+    conversations = journal.load(CONVERSATION)
+    journal_file = journal.journal_path(CONVERSATION)
+    with open(journal_file, 'r', encoding='utf-8') as f:
+        journal_before = f.read()
+    journal.write_snapshot(CONVERSATION, conversations)
+    journal.close()
+    # 模拟快照已替换、日志尚未删除时崩溃：旧记录仍在日志中
+    with open(journal_file, 'w', encoding='utf-8') as f:
+        f.write(journal_before)
+
+    reopened = reopen(tmp_path)
+    assert turns(reopened.load(CONVERSATION)) == ["q0", "q1", "q2"]
+    reopened.append(CONVERSATION, "q3", "a3", wait_durable=True)
+    reopened.close()
+
+    again = reopen(tmp_path)
+    assert turns(again.load(CONVERSATION)) == ["q0", "q1", "q2", "q3"]
+    again.close()
+
+
+def test_crash_while_writing_snapshot(tmp_path, journal):
+    journal.append(CONVERSATION, "q0", "a0")
+    journal.append(CONVERSATION, "q1", "a1", wait_durable=True)
+    journal.close()
+    # 模拟写快照临时文件时崩溃：临时文件残缺，正式快照和日志都未改动
+    with open(journal.snapshot_path(CONVERSATION) + '.tmp', 'w', encoding='utf-8') as f:
+        f.write('{"conversations": [{"Human": "q0"')
+
+    reopened = reopen(tmp_path)
+    conversations = reopened.load(CONVERSATION)
+    assert turns(conversations) == ["q0", "q1"]
+    # 下一次压缩覆盖残留的临时文件
+    reopened.write_snapshot(CONVERSATION, conversations)
+    assert not os.path.exists(reopened.snapshot_path(CONVERSATION) + '.tmp')
+    assert not os.path.exists(reopened.journal_path(CONVERSATION))
+    reopened.close()
+
+    again = reopen(tmp_path)
+    assert turns(again.load(CONVERSATION)) == ["q0", "q1"]
+    again.close()
+
+
+def test_legacy_snapshot_without_seq(tmp_path, journal):
+    with open(journal.snapshot_path(CONVERSATION), 'w', encoding='utf-8') as f:
+        json.dump({'conversations': [{'Human': "old", 'AI': "reply"}]}, f)
+
+    assert turns(journal.load(CONVERSATION)) == ["old"]
+    journal.append(CONVERSATION, "new", "reply", wait_durable=True)
+    journal.close()
+
+    reopened = reopen(tmp_path)
+    assert turns(reopened.load(CONVERSATION)) == ["old", "new"]
+    reopened.close()
+
+
+def test_compaction_threshold_counts_replayed_records(tmp_path):
+    journal = MemoryJournal(str(tmp_path), compact_threshold=3)
+    journal.append(CONVERSATION, "q0", "a0")
+    journal.append(CONVERSATION, "q1", "a1")
+    journal.close()
+
+    reopened = MemoryJournal(str(tmp_path), compact_threshold=3)
+    reopened.load(CONVERSATION)
+    assert not reopened.needs_compaction(CONVERSATION)
+    reopened.append(CONVERSATION, "q2", "a2")
+    assert reopened.needs_compaction(CONVERSATION)
+    reopened.close()
+
+
+def test_append_not_blocked_by_fsync(tmp_path, monkeypatch):
+    journal = MemoryJournal(str(tmp_path), fsync_interval=3600)
+    journal.append(CONVERSATION, "q0", "a0")
+    entered = threading.Event()
+    release = threading.Event()
+    real_fsync = os.fsync
+
+    def slow_fsync(fd):
+        entered.set()
+        release.wait(5)
+        real_fsync(fd)
+
+    monkeypatch.setattr(os, 'fsync', slow_fsync)
+    flusher = threading.Thread(target=journal.flush)
+    flusher.start()
+    assert entered.wait(5)
+    # fsync进行中时追加不需要等待
+    start = time.time()
+    journal.append(CONVERSATION, "q1", "a1")
+    assert time.time() - start < 1
+    release.set()
+    flusher.join()
+    monkeypatch.undo()
+    journal.close()
+
+    reopened = reopen(tmp_path)
+    assert turns(reopened.load(CONVERSATION)) == ["q0", "q1"]
+    reopened.close()
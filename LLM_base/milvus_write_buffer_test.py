@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 模块导入时会创建默认的嵌入模型，测试中不会真正请求API
+os.environ.setdefault("Doubao_API_KEY", "test")
+
+from LLM_base.MilvusRAG import MilvusRAG, MilvusWriteBuffer
+
+DIMENSION = 4
+
+
+class FakeEmbeddings:
+    """可切换成功/失败的嵌入模型"""
+
+    def __init__(self):
+        self.available = True
+
+    def embed_documents_strict(self, texts):
+        if not self.available:
+            raise ConnectionError("embedding API down")
+        return [[float(len(text))] * DIMENSION for text in texts]
+
+    def embed_documents(self, texts):
+        return self.embed_documents_strict(texts)
+
+    def embed_query(self, text):
+        return self.embed_documents_strict([text])[0]
+
+
+class FakeMilvusClient:
+    """记录写入和检索调用的Milvus客户端"""
+
+    def __init__(self):
+        self.inserted = []
+        self.upserted = []
+        self.searches = 0
+
+    def insert(self, collection_name, data):
+        self.inserted.extend(data)
+
+    def upsert(self, collection_name, data):
+        self.upserted.extend(data)
+
+    def search(self, collection_name, data, **kwargs):
+        self.searches += 1
+        return [[] for _ in data]
+
+
+def make_rag(tmp_path, buffered=True):
+    """不连接Milvus服务，只设置写入和检索用到的属性"""
+    rag = MilvusRAG.__new__(MilvusRAG)
+    rag.client = FakeMilvusClient()
+    rag.embedding_model = FakeEmbeddings()
+    rag.chat_history_collection_name = "chat_history"
+    rag.search_params = {}
+    rag.metric_type = "COSINE"
+    rag.consistency_level = "Session"
+    rag.consistency_overrides = {}
+    rag.write_buffer = None
+    if buffered:
+        rag.write_buffer = MilvusWriteBuffer(rag, max_batch=8, flush_interval=0.01, max_retries=0,
+                                             spill_path=str(tmp_path / "spill.jsonl"),
+                                             spill_retry_interval=3600)
+    return rag
+
+
+def read_spill(rag):
+    with open(rag.write_buffer.spill_path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+@pytest.fixture
+def rag(tmp_path):
+    rag = make_rag(tmp_path)
+    yield rag
+    rag.write_buffer.close()
+
+
+def test_failed_embedding_spills_without_vector(rag):
+    rag.embedding_model.available = False
+    rag.add_user_message("u1", "alice", "hello")
+    rag.write_buffer.flush()
+
+    assert rag.client.inserted == []
+    rows = read_spill(rag)
+    assert [row["content"] for row in rows] == ["hello"]
+    assert rows[0]["vector_field"] is None
+    assert rag.write_buffer.stats()['spilled_rows'] == 1
+
+
+def test_replay_embeds_and_upserts_spilled_rows(rag):
+    rag.embedding_model.available = False
+    rag.add_user_message("u1", "alice", "hello")
+    rag.add_llm_response("u1", "alice", "hi there")
+    rag.write_buffer.flush()
+
+    rag.embedding_model.available = True
+    assert rag.write_buffer.replay_spill() == 2
+    assert [row["content"] for row in rag.client.upserted] == ["hello", "hi there"]
+    assert rag.client.upserted[0]["vector_field"] == [5.0] * DIMENSION
+    assert not os.path.exists(rag.write_buffer.spill_path)
+    assert not os.path.exists(rag.write_buffer.spill_path + ".replaying")
+    # 重放过的行不会再写一次
+    assert rag.write_buffer.replay_spill() == 0
+
+
+def test_replay_skips_truncated_spill_line(rag):
+    with open(rag.write_buffer.spill_path, 'w', encoding='utf-8') as f:
+        row = rag.construct_data_input("u1", "alice", "hello", "query", defer_vector=True)
+        f.write(json.dumps(row) + "\n")
+        f.write('{"message_id": "half')
+
+    assert rag.write_buffer.replay_spill() == 1
+    assert [row["content"] for row in rag.client.upserted] == ["hello"]
+
+
+def test_search_and_add_skips_search_when_embedding_fails(rag):
+    rag.embedding_model.available = False
+    similar, data = rag.search_and_add_user_message("u1", "alice", "hello")
+    rag.write_buffer.flush()
+
+    assert similar == []
+    assert rag.client.searches == 0
+    assert data["vector_field"] is None
+    assert rag.client.inserted == []
+    assert [row["content"] for row in read_spill(rag)] == ["hello"]
+
+
+def test_search_and_add_embeds_once(rag):
+    calls = []
+    embed = rag.embedding_model.embed_documents_strict
+    rag.embedding_model.embed_documents_strict = lambda texts: calls.append(list(texts)) or embed(texts)
+    rag.search_and_add_user_message("u1", "alice", "hello")
+    rag.write_buffer.flush()
+
+    assert calls == [["hello"]]
+    assert rag.client.searches == 1
+    assert rag.client.inserted[0]["vector_field"] == [5.0] * DIMENSION
+
+
+def test_unbuffered_write_raises_instead_of_random_vector(tmp_path):
+    rag = make_rag(tmp_path, buffered=False)
+    rag.embedding_model.available = False
+    with pytest.raises(ConnectionError):
+        rag.add_user_message("u1", "alice", "hello")
+    assert rag.client.inserted == []
+
+
+def test_search_returns_empty_when_embedding_fails(rag):
+    rag.embedding_model.available = False
+    assert rag.semantic_similarity_search("hello", user_id="u1") == []
+    assert rag.client.searches == 0
+
+
+def test_batch_search_returns_empty_lists_when_embedding_fails(rag):
+    rag.embedding_model.available = False
+    assert rag.semantic_similarity_search_batch(["a", "b"], user_ids=["u1", None]) == [[], []]
+    assert rag.client.searches == 0
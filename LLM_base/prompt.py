@@ -111,4 +111,5 @@ def get_prompt(prompt_name: str, user_input: str) -> Optional[str]:
 # 预定义的提示词名称常量
 CONTRACT_GENERATION_PROMPT = "contract_generation"
 CONTRACT_REVIEW_PROMPT = "contract_review"
-CUSTOMER_SERVICE_PROMPT = "customer_service"
\ No newline at end of file
+CUSTOMER_SERVICE_PROMPT = "customer_service"
+HISTORY_SUMMARY_PROMPT = "history_summary"
\ No newline at end of file
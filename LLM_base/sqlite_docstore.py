@@ -0,0 +1,237 @@
+import os
+import glob
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from collections.abc import Mapping
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    # Windows
+    import msvcrt
+    FCNTL_AVAILABLE = False
+
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SQLITE_DOCSTORE_FILE = "docstore.sqlite"
+
+
+def snapshot_identity(pickle_path: str) -> str:
+    """
+    基线快照（index.pkl）的标识，用于判断SQLite副本是否过期
+
+    Args:
+        pickle_path (str): index.pkl路径
+
+    Returns:
+        str: "大小:修改时间(ns)"
+    """
+    stat = os.stat(pickle_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+@contextmanager
+def export_lock(path: str):
+    """
+    跨进程的导出锁（锁文件为 path + '.lock'），同一时间只允许一个进程或线程导出SQLite副本；
+    持锁进程退出时由操作系统释放，不会留下失效的锁
+
+    Args:
+        path (str): SQLite文件路径
+    """
+    with open(path + '.lock', 'a+b') as f:
+        if FCNTL_AVAILABLE:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK约10秒后仍未拿到锁会报错，继续等待
+                    time.sleep(0.1)
+        try:
+            yield
+        finally:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def export_sqlite_docstore(path: str, docstore, index_to_docstore_id: Dict[int, str], snapshot: str):
+    """
+    把docstore和位置映射写成SQLite文件（先写本进程独有的临时文件再原子替换）
+
+    调用方需持有export_lock(path)，因此遗留的临时文件都来自中途退出的导出，可以直接删除。
+
+    Args:
+        path (str): SQLite文件路径
+        docstore (Docstore): 文档存储（InMemoryDocstore）
+        index_to_docstore_id (Dict[int, str]): 索引位置 -> 文档ID
+        snapshot (str): 对应基线快照的标识
+    """
+    for stale_file in glob.glob(glob.escape(path) + '.*.tmp'):
+        try:
+            os.remove(stale_file)
+        except OSError:
+            pass
+    temp_file = f"{path}.{os.getpid()}-{uuid.uuid4().hex}.tmp"
+    conn = sqlite3.connect(temp_file)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("CREATE TABLE docs (id TEXT PRIMARY KEY, page_content TEXT, metadata TEXT)")
+        conn.execute("CREATE TABLE positions (position INTEGER PRIMARY KEY, id TEXT)")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.executemany(
+            "INSERT INTO positions (position, id) VALUES (?, ?)",
+            ((int(position), doc_id) for position, doc_id in index_to_docstore_id.items())
+        )
+        rows = []
+        for doc_id in index_to_docstore_id.values():
+            doc = docstore.search(doc_id)
+            if isinstance(doc, Document):
+                rows.append((doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False, default=str)))
+        conn.executemany("INSERT OR REPLACE INTO docs (id, page_content, metadata) VALUES (?, ?, ?)", rows)
+        conn.execute("INSERT INTO meta (key, value) VALUES ('snapshot', ?)", (snapshot,))
+        conn.commit()
+    except Exception:
+        conn.close()
+        os.remove(temp_file)
+        raise
+    conn.close()
+    os.replace(temp_file, path)
+    logger.info(f"SQLite docstore已导出: {path}，共{len(rows)}个文档")
+
+
+def read_snapshot_identity(path: str) -> Optional[str]:
+    """
+    读取SQLite副本记录的基线快照标识
+
+    Args:
+        path (str): SQLite文件路径
+
+    Returns:
+        Optional[str]: 快照标识，文件不存在或损坏时返回None
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'snapshot'").fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+    except sqlite3.Error:
+        return None
+
+
+class _ReadOnlyConnection:
+    """只读打开的SQLite连接，多线程共享时串行访问"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def fetchone(self, sql: str, params: Tuple = ()) -> Optional[Tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def fetchall(self, sql: str, params: Tuple = ()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SQLiteDocstore(Docstore):
+    """
+    按需从SQLite读取文档的只读docstore
+
+    启动时不加载任何文档，检索命中时才按ID查询；多个进程只读打开同一文件，共享操作系统页缓存。
+    """
+
+    def __init__(self, connection: _ReadOnlyConnection):
+        self._connection = connection
+
+    def search(self, search: str) -> Union[str, Document]:
+        """
+        按ID查询文档
+
+        Args:
+            search (str): 文档ID
+
+        Returns:
+            Union[str, Document]: 文档，不存在时返回提示字符串（与InMemoryDocstore一致）
+        """
+        row = self._connection.fetchone("SELECT page_content, metadata FROM docs WHERE id = ?", (search,))
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]) if row[1] else {})
+
+    def close(self):
+        """关闭SQLite连接"""
+        self._connection.close()
+
+
+class SQLiteIndexMap(Mapping):
+    """
+    按需从SQLite读取的 索引位置 -> 文档ID 映射，替代FAISS.index_to_docstore_id字典
+    """
+
+    def __init__(self, connection: _ReadOnlyConnection):
+        self._connection = connection
+        self._length: Optional[int] = None
+
+    def __getitem__(self, position: int) -> str:
+        row = self._connection.fetchone("SELECT id FROM positions WHERE position = ?", (int(position),))
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __len__(self) -> int:
+        if self._length is None:
+            self._length = self._connection.fetchone("SELECT COUNT(*) FROM positions")[0]
+        return self._length
+
+    def __iter__(self) -> Iterator[int]:
+        for row in self._connection.fetchall("SELECT position FROM positions ORDER BY position"):
+            yield row[0]
+
+    def items(self):
+        return self._connection.fetchall("SELECT position, id FROM positions ORDER BY position")
+
+    def values(self):
+        return [row[0] for row in self._connection.fetchall("SELECT id FROM positions ORDER BY position")]
+
+
+def open_sqlite_docstore(path: str) -> Tuple[SQLiteDocstore, SQLiteIndexMap]:
+    """
+    只读打开SQLite docstore
+
+    Args:
+        path (str): SQLite文件路径
+
+    Returns:
+        Tuple[SQLiteDocstore, SQLiteIndexMap]: 文档存储和位置映射（共享同一连接）
+    """
+    connection = _ReadOnlyConnection(path)
+    return SQLiteDocstore(connection), SQLiteIndexMap(connection)
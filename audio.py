@@ -1,5 +1,13 @@
-import os
+import re
+import wave
+import logging
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 情感 -> 参考音频路径，文件名格式为【情感】音频文字.wav
 dicts = {
     "调皮": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【调皮】哇已经发展成三人关系了吗？芽衣你真是越来越大胆了呢。.wav",
     "调侃": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【调侃的失望】啊真是的，头也不回的走掉了呢。.wav",
@@ -9,7 +17,7 @@ dicts = {
     "急了": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【急了】啊等等，难道说背叛者指的是芽衣的事，千万别这样想呀，我心里还是有你的。.wav",
     "假装": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【假装】拜托了医生，对我来说这真的很重要。.wav",
     "惊喜": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【惊喜】哇，那不是预约不知排到什么时候的超级餐厅嘛，突然带个人会不会给你添麻烦呀？.wav",
-    "开心": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【开心】哎呀，那时的我可真好看，当然啦一直都很好看。.wav",
+    "开心": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【开心】哎呀，看到美少女突然来访，比起惊讶，要表现的更开心一些才行啊。.wav",
     "撩拨": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【撩拨】哎呀，我还以为你会好好记住人家的名字的，有点难过。.wav",
     "难过": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【难过】对你来说，对任何人来说，我们，意味着什么呢？.wav",
     "疲惫": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【疲惫】我知道你在想什么，不过也稍微休息一下吧。.wav",
@@ -25,6 +33,140 @@ emotion_keys = [
     "撩拨", "难过", "疲惫", "普通", "撒娇", "生气", "严肃", "疑问", "自言"
 ]
 
+# GPT-SoVITS要求参考音频时长在3~10秒之间
+REFERENCE_MIN_SECONDS = 3.0
+REFERENCE_MAX_SECONDS = 10.0
+
+
+def parse_reference_filename(file_path: str) -> Tuple[str, str]:
+    """
+    从参考音频文件名中提取音频文字和文件格式
+
+    文件名格式：【情感】音频文字.wav；路径可以是Windows或POSIX风格
+
+    Args:
+        file_path (str): 参考音频路径
+
+    Returns:
+        Tuple[str, str]: (音频文字, 文件格式)
+    """
+    filename = re.split(r"[\\/]", file_path)[-1]
+    stem, _, file_format = filename.rpartition('.')
+    if not stem:
+        stem, file_format = filename, ""
+    if stem.startswith('【') and '】' in stem:
+        # 去掉【情感】部分
+        stem = stem[stem.index('】') + 1:]
+    return stem, file_format
+
+
+class EmotionReference(NamedTuple):
+    """一种情感对应的参考音频"""
+    emotion: str
+    path: str
+    prompt_text: str
+    file_format: str
+    prompt_lang: str = "zh"
+    # 以下字段在load_audio为True且文件可读时填充
+    audio_bytes: Optional[bytes] = None
+    duration: Optional[float] = None
+    valid: bool = False
+
+
+class EmotionRegistry:
+    """
+    启动时一次性构建的情感参考音频表
+
+    每种情感的音频文字从文件名中提取，参考音频的字节和时长在加载时读取并校验，
+    之后每次TTS请求只做字典查找，不再访问文件系统。
+    """
+
+    def __init__(self, paths: Optional[Dict[str, str]] = None, default_emotion: str = "普通",
+                 prompt_lang: str = "zh", load_audio: bool = True):
+        """
+        初始化情感表
+
+        Args:
+            paths (Dict[str, str], optional): 情感 -> 参考音频路径，默认为dicts
+            default_emotion (str): 未知情感时使用的情感，默认为"普通"
+            prompt_lang (str): 参考音频的语言，默认为"zh"
+            load_audio (bool): 是否读取并校验参考音频文件，默认为True
+        """
+        paths = dicts if paths is None else paths
+        if default_emotion not in paths:
+            raise ValueError(f"默认情感不在参考音频表中: {default_emotion}")
+        self.default_emotion = default_emotion
+        self._references: Dict[str, EmotionReference] = {}
+        for emotion, path in paths.items():
+            prompt_text, file_format = parse_reference_filename(path)
+            reference = EmotionReference(emotion, path, prompt_text, file_format, prompt_lang)
+            if load_audio:
+                reference = self._load_reference(reference)
+            self._references[emotion] = reference
+        if load_audio:
+            valid = sum(1 for reference in self._references.values() if reference.valid)
+            logger.info(f"情感参考音频加载完成: {valid}/{len(self._references)} 个可用")
+
+    @staticmethod
+    def _load_reference(reference: EmotionReference) -> EmotionReference:
+        """读取参考音频的字节和时长，并检查时长是否符合要求"""
+        try:
+            with open(reference.path, 'rb') as f:
+                audio_bytes = f.read()
+            with wave.open(reference.path, 'rb') as wf:
+                duration = wf.getnframes() / wf.getframerate()
+        except FileNotFoundError:
+            logger.warning(f"参考音频不存在: {reference.emotion}: {reference.path}")
+            return reference
+        except Exception as e:
+            logger.warning(f"读取参考音频失败: {reference.emotion}: {e}")
+            return reference
+        if not REFERENCE_MIN_SECONDS <= duration <= REFERENCE_MAX_SECONDS:
+            logger.warning(f"参考音频时长{duration:.2f}秒不在"
+                           f"{REFERENCE_MIN_SECONDS}~{REFERENCE_MAX_SECONDS}秒之间: {reference.emotion}")
+        return reference._replace(audio_bytes=audio_bytes, duration=duration, valid=True)
+
+    @property
+    def emotions(self) -> List[str]:
+        return list(self._references)
+
+    def __contains__(self, emotion: str) -> bool:
+        return emotion in self._references
+
+    def get(self, emotion: Optional[str]) -> EmotionReference:
+        """
+        获取情感对应的参考音频，未知情感返回默认情感的参考音频
+
+        Args:
+            emotion (str, optional): 情感
+
+        Returns:
+            EmotionReference: 参考音频信息
+        """
+        reference = self._references.get(emotion) if emotion else None
+        if reference is None:
+            reference = self._references[self.default_emotion]
+        return reference
+
+
+_default_registry: Optional[EmotionRegistry] = None
+_default_registry_lock = threading.Lock()
+
+
+def get_default_registry() -> EmotionRegistry:
+    """
+    获取只解析文件名、不读取音频文件的默认情感表（供get_audio_info使用）
+
+    Returns:
+        EmotionRegistry: 默认情感表
+    """
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = EmotionRegistry(load_audio=False)
+        return _default_registry
+
+
 def get_audio_info(key):
     """
     根据输入的key返回音频信息
@@ -37,35 +179,16 @@ def get_audio_info(key):
               格式: {"情感": str, "文件地址": str, "音频文字": str, "文件格式": str}
               如果key不存在，返回None
     """
-    if key not in dicts:
+    registry = get_default_registry()
+    if key not in registry:
         return None
     
-    file_path = dicts[key]
-    
-    # 提取文件名
-    filename = os.path.basename(file_path)
-    
-    # 提取文件格式
-    file_format = filename.split('.')[-1]
-    
-    # 提取音频文字
-    # 格式：【情感】音频文字.wav
-    # 需要去掉【情感】和.wav部分
-    if filename.startswith('【') and '】' in filename:
-        # 找到第一个】的位置
-        end_emotion = filename.index('】')
-        # 提取音频文字（从】之后到.wav之前）
-        audio_text = filename[end_emotion + 1:].split('.')[0]
-    else:
-        # 如果格式不符合预期，返回文件名（不包含扩展名）
-        audio_text = filename.split('.')[0]
-    
-    # 返回结果
+    reference = registry.get(key)
     return {
-        "情感": key,
-        "文件地址": file_path,
-        "音频文字": audio_text,
-        "文件格式": file_format
+        "情感": reference.emotion,
+        "文件地址": reference.path,
+        "音频文字": reference.prompt_text,
+        "文件格式": reference.file_format
     }
 def extract_first_bracketed_word(text):
     """
@@ -0,0 +1,623 @@
+import os
+import time
+import wave
+import logging
+import threading
+from queue import Queue
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional
+
+from tts import AudioFormat, parse_wav_header
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# PyAudio用于声卡输出，未安装时（如无声卡的服务器）无法使用PyAudioSink
+try:
+    import pyaudio
+    PYAUDIO_AVAILABLE = True
+except ImportError:
+    logging.warning("pyaudio库未安装，无法直接播放音频")
+    PYAUDIO_AVAILABLE = False
+
+
+class AudioSegment(NamedTuple):
+    """一段待播放的音频：对应一句话或一个音频文件"""
+    text: str
+    audio_format: AudioFormat
+    chunks: Iterable[bytes]
+    # 已知的音频时长（秒），流式合成时未知为None
+    duration: Optional[float] = None
+
+
+def load_wav_segment(audio_path: str, text: str = "", chunk_frames: int = 4096) -> AudioSegment:
+    """
+    读取WAV文件头，返回按块惰性读取PCM的音频段
+
+    Args:
+        audio_path (str): WAV文件路径
+        text (str): 音频对应的文本
+        chunk_frames (int): 每块的帧数，默认为4096
+
+    Returns:
+        AudioSegment: 音频段
+    """
+    with wave.open(audio_path, 'rb') as wf:
+        audio_format = AudioFormat(wf.getnchannels(), wf.getsampwidth(), wf.getframerate())
+        duration = wf.getnframes() / wf.getframerate()
+
+    def read_chunks() -> Iterator[bytes]:
+        with wave.open(audio_path, 'rb') as wf:
+            while True:
+                data = wf.readframes(chunk_frames)
+                if not data:
+                    return
+                yield data
+
+    return AudioSegment(text, audio_format, read_chunks(), duration)
+
+
+def wav_bytes_segment(data: bytes, text: str = "", chunk_bytes: int = 16384) -> AudioSegment:
+    """
+    把内存中的WAV数据包装成音频段，分块是原数据的memoryview切片，不复制PCM
+
+    Args:
+        data (bytes): 完整的WAV数据
+        text (str): 音频对应的文本
+        chunk_bytes (int): 每块的字节数，会向下对齐到整帧，默认为16384
+
+    Returns:
+        AudioSegment: 音频段
+
+    Raises:
+        ValueError: 不是完整的WAV数据
+    """
+    header = parse_wav_header(data)
+    if header is None:
+        raise ValueError("WAV数据不完整")
+    audio_format, data_offset = header
+    frame_size = audio_format.channels * audio_format.sample_width
+    chunk_bytes = max(frame_size, chunk_bytes - chunk_bytes % frame_size)
+    pcm = memoryview(data)[data_offset:]
+    # 不足一帧的尾部字节不播放
+    pcm = pcm[:len(pcm) - len(pcm) % frame_size]
+    chunks = [pcm[start:start + chunk_bytes] for start in range(0, len(pcm), chunk_bytes)]
+    return AudioSegment(text, audio_format, chunks, len(pcm) / audio_format.bytes_per_second)
+
+
+class AudioArchive:
+    """
+    可选的音频存档目录：按总字节数和文件数限额，超出时删除最旧的文件
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 200 * 1024 * 1024, max_files: int = 500):
+        """
+        初始化音频存档
+
+        Args:
+            directory (str): 存档目录
+            max_bytes (int): 存档总字节上限，默认为200MB
+            max_files (int): 存档文件数上限，默认为500
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # 按修改时间从旧到新登记已有文件
+        existing = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith('.wav') and os.path.isfile(path):
+                stat = os.stat(path)
+                existing.append((stat.st_mtime, path, stat.st_size))
+        existing.sort()
+        self._files = [(path, size) for _, path, size in existing]
+        self._total_bytes = sum(size for _, size in self._files)
+        with self._lock:
+            self._rotate()
+
+    def _rotate(self):
+        """删除最旧的文件直到满足限额（调用方需持有锁）"""
+        while self._files and (len(self._files) > self.max_files or self._total_bytes > self.max_bytes):
+            path, size = self._files.pop(0)
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"删除存档音频失败: {path}: {e}")
+
+    def save(self, data: bytes, prefix: str = "response") -> Optional[str]:
+        """
+        保存一段WAV数据
+
+        Args:
+            data (bytes): WAV数据
+            prefix (str): 文件名前缀，默认为"response"
+
+        Returns:
+            Optional[str]: 保存的文件路径，失败返回None
+        """
+        path = os.path.join(self.directory, f"{prefix}_{int(time.time() * 1000)}_{os.urandom(4).hex()}.wav")
+        try:
+            with open(path, 'wb') as f:
+                f.write(data)
+        except Exception as e:
+            logger.error(f"保存存档音频失败: {path}: {e}")
+            return None
+        with self._lock:
+            self._files.append((path, len(data)))
+            self._total_bytes += len(data)
+            self._rotate()
+        return path
+
+    def stats(self) -> dict:
+        """
+        获取存档占用
+
+        Returns:
+            dict: 文件数和总字节数
+        """
+        with self._lock:
+            return {'files': len(self._files), 'bytes': self._total_bytes}
+
+
+class PyAudioSink:
+    """
+    常驻的PyAudio输出：PyAudio实例和输出流只创建一次，格式不变时一直复用
+
+    write按帧对齐写入，不足一帧的尾部字节留到下一次写入。
+    """
+
+    def __init__(self):
+        if not PYAUDIO_AVAILABLE:
+            raise RuntimeError("pyaudio库未安装，无法创建PyAudioSink")
+        self._pyaudio = None
+        self._stream = None
+        self._format: Optional[AudioFormat] = None
+        self._remainder = b""
+        self._lock = threading.Lock()
+
+    def open(self, audio_format: AudioFormat):
+        """
+        准备按指定格式输出，格式与当前输出流一致时直接复用
+
+        Args:
+            audio_format (AudioFormat): PCM音频格式
+        """
+        with self._lock:
+            if self._stream is not None and self._format == audio_format:
+                return
+            self._close_stream()
+            if self._pyaudio is None:
+                self._pyaudio = pyaudio.PyAudio()
+            self._stream = self._pyaudio.open(
+                format=self._pyaudio.get_format_from_width(audio_format.sample_width),
+                channels=audio_format.channels,
+                rate=audio_format.sample_rate,
+                output=True
+            )
+            self._format = audio_format
+            self._remainder = b""
+            logger.info(f"打开音频输出流: {audio_format}")
+
+    def write(self, data: bytes):
+        """
+        写入PCM数据（阻塞直到数据进入声卡缓冲区）
+
+        Args:
+            data (bytes): PCM数据，也可以是只读的memoryview（如内存WAV的切片）
+        """
+        with self._lock:
+            if self._stream is None:
+                raise RuntimeError("音频输出流尚未打开")
+            frame_size = self._format.channels * self._format.sample_width
+            if not self._remainder and len(data) % frame_size == 0:
+                # 已按帧对齐的块直接写入，bytes和只读memoryview都不复制；
+                # PyAudio只接受只读缓冲区，其他可写缓冲区才转换为bytes
+                if not isinstance(data, bytes) and not (isinstance(data, memoryview) and data.readonly):
+                    data = bytes(data)
+                self._stream.write(data)
+                return
+            data = self._remainder + data
+            usable = len(data) - len(data) % frame_size
+            self._remainder = data[usable:]
+            if usable:
+                self._stream.write(data[:usable])
+
+    def drain(self):
+        """一个播放任务结束：丢弃不足一帧的尾部字节，输出流保持打开"""
+        with self._lock:
+            self._remainder = b""
+
+    def _close_stream(self):
+        """关闭当前输出流（调用方需持有锁）"""
+        if self._stream is not None:
+            try:
+                self._stream.stop_stream()
+                self._stream.close()
+            except Exception as e:
+                logger.error(f"关闭音频输出流失败: {e}")
+            self._stream = None
+            self._format = None
+
+    def close(self):
+        """关闭输出流并释放PyAudio"""
+        with self._lock:
+            self._close_stream()
+            if self._pyaudio is not None:
+                self._pyaudio.terminate()
+                self._pyaudio = None
+
+
+class NullSink:
+    """
+    丢弃所有音频的输出，用于无声卡的服务器和测试
+
+    realtime为True时按音频时长阻塞，模拟真实播放的节奏。
+    """
+
+    def __init__(self, realtime: bool = False):
+        self.realtime = realtime
+        self.bytes_written = 0
+        self._format: Optional[AudioFormat] = None
+
+    def open(self, audio_format: AudioFormat):
+        self._format = audio_format
+
+    def write(self, data: bytes):
+        self.bytes_written += len(data)
+        if self.realtime and self._format is not None:
+            time.sleep(len(data) / self._format.bytes_per_second)
+
+    def drain(self):
+        pass
+
+    def close(self):
+        self._format = None
+
+
+class WavFileSink:
+    """
+    把每个播放任务写成一个WAV文件的输出，用于无声卡环境下检查播放结果
+    """
+
+    def __init__(self, output_dir: str, prefix: str = "playback"):
+        """
+        初始化WAV文件输出
+
+        Args:
+            output_dir (str): 输出目录
+            prefix (str): 文件名前缀，默认为"playback"
+        """
+        self.output_dir = output_dir
+        self.prefix = prefix
+        os.makedirs(output_dir, exist_ok=True)
+        self.files: List[str] = []
+        self._writer = None
+        self._format: Optional[AudioFormat] = None
+
+    def open(self, audio_format: AudioFormat):
+        if self._writer is not None and self._format == audio_format:
+            return
+        self.drain()
+        path = os.path.join(self.output_dir, f"{self.prefix}_{len(self.files):05d}.wav")
+        self._writer = wave.open(path, 'wb')
+        self._writer.setnchannels(audio_format.channels)
+        self._writer.setsampwidth(audio_format.sample_width)
+        self._writer.setframerate(audio_format.sample_rate)
+        self._format = audio_format
+        self.files.append(path)
+
+    def write(self, data: bytes):
+        if self._writer is None:
+            raise RuntimeError("WAV输出文件尚未打开")
+        self._writer.writeframes(data)
+
+    def drain(self):
+        """一个播放任务结束，关闭当前文件"""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._format = None
+
+    def close(self):
+        self.drain()
+
+
+def create_default_sink():
+    """有PyAudio时输出到声卡，否则丢弃音频"""
+    if PYAUDIO_AVAILABLE:
+        return PyAudioSink()
+    logger.warning("pyaudio不可用，音频播放将使用NullSink")
+    return NullSink()
+
+
+class PlaybackJob:
+    """
+    播放队列中的一个任务（通常是一条回复），由若干音频段组成
+    """
+
+    def __init__(self, segments: Iterable[AudioSegment], label: str = "",
+                 on_segment: Optional[Callable[[AudioSegment], None]] = None,
+                 on_cancel: Optional[Callable[[], None]] = None):
+        """
+        初始化播放任务
+
+        Args:
+            segments (Iterable[AudioSegment]): 音频段，可以是边合成边产出的生成器
+            label (str): 任务标签，用于日志
+            on_segment (Callable, optional): 每段开始播放前的回调（例如驱动Live2D动作）
+            on_cancel (Callable, optional): 任务被取消时调用一次（例如停止上游合成）；
+                排队中的任务从未开始迭代，关闭其生成器不会通知上游，需要通过该回调取消
+        """
+        self.segments = segments
+        self.label = label
+        self.on_segment = on_segment
+        self.on_cancel = on_cancel
+        self.played_seconds = 0.0
+        self._cancelled = threading.Event()
+        self._cancel_lock = threading.Lock()
+        self._done = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def cancel(self):
+        """取消任务：排队中的不再播放，正在播放的在下一块处停止"""
+        with self._cancel_lock:
+            if self._cancelled.is_set():
+                return
+            self._cancelled.set()
+        if self.on_cancel is not None:
+            try:
+                self.on_cancel()
+            except Exception as e:
+                logger.error(f"取消回调出错: {self.label}: {e}")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待任务播放完成（或被取消）
+
+        Args:
+            timeout (float, optional): 超时秒数
+
+        Returns:
+            bool: 是否在超时前完成
+        """
+        return self._done.wait(timeout)
+
+
+class AudioPlaybackService:
+    """
+    常驻的音频播放服务
+
+    一个后台线程按提交顺序逐个播放任务，输出设备只打开一次；
+    支持跳过当前任务（skip）和清空全部任务（interrupt）。输出可替换为
+    NullSink或WavFileSink，便于在无声卡的环境下运行。
+    """
+
+    def __init__(self, sink=None):
+        """
+        初始化播放服务
+
+        Args:
+            sink: 音频输出，需提供open/write/drain/close方法，默认有声卡时用PyAudioSink，否则用NullSink
+        """
+        self.sink = sink if sink is not None else create_default_sink()
+        self._queue: Queue = Queue()
+        self._current: Optional[PlaybackJob] = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._unfinished = 0
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+        self.played_jobs = 0
+        self.skipped_jobs = 0
+        self.played_seconds = 0.0
+
+    def _ensure_thread(self):
+        """首次提交任务时启动播放线程（调用方需持有锁）"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="AudioPlayback")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def submit(self, segments: Iterable[AudioSegment], label: str = "",
+               on_segment: Optional[Callable[[AudioSegment], None]] = None,
+               on_cancel: Optional[Callable[[], None]] = None) -> PlaybackJob:
+        """
+        提交一个播放任务，排在已提交的任务之后
+
+        Args:
+            segments (Iterable[AudioSegment]): 音频段
+            label (str): 任务标签
+            on_segment (Callable, optional): 每段开始播放前的回调
+            on_cancel (Callable, optional): 任务被取消时的回调
+
+        Returns:
+            PlaybackJob: 播放任务，可用于等待或取消
+        """
+        job = PlaybackJob(segments, label=label, on_segment=on_segment, on_cancel=on_cancel)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("音频播放服务已关闭")
+            self._unfinished += 1
+            self._ensure_thread()
+        self._queue.put(job)
+        return job
+
+    def play(self, audio_format: AudioFormat, chunks: Iterable[bytes], text: str = "",
+             duration: Optional[float] = None,
+             on_segment: Optional[Callable[[AudioSegment], None]] = None) -> PlaybackJob:
+        """
+        提交单段音频
+
+        Args:
+            audio_format (AudioFormat): PCM音频格式
+            chunks (Iterable[bytes]): PCM分块
+            text (str): 音频对应的文本
+            duration (float, optional): 已知的音频时长
+            on_segment (Callable, optional): 开始播放前的回调
+
+        Returns:
+            PlaybackJob: 播放任务
+        """
+        return self.submit([AudioSegment(text, audio_format, chunks, duration)], label=text, on_segment=on_segment)
+
+    def skip(self) -> bool:
+        """
+        跳过当前正在播放的任务
+
+        Returns:
+            bool: 是否有任务被跳过
+        """
+        with self._lock:
+            job = self._current
+        if job is None:
+            return False
+        job.cancel()
+        return True
+
+    def interrupt(self) -> int:
+        """
+        停止当前任务并丢弃所有排队中的任务
+
+        Returns:
+            int: 被取消的任务数
+        """
+        with self._queue.mutex:
+            queued = [job for job in self._queue.queue if job is not None and not job.cancelled]
+        # 在队列锁外取消，取消回调可能要停止上游合成
+        for job in queued:
+            job.cancel()
+        cancelled = len(queued)
+        if self.skip():
+            cancelled += 1
+        return cancelled
+
+    def pending(self) -> int:
+        """
+        未播放完的任务数（包括正在播放的）
+
+        Returns:
+            int: 任务数
+        """
+        with self._lock:
+            return self._unfinished
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待所有已提交的任务播放完
+
+        Args:
+            timeout (float, optional): 超时秒数
+
+        Returns:
+            bool: 是否在超时前播放完
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._unfinished == 0, timeout)
+
+    def _run(self):
+        """播放线程：按顺序取出任务播放"""
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                self._current = job
+            try:
+                self._play_job(job)
+            except Exception as e:
+                logger.error(f"播放任务出错: {job.label}: {e}")
+            finally:
+                with self._idle:
+                    self._current = None
+                    self._unfinished -= 1
+                    self._idle.notify_all()
+                job._done.set()
+
+    def _play_job(self, job: PlaybackJob):
+        """逐段逐块写入输出；任务取消时关闭尚未读完的生成器，让上游停止合成"""
+        segments = iter(job.segments)
+        try:
+            while not job.cancelled:
+                segment = next(segments, None)
+                if segment is None or job.cancelled:
+                    break
+                if job.on_segment is not None:
+                    try:
+                        job.on_segment(segment)
+                    except Exception as e:
+                        logger.error(f"播放回调出错: {e}")
+                self.sink.open(segment.audio_format)
+                played = 0
+                chunks = iter(segment.chunks)
+                try:
+                    for chunk in chunks:
+                        if job.cancelled:
+                            break
+                        self.sink.write(chunk)
+                        played += len(chunk)
+                finally:
+                    close = getattr(chunks, 'close', None)
+                    if close is not None:
+                        close()
+                seconds = played / segment.audio_format.bytes_per_second
+                job.played_seconds += seconds
+                self.played_seconds += seconds
+        finally:
+            close = getattr(segments, 'close', None)
+            if close is not None:
+                close()
+            self.sink.drain()
+        if job.cancelled:
+            self.skipped_jobs += 1
+            logger.info(f"播放任务被跳过: {job.label}")
+        else:
+            self.played_jobs += 1
+            logger.info(f"播放任务完成: {job.label}，时长{job.played_seconds:.2f}秒")
+
+    def stats(self) -> dict:
+        """
+        获取播放统计
+
+        Returns:
+            dict: 已播放、已跳过、排队中的任务数和累计播放时长
+        """
+        with self._lock:
+            pending = self._unfinished
+        return {
+            'played_jobs': self.played_jobs,
+            'skipped_jobs': self.skipped_jobs,
+            'pending_jobs': pending,
+            'played_seconds': self.played_seconds
+        }
+
+    def close(self, timeout: Optional[float] = 5.0):
+        """
+        停止播放线程并关闭输出
+
+        Args:
+            timeout (float, optional): 等待排队任务播放完的秒数，None表示一直等待
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            if not self.wait_idle(timeout):
+                self.interrupt()
+            self._queue.put(None)
+            thread.join(timeout=2)
+        self.sink.close()
@@ -0,0 +1,126 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from audio_playback import AudioArchive, AudioPlaybackService, AudioSegment, NullSink, wav_bytes_segment
+from tts import AudioFormat, encode_wav
+
+FORMAT = AudioFormat(channels=1, sample_width=2, sample_rate=16000)
+
+
+class RecordingSink(NullSink):
+    """记录写入的每一块"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def write(self, data: bytes):
+        super().write(data)
+        self.chunks.append(bytes(data))
+
+
+def segment(text, *chunks):
+    return AudioSegment(text, FORMAT, list(chunks))
+
+
+def blocking_segments(started, release):
+    """第一段开始播放后阻塞，直到release被设置"""
+    yield segment("first", b"\x00\x01")
+    started.set()
+    release.wait(5)
+    yield segment("second", b"\x02\x03")
+
+
+def test_jobs_play_in_submission_order():
+    sink = RecordingSink()
+    playback = AudioPlaybackService(sink=sink)
+    played = []
+    for name in ("a", "b", "c"):
+        playback.submit([segment(name, name.encode() * 2)], label=name, on_segment=lambda s: played.append(s.text))
+    assert playback.wait_idle(5)
+    assert played == ["a", "b", "c"]
+    assert sink.chunks == [b"aa", b"bb", b"cc"]
+    stats = playback.stats()
+    assert stats['played_jobs'] == 3
+    assert stats['played_seconds'] == 3 * 2 / FORMAT.bytes_per_second
+    playback.close()
+
+
+def test_skip_stops_current_job_and_closes_generator():
+    started = threading.Event()
+    release = threading.Event()
+    sink = RecordingSink()
+    playback = AudioPlaybackService(sink=sink)
+    segments = blocking_segments(started, release)
+    job = playback.submit(segments, label="long")
+    after = playback.submit([segment("next", b"\x04\x05")], label="next")
+    assert started.wait(5)
+    assert playback.skip()
+    release.set()
+    assert after.wait(5)
+    assert job.cancelled
+    # 被跳过的任务不再播放后续段，生成器已关闭，下一个任务照常播放
+    assert sink.chunks == [b"\x00\x01", b"\x04\x05"]
+    assert segments.gi_frame is None
+    assert playback.stats()['skipped_jobs'] == 1
+    playback.close()
+
+
+def test_interrupt_cancels_queued_jobs():
+    started = threading.Event()
+    release = threading.Event()
+    playback = AudioPlaybackService(sink=RecordingSink())
+    playback.submit(blocking_segments(started, release), label="current")
+    cancelled = []
+    queued = [playback.submit([segment(name, b"\x00\x00")], label=name,
+                              on_cancel=lambda name=name: cancelled.append(name)) for name in ("x", "y")]
+    assert started.wait(5)
+    assert playback.interrupt() == 3
+    release.set()
+    assert playback.wait_idle(5)
+    # 排队中的任务从未开始迭代，通过on_cancel通知上游
+    assert cancelled == ["x", "y"]
+    assert all(job.cancelled for job in queued)
+    assert playback.stats()['played_jobs'] == 0
+    playback.close()
+
+
+def test_closed_service_rejects_jobs():
+    playback = AudioPlaybackService(sink=RecordingSink())
+    playback.close()
+    with pytest.raises(RuntimeError):
+        playback.submit([segment("late", b"\x00\x00")])
+
+
+def test_wav_bytes_segment_slices_without_copy():
+    pcm = bytes(range(256)) * 4 + b"\x01"
+    data = encode_wav(FORMAT, pcm)
+    audio = wav_bytes_segment(data, text="hi", chunk_bytes=301)
+    assert audio.audio_format == FORMAT
+    # 分块向下对齐到整帧，不足一帧的尾部字节丢弃
+    assert all(len(chunk) == 300 for chunk in audio.chunks[:-1])
+    assert b"".join(audio.chunks) == pcm[:-1]
+    assert audio.duration == (len(pcm) - 1) / FORMAT.bytes_per_second
+    assert all(isinstance(chunk, memoryview) and chunk.obj is data for chunk in audio.chunks)
+
+
+def test_wav_bytes_segment_rejects_truncated_header():
+    with pytest.raises(ValueError):
+        wav_bytes_segment(encode_wav(FORMAT, b"\x00\x00")[:20])
+
+
+def test_archive_rotates_oldest_files(tmp_path):
+    archive = AudioArchive(str(tmp_path), max_bytes=250, max_files=10)
+    paths = [archive.save(b"x" * 100, prefix=f"r{i}") for i in range(3)]
+    assert not os.path.exists(paths[0])
+    assert all(os.path.exists(path) for path in paths[1:])
+    assert archive.stats() == {'files': 2, 'bytes': 200}
+
+    # 重新打开时登记已有文件，按新的限额继续删除
+    reopened = AudioArchive(str(tmp_path), max_bytes=250, max_files=1)
+    assert reopened.stats() == {'files': 1, 'bytes': 100}
@@ -0,0 +1,67 @@
+import os
+import sys
+import wave
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from audio import EmotionRegistry, get_audio_info, parse_reference_filename
+
+
+def write_reference(directory, name, seconds, sample_rate=8000):
+    """写入指定时长的静音WAV，返回路径"""
+    path = os.path.join(str(directory), name)
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(b"\x00\x00" * int(seconds * sample_rate))
+    return path
+
+
+def test_parse_reference_filename():
+    assert parse_reference_filename("E:\\参考音频\\【开心】哎呀，真开心。.wav") == ("哎呀，真开心。", "wav")
+    assert parse_reference_filename("/data/ref/【难过】唉.mp3") == ("唉", "mp3")
+    assert parse_reference_filename("没有标记.wav") == ("没有标记", "wav")
+    assert parse_reference_filename("no_extension") == ("no_extension", "")
+
+
+def test_registry_loads_and_validates_references(tmp_path):
+    paths = {
+        "普通": write_reference(tmp_path, "【普通】今天也要加油哦。.wav", 4),
+        "开心": write_reference(tmp_path, "【开心】太好啦。.wav", 1),
+        "难过": os.path.join(str(tmp_path), "【难过】不存在.wav"),
+    }
+    registry = EmotionRegistry(paths)
+    normal = registry.get("普通")
+    assert normal.valid and normal.prompt_text == "今天也要加油哦。"
+    assert normal.duration == 4
+    with open(paths["普通"], 'rb') as f:
+        assert normal.audio_bytes == f.read()
+    # 时长不符合要求只记录警告，仍可使用
+    assert registry.get("开心").valid
+    assert not registry.get("难过").valid
+    assert registry.get("难过").prompt_text == "不存在"
+
+
+def test_unknown_emotion_falls_back_to_default():
+    registry = EmotionRegistry({"普通": "a/【普通】你好。.wav", "开心": "a/【开心】嘿。.wav"}, load_audio=False)
+    assert registry.get("生气").emotion == "普通"
+    assert registry.get(None).emotion == "普通"
+    assert registry.get("开心").path == "a/【开心】嘿。.wav"
+    assert "开心" in registry and "生气" not in registry
+    assert registry.emotions == ["普通", "开心"]
+
+
+def test_default_emotion_must_exist():
+    with pytest.raises(ValueError):
+        EmotionRegistry({"开心": "【开心】嘿。.wav"}, load_audio=False)
+
+
+def test_get_audio_info_uses_registry_without_reading_files():
+    info = get_audio_info("开心")
+    assert info["情感"] == "开心"
+    assert info["音频文字"] == "哎呀，看到美少女突然来访，比起惊讶，要表现的更开心一些才行啊。"
+    assert info["文件格式"] == "wav"
+    assert get_audio_info("不存在的情感") is None
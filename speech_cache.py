@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from tts import AudioFormat, encode_wav
+from LLM_base.embedding_cache import text_digest
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 默认的磁盘缓存目录
+DEFAULT_SPEECH_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'speech')
+
+# 只影响传输方式、不影响合成结果的参数，不参与缓存键
+_TRANSPORT_PARAMS = ("streaming_mode", "media_type")
+
+
+class SpeechCache:
+    """
+    以 (文本, 参考音频, 合成参数) 为键的合成语音缓存
+
+    内存层和磁盘层都按总字节数做LRU淘汰；磁盘层每条缓存是一个WAV文件，
+    命中时刷新修改时间，进程重启后按修改时间恢复LRU顺序。disk_dir为None时只使用内存层。
+    """
+
+    def __init__(self, disk_dir: Optional[str] = DEFAULT_SPEECH_CACHE_DIR,
+                 max_memory_bytes: int = 32 * 1024 * 1024, max_disk_bytes: int = 256 * 1024 * 1024):
+        """
+        初始化语音缓存
+
+        Args:
+            disk_dir (str, optional): 磁盘缓存目录，None表示不落盘
+            max_memory_bytes (int): 内存层字节上限，默认为32MB
+            max_disk_bytes (int): 磁盘层字节上限，默认为256MB
+        """
+        self.disk_dir = disk_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        # key -> 文件大小，按访问顺序排列
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if disk_dir:
+            try:
+                os.makedirs(disk_dir, exist_ok=True)
+                existing = []
+                for name in os.listdir(disk_dir):
+                    if name.endswith('.wav'):
+                        stat = os.stat(os.path.join(disk_dir, name))
+                        existing.append((stat.st_mtime, name[:-4], stat.st_size))
+                for _, key, size in sorted(existing):
+                    self._disk[key] = size
+                    self._disk_bytes += size
+                with self._lock:
+                    self._evict_disk()
+                logger.info(f"语音缓存磁盘层已打开: {disk_dir}，已有{len(self._disk)}条")
+            except Exception as e:
+                logger.error(f"打开语音缓存磁盘层失败，仅使用内存缓存: {e}")
+                self.disk_dir = None
+
+    @staticmethod
+    def make_key(text: str, text_lang: str, ref_audio_path: str, prompt_lang: str,
+                 prompt_text: str = "", **params) -> str:
+        """
+        构造缓存键，参数与GPTSoVITSClient.synthesize一致
+
+        Returns:
+            str: 缓存键
+        """
+        params = {k: v for k, v in params.items() if k not in _TRANSPORT_PARAMS}
+        material = json.dumps(
+            [text, text_lang, ref_audio_path, prompt_lang, prompt_text, params],
+            ensure_ascii=False, sort_keys=True
+        )
+        return text_digest(material)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.wav")
+
+    def _remember(self, key: str, data: bytes):
+        """放入内存层并按字节上限淘汰（调用方需持有锁）"""
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _evict_disk(self):
+        """按字节上限删除最久未用的磁盘缓存（调用方需持有锁）"""
+        while self._disk_bytes > self.max_disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"删除语音缓存失败: {key}: {e}")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        查询缓存的WAV数据，先查内存层再查磁盘层
+
+        Args:
+            key (str): 缓存键
+
+        Returns:
+            Optional[bytes]: WAV数据，未命中返回None
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self.memory_hits += 1
+                return data
+            if self.disk_dir and key in self._disk:
+                path = self._disk_path(key)
+                try:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    os.utime(path)
+                except Exception as e:
+                    logger.error(f"读取语音缓存失败: {key}: {e}")
+                    self._disk_bytes -= self._disk.pop(key)
+                    self.misses += 1
+                    return None
+                self._disk.move_to_end(key)
+                self._remember(key, data)
+                self.disk_hits += 1
+                return data
+            self.misses += 1
+            return None
+
+    def put(self, key: str, data: bytes):
+        """
+        写入WAV数据到内存层和磁盘层
+
+        Args:
+            key (str): 缓存键
+            data (bytes): WAV数据
+        """
+        data = bytes(data)
+        with self._lock:
+            self._remember(key, data)
+            if not self.disk_dir or len(data) > self.max_disk_bytes:
+                return
+            path = self._disk_path(key)
+            temp_path = path + '.tmp'
+            try:
+                with open(temp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            except Exception as e:
+                logger.error(f"写入语音缓存失败: {key}: {e}")
+                return
+            self._disk_bytes -= self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            self._evict_disk()
+
+    def tee(self, key: str, audio_format: AudioFormat, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        包装流式合成的PCM分块：原样产出，完整读完后把整段音频写入缓存
+        （中途被取消的不完整音频不会写入）
+
+        Args:
+            key (str): 缓存键
+            audio_format (AudioFormat): PCM音频格式
+            chunks (Iterable[bytes]): PCM分块
+
+        Yields:
+            bytes: PCM分块
+        """
+        parts: List[bytes] = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        self.put(key, encode_wav(audio_format, b"".join(parts)))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计信息
+
+        Returns:
+            Dict[str, Any]: 命中次数和两层的占用
+        """
+        with self._lock:
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses
+            }
+
+
+def warm_up_speech_cache(cache: SpeechCache, client, lines: Iterable[Tuple[str, str]],
+                         text_lang: str = "zh", prompt_lang: str = "zh", **params) -> int:
+    """
+    预先合成固定台词（如兜底回复）写入缓存，已缓存的跳过
+
+    Args:
+        cache (SpeechCache): 语音缓存
+        client (GPTSoVITSClient): TTS客户端
+        lines (Iterable[Tuple[str, str]]): (台词, 参考音频路径) 列表
+        text_lang (str): 台词语言，默认为"zh"
+        prompt_lang (str): 参考音频语言，默认为"zh"
+        **params: 其他合成参数，需与实际播放时一致才能命中
+
+    Returns:
+        int: 本次新合成的条数
+    """
+    start = time.time()
+    rendered = 0
+    for text, ref_audio_path in lines:
+        key = cache.make_key(text, text_lang, ref_audio_path, prompt_lang, **params)
+        if cache.get(key) is not None:
+            continue
+        data = client.synthesize(text, text_lang, ref_audio_path, prompt_lang, **params)
+        if data:
+            cache.put(key, data)
+            rendered += 1
+        else:
+            logger.warning(f"预热合成失败: {text}")
+    logger.info(f"语音缓存预热完成，新合成{rendered}条，耗时{time.time() - start:.2f}秒")
+    return rendered
@@ -0,0 +1,95 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from speech_cache import SpeechCache, warm_up_speech_cache
+from tts import AudioFormat, encode_wav
+
+FORMAT = AudioFormat(channels=1, sample_width=2, sample_rate=16000)
+
+
+def key(text, **params):
+    return SpeechCache.make_key(text, "zh", "ref/普通.wav", "zh", prompt_text="参考文本", **params)
+
+
+class FakeTTSClient:
+    """记录合成请求，返回固定的WAV数据"""
+
+    def __init__(self):
+        self.requests = []
+
+    def synthesize(self, text, text_lang, ref_audio_path, prompt_lang, **params):
+        self.requests.append(text)
+        return encode_wav(FORMAT, text.encode('utf-8'))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SpeechCache(disk_dir=str(tmp_path / "speech"))
+
+
+def test_key_ignores_transport_params():
+    assert key("你好") == key("你好", streaming_mode=True, media_type="wav")
+    assert key("你好", speed_factor=1.0) == key("你好", speed_factor=1.0, streaming_mode=True)
+
+
+def test_key_covers_synthesis_inputs():
+    base = key("你好")
+    assert base != key("你好呀")
+    assert base != SpeechCache.make_key("你好", "zh", "ref/开心.wav", "zh", prompt_text="参考文本")
+    assert base != SpeechCache.make_key("你好", "zh", "ref/普通.wav", "zh", prompt_text="别的参考文本")
+    assert base != key("你好", speed_factor=1.2)
+    # prompt_text按位置或关键字传入得到相同的键
+    assert base == SpeechCache.make_key("你好", "zh", "ref/普通.wav", "zh", "参考文本")
+
+
+def test_memory_layer_evicts_by_bytes():
+    cache = SpeechCache(disk_dir=None, max_memory_bytes=10)
+    cache.put("a", b"x" * 6)
+    cache.put("b", b"y" * 6)
+    assert cache.get("a") is None
+    assert cache.get("b") == b"y" * 6
+    # 单条超过上限时仍保留最新的一条
+    cache.put("c", b"z" * 20)
+    assert cache.get("c") == b"z" * 20
+    assert cache.stats()['memory_entries'] == 1
+
+
+def test_disk_layer_survives_restart_and_evicts(tmp_path):
+    disk_dir = str(tmp_path / "speech")
+    cache = SpeechCache(disk_dir=disk_dir, max_disk_bytes=20)
+    cache.put("a", b"x" * 8)
+    cache.put("b", b"y" * 8)
+    cache.put("c", b"z" * 8)
+    assert not os.path.exists(os.path.join(disk_dir, "a.wav"))
+
+    reopened = SpeechCache(disk_dir=disk_dir, max_disk_bytes=20)
+    assert reopened.get("a") is None
+    assert reopened.get("c") == b"z" * 8
+    assert reopened.stats()['disk_hits'] == 1
+    assert reopened.stats()['disk_bytes'] == 16
+
+
+def test_tee_caches_only_complete_audio(cache):
+    chunks = [b"\x00\x01", b"\x02\x03"]
+    assert list(cache.tee("full", FORMAT, iter(chunks))) == chunks
+    assert cache.get("full") == encode_wav(FORMAT, b"".join(chunks))
+
+    # 播放被取消、生成器没有读完时不写入缓存
+    partial = cache.tee("partial", FORMAT, iter(chunks))
+    next(partial)
+    partial.close()
+    assert cache.get("partial") is None
+
+
+def test_warm_up_skips_cached_lines(cache):
+    client = FakeTTSClient()
+    lines = [("第一句", "ref/普通.wav"), ("第二句", "ref/普通.wav")]
+    assert warm_up_speech_cache(cache, client, lines, prompt_text="参考文本") == 2
+    assert warm_up_speech_cache(cache, client, lines, prompt_text="参考文本") == 0
+    assert client.requests == ["第一句", "第二句"]
+    # 预热时的键与播放时构造的键一致
+    assert cache.get(key("第一句")) == encode_wav(FORMAT, "第一句".encode('utf-8'))
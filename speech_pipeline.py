@@ -0,0 +1,249 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from tts import AudioFormat
+from audio_playback import AudioSegment
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 句末标点：遇到这些字符（及其后连续的标点和右引号/括号）视为一句结束
+SENTENCE_ENDINGS = "。！？!?~～…；;\n"
+SENTENCE_CLOSERS = "」』”’）)】"
+
+SynthesizeFn = Callable[[str, str], Optional[Tuple[AudioFormat, Iterator[bytes]]]]
+
+
+class SentenceSplitter:
+    """
+    增量分句器：LLM流式输出逐块喂入，每凑出一个完整句子就返回
+
+    回复开头的【情感】标记会被提取到emotion属性，不出现在句子中。
+    """
+
+    def __init__(self, min_chars: int = 6):
+        """
+        初始化分句器
+
+        Args:
+            min_chars (int): 句子的最少字数，过短的句子并入下一句一起合成，默认为6
+        """
+        self.min_chars = min_chars
+        self.emotion: Optional[str] = None
+        self._buffer = ""
+        self._head_checked = False
+
+    def _check_head(self) -> bool:
+        """处理开头的【情感】标记，标记尚未接收完整时返回False"""
+        if self._head_checked:
+            return True
+        stripped = self._buffer.lstrip()
+        if not stripped:
+            return False
+        if stripped.startswith("【"):
+            end = stripped.find("】")
+            if end == -1:
+                return False
+            self.emotion = stripped[1:end]
+            self._buffer = stripped[end + 1:]
+        self._head_checked = True
+        return True
+
+    def feed(self, text: str) -> List[str]:
+        """
+        喂入一段新文本
+
+        Args:
+            text (str): LLM新产出的文本
+
+        Returns:
+            List[str]: 本次凑齐的完整句子
+        """
+        self._buffer += text
+        if not self._check_head():
+            return []
+
+        sentences = []
+        start = 0
+        i = 0
+        length = len(self._buffer)
+        while i < length:
+            if self._buffer[i] in SENTENCE_ENDINGS:
+                # 把连续的标点和右引号/括号并入本句
+                j = i + 1
+                while j < length and (self._buffer[j] in SENTENCE_ENDINGS or self._buffer[j] in SENTENCE_CLOSERS):
+                    j += 1
+                if j == length:
+                    # 句末标点在缓冲末尾，后面可能还有标点，等下一块再判断
+                    break
+                sentence = self._buffer[start:j].strip()
+                if len(sentence) >= self.min_chars:
+                    sentences.append(sentence)
+                    start = j
+                i = j
+            else:
+                i += 1
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> List[str]:
+        """
+        流结束时取出剩余文本
+
+        Returns:
+            List[str]: 剩余的句子（可能为空）
+        """
+        self._check_head()
+        self._head_checked = True
+        rest = self._buffer.strip()
+        self._buffer = ""
+        return [rest] if rest else []
+
+
+class SpeechPipeline:
+    """
+    一条回复的分句语音流水线
+
+    句子一凑齐就提交TTS（最多max_parallel_tts句同时合成），segments()按句子顺序
+    产出音频段，交给播放服务逐块播放，因此第一句合成出首个音频块后就开始发声，
+    不必等整段回复生成完。
+    """
+
+    def __init__(self, synthesize_fn: SynthesizeFn, default_emotion: str = "普通",
+                 max_parallel_tts: int = 2, min_chars: int = 6, wait_timeout: float = 30.0):
+        """
+        初始化流水线
+
+        Args:
+            synthesize_fn (Callable): 合成函数，参数为(句子, 情感)，返回(音频格式, PCM分块迭代器)，失败返回None
+            default_emotion (str): 回复没有【情感】标记时使用的情感，默认为"普通"
+            max_parallel_tts (int): 同时进行的TTS请求数，默认为2
+            min_chars (int): 句子的最少字数，默认为6
+            wait_timeout (float): 播放方等待下一句或下一个音频块的最长秒数，超时视为上游卡住并取消，默认为30
+        """
+        self.synthesize_fn = synthesize_fn
+        self.wait_timeout = wait_timeout
+        self.default_emotion = default_emotion
+        self.splitter = SentenceSplitter(min_chars=min_chars)
+
+        self._tts_pool = ThreadPoolExecutor(max_workers=max_parallel_tts, thread_name_prefix="SpeechTTS")
+        # 按顺序排队的句子，每项是(句子, 该句的PCM分块队列)；None表示回复结束
+        self._sentences: Queue = Queue()
+        self._cancelled = threading.Event()
+        self.sentence_count = 0
+        # 已提交合成的句子，按顺序
+        self._submitted: List[str] = []
+
+    @property
+    def emotion(self) -> str:
+        return self.splitter.emotion or self.default_emotion
+
+    def feed(self, text: str):
+        """
+        喂入LLM新产出的文本，凑齐的句子立即提交合成
+
+        Args:
+            text (str): 新文本
+        """
+        for sentence in self.splitter.feed(text):
+            self._submit(sentence)
+
+    def _submit(self, sentence: str):
+        """提交一句合成，并把它的分块队列按顺序排入句子队列"""
+        if self._cancelled.is_set():
+            return
+        chunk_queue: Queue = Queue()
+        self._sentences.put((sentence, chunk_queue))
+        self._tts_pool.submit(self._synthesize, sentence, self.emotion, chunk_queue)
+        self._submitted.append(sentence)
+        self.sentence_count += 1
+
+    def spoken_text(self) -> str:
+        """
+        获取已提交合成的文本（不含情感标记）
+
+        Returns:
+            str: 按顺序拼接的句子
+        """
+        return "".join(self._submitted)
+
+    def _synthesize(self, sentence: str, emotion: str, chunk_queue: Queue):
+        """TTS线程：合成一句，把音频格式和PCM分块依次放入该句的队列，以None结束"""
+        try:
+            if self._cancelled.is_set():
+                return
+            result = self.synthesize_fn(sentence, emotion)
+            if result is None:
+                logger.error(f"句子合成失败: {sentence}")
+                return
+            audio_format, chunks = result
+            chunk_queue.put(audio_format)
+            for chunk in chunks:
+                if self._cancelled.is_set():
+                    break
+                chunk_queue.put(chunk)
+        except Exception as e:
+            logger.error(f"句子合成出错: {e}")
+        finally:
+            chunk_queue.put(None)
+
+    def _get(self, queue: Queue, what: str):
+        """有超时地等待队列中的下一项，超时时取消流水线并返回None，避免卡住播放线程"""
+        try:
+            return queue.get(timeout=self.wait_timeout)
+        except Empty:
+            logger.error(f"等待{what}超过{self.wait_timeout}秒，取消本条回复的语音")
+            self.cancel()
+            return None
+
+    def _drain(self, chunk_queue: Queue) -> Iterator[bytes]:
+        while True:
+            chunk = self._get(chunk_queue, "音频块")
+            if chunk is None:
+                return
+            yield chunk
+
+    def segments(self) -> Iterator[AudioSegment]:
+        """
+        按句子顺序产出音频段，供AudioPlaybackService播放；合成失败的句子被跳过。
+        播放方提前关闭该生成器（任务被跳过）时取消剩余句子的合成；
+        等待下一句或音频块超过wait_timeout时取消并结束。
+
+        Yields:
+            AudioSegment: 一句的音频段
+        """
+        try:
+            while not self._cancelled.is_set():
+                item = self._get(self._sentences, "下一句")
+                if item is None:
+                    return
+                sentence, chunk_queue = item
+                audio_format = self._get(chunk_queue, "音频格式")
+                if audio_format is None:
+                    continue
+                yield AudioSegment(sentence, audio_format, self._drain(chunk_queue))
+        except GeneratorExit:
+            self.cancel()
+            raise
+
+    def flush(self):
+        """提交分句器中剩余的文本，句子队列保持打开"""
+        for sentence in self.splitter.flush():
+            self._submit(sentence)
+
+    def finish(self):
+        """
+        LLM输出结束：提交剩余文本，并标记句子队列结束
+        """
+        self.flush()
+        self._sentences.put(None)
+        self._tts_pool.shutdown(wait=False)
+
+    def cancel(self):
+        """取消尚未合成的句子（可重复调用）"""
+        self._cancelled.set()
+        self._sentences.put(None)
+        self._tts_pool.shutdown(wait=False, cancel_futures=True)
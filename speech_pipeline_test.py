@@ -0,0 +1,87 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from speech_pipeline import SentenceSplitter, SpeechPipeline
+from tts import AudioFormat
+
+FORMAT = AudioFormat(channels=1, sample_width=2, sample_rate=32000)
+
+
+def split(chunks, min_chars=6):
+    """逐块喂入，返回每块凑齐的句子、flush剩余的句子和提取到的情感"""
+    splitter = SentenceSplitter(min_chars=min_chars)
+    fed = [splitter.feed(chunk) for chunk in chunks]
+    return fed, splitter.flush(), splitter.emotion
+
+
+def test_sentences_are_emitted_as_soon_as_complete():
+    fed, rest, emotion = split(["【开心】今天天气", "真不错。我们出去", "玩吧！好", "不好"])
+    assert emotion == "开心"
+    assert fed == [[], ["今天天气真不错。"], ["我们出去玩吧！"], []]
+    assert rest == ["好不好"]
+
+
+def test_emotion_tag_split_across_chunks():
+    fed, rest, emotion = split(["【伤", "心】唉，", "今天下雨了。"])
+    assert emotion == "伤心"
+    assert fed[0] == [] and fed[1] == []
+    assert rest == ["唉，今天下雨了。"]
+
+
+def test_trailing_punctuation_and_closers_stay_with_sentence():
+    fed, rest, _ = split(["他说「真的吗？！」", "然后就走掉了……", "嗯"])
+    assert fed == [[], ["他说「真的吗？！」"], ["然后就走掉了……"]]
+    assert rest == ["嗯"]
+
+
+def test_short_sentences_merge_with_next():
+    fed, rest, _ = split(["好的。", "那我们明天见面吧。", "拜拜"])
+    assert fed == [[], [], ["好的。那我们明天见面吧。"]]
+    assert rest == ["拜拜"]
+
+
+def test_reply_without_tag_or_punctuation():
+    fed, rest, emotion = split(["没有标点的回复"])
+    assert emotion is None
+    assert fed == [[]]
+    assert rest == ["没有标点的回复"]
+
+
+def test_pipeline_plays_sentences_in_order():
+    def synthesize(sentence, emotion):
+        return FORMAT, iter([f"{emotion}:{sentence}".encode('utf-8')])
+
+    pipeline = SpeechPipeline(synthesize_fn=synthesize, max_parallel_tts=2)
+    pipeline.feed("【开心】第一句话说完了。第二句话也说完了。")
+    pipeline.feed("第三句")
+    pipeline.finish()
+    segments = [(segment.text, b"".join(segment.chunks).decode('utf-8')) for segment in pipeline.segments()]
+    assert segments == [
+        ("第一句话说完了。", "开心:第一句话说完了。"),
+        ("第二句话也说完了。", "开心:第二句话也说完了。"),
+        ("第三句", "开心:第三句"),
+    ]
+    assert pipeline.spoken_text() == "第一句话说完了。第二句话也说完了。第三句"
+
+
+def test_failed_sentence_is_skipped():
+    def synthesize(sentence, emotion):
+        if "失败" in sentence:
+            return None
+        return FORMAT, iter([b"pcm"])
+
+    pipeline = SpeechPipeline(synthesize_fn=synthesize)
+    pipeline.feed("这一句会合成失败。这一句可以正常播放。")
+    pipeline.finish()
+    assert [segment.text for segment in pipeline.segments()] == ["这一句可以正常播放。"]
+
+
+def test_cancel_stops_further_sentences():
+    pipeline = SpeechPipeline(synthesize_fn=lambda sentence, emotion: (FORMAT, iter([b"pcm"])))
+    pipeline.cancel()
+    pipeline.feed("取消后喂入的句子。不会再合成了。")
+    pipeline.finish()
+    assert list(pipeline.segments()) == []
+    assert pipeline.sentence_count == 0
@@ -0,0 +1,73 @@
+import logging
+import threading
+from typing import Dict, Iterable, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+def create_session(pool_size: int = 10, max_retries: int = 3, backoff_factor: float = 0.3,
+                   status_forcelist: Iterable[int] = (502, 503, 504)) -> requests.Session:
+    """
+    创建带连接池、keep-alive和重试退避的requests会话
+
+    连接失败（请求尚未发出）时所有方法都会重试；读超时和status_forcelist状态码只对幂等方法重试，
+    POST（TTS合成、Live2D控制）可能已被服务端处理，重放会重复合成并使延迟翻倍。
+
+    Args:
+        pool_size (int): 每个主机保持的连接数，默认为10
+        max_retries (int): 重试次数，默认为3
+        backoff_factor (float): 重试退避系数，第n次重试前等待 backoff_factor * 2^(n-1) 秒，默认为0.3
+        status_forcelist (Iterable[int]): 幂等请求需要重试的HTTP状态码
+
+    Returns:
+        requests.Session: 配置好的会话
+    """
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=tuple(status_forcelist),
+        # 读错误和状态码重试仅限幂等方法（不含POST）
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_shared_sessions: Dict[str, requests.Session] = {}
+_shared_sessions_lock = threading.Lock()
+
+
+def get_shared_session(name: str, pool_size: int = 10, max_retries: int = 3,
+                       backoff_factor: float = 0.3) -> requests.Session:
+    """
+    获取按名称共享的会话，同一进程内复用连接池
+
+    Args:
+        name (str): 会话名称（例如 "live2d"）
+        pool_size (int): 首次创建时的连接池大小
+        max_retries (int): 首次创建时的重试次数
+        backoff_factor (float): 首次创建时的退避系数
+
+    Returns:
+        requests.Session: 共享会话
+    """
+    with _shared_sessions_lock:
+        session = _shared_sessions.get(name)
+        if session is None:
+            session = create_session(pool_size=pool_size, max_retries=max_retries, backoff_factor=backoff_factor)
+            _shared_sessions[name] = session
+            logger.info(f"创建共享HTTP会话: {name}，连接池大小: {pool_size}")
+        return session
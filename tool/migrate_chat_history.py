@@ -0,0 +1,38 @@
+import os
+import sys
+import argparse
+import logging
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from LLM_base.MilvusRAG import MilvusRAG
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def main():
+    """
+    把聊天历史集合迁移为以user_id为分区键的集合
+
+    用法: python tool/migrate_chat_history.py --uri http://localhost:19530 --db vtuber
+    """
+    parser = argparse.ArgumentParser(description="聊天历史集合迁移为user_id分区键")
+    parser.add_argument("--uri", default="http://localhost:19530", help="Milvus服务地址")
+    parser.add_argument("--token", default="root:Milvus", help="Milvus认证令牌")
+    parser.add_argument("--db", default="vtuber", help="数据库名称")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每批复制的行数")
+    parser.add_argument("--num-partitions", type=int, default=64, help="分区键模式下的分区数")
+    parser.add_argument("--no-backup", action="store_true", help="迁移完成后删除旧集合而不是保留备份")
+    args = parser.parse_args()
+
+    rag = MilvusRAG(uri=args.uri, token=args.token, dbname=args.db, num_partitions=args.num_partitions)
+    try:
+        migrated = rag.migrate_to_partition_key(batch_size=args.batch_size, keep_backup=not args.no_backup)
+        logger.info(f"迁移结束，共迁移{migrated}条")
+    finally:
+        rag.close()
+
+
+if __name__ == "__main__":
+    main()
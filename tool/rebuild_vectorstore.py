@@ -0,0 +1,51 @@
+import os
+import sys
+import json
+import argparse
+import logging
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from LLM_base.RAG import RAG
+from LLM_base.faiss_index import INDEX_TYPES
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def main():
+    """
+    在抽样向量上训练并重建FAISS向量库索引，输出召回率-延迟评估
+
+    用法: python tool/rebuild_vectorstore.py --index ivf_pq --nlist 1024 --pq-m 64
+    """
+    parser = argparse.ArgumentParser(description="重建FAISS向量库索引")
+    parser.add_argument("--model", default="doubao", choices=["doubao", "zhipu"], help="嵌入模型类型")
+    parser.add_argument("--index", default="ivf_flat", choices=INDEX_TYPES, help="索引类型")
+    parser.add_argument("--nlist", type=int, help="IVF聚类数")
+    parser.add_argument("--pq-m", type=int, help="PQ子量化器数（需整除向量维度）")
+    parser.add_argument("--pq-nbits", type=int, help="PQ每个子量化器的位数")
+    parser.add_argument("--hnsw-m", type=int, help="HNSW每个节点的邻居数")
+    parser.add_argument("--sample-size", type=int, default=100000, help="训练抽样数")
+    parser.add_argument("--target-recall", type=float, default=0.95, help="选择检索参数的目标召回率")
+    parser.add_argument("--k", type=int, default=10, help="评估recall@k的k")
+    parser.add_argument("--no-eval", action="store_true", help="跳过召回率-延迟评估")
+    args = parser.parse_args()
+
+    index_params = {key: value for key, value in {
+        "nlist": args.nlist, "pq_m": args.pq_m, "pq_nbits": args.pq_nbits, "hnsw_m": args.hnsw_m
+    }.items() if value is not None}
+
+    rag = RAG(modeltype=args.model)
+    try:
+        report = rag.rebuild_index(args.index, index_params, sample_size=args.sample_size,
+                                   evaluate=not args.no_eval, target_recall=args.target_recall, k=args.k)
+        if report is None:
+            sys.exit(1)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    finally:
+        rag.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,116 @@
 import requests
 import os
 import json
-from typing import Optional, List
+import struct
+from typing import Any, Dict, Iterator, NamedTuple, Optional, List, Tuple
+from tool.http_session import create_session, Timeout
+
+class AudioFormat(NamedTuple):
+    """PCM音频格式"""
+    channels: int
+    sample_width: int
+    sample_rate: int
+    
+    @property
+    def bytes_per_second(self) -> int:
+        return self.channels * self.sample_width * self.sample_rate
+
+
+def parse_wav_header(data: bytes) -> Optional[Tuple[AudioFormat, int]]:
+    """
+    解析WAV头，返回音频格式和PCM数据起始偏移
+    
+    流式模式下服务端先发送一个数据长度未知的WAV头，随后是裸PCM数据。
+    
+    参数:
+        data: 已收到的字节（可能还不完整）
+        
+    返回:
+        Optional[Tuple[AudioFormat, int]]: (音频格式, data块之后的偏移)；数据不足时返回None
+        
+    异常:
+        ValueError: 不是WAV数据
+    """
+    if len(data) < 12:
+        return None
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("响应不是WAV格式")
+    offset = 12
+    audio_format = None
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack("<I", data[offset + 4:offset + 8])[0]
+        if chunk_id == b"data":
+            if audio_format is None:
+                raise ValueError("WAV数据缺少fmt块")
+            return audio_format, offset + 8
+        if offset + 8 + chunk_size > len(data):
+            return None
+        if chunk_id == b"fmt ":
+            channels, sample_rate = struct.unpack("<HI", data[offset + 10:offset + 16])
+            bits_per_sample = struct.unpack("<H", data[offset + 22:offset + 24])[0]
+            audio_format = AudioFormat(channels, bits_per_sample // 8, sample_rate)
+        # RIFF块按偶数字节对齐
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def encode_wav(audio_format: AudioFormat, pcm: bytes) -> bytes:
+    """
+    为裸PCM数据加上标准的44字节WAV头
+    
+    参数:
+        audio_format: PCM音频格式
+        pcm: PCM数据
+        
+    返回:
+        bytes: 完整的WAV数据
+    """
+    block_align = audio_format.channels * audio_format.sample_width
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + len(pcm), b"WAVE",
+        b"fmt ", 16, 1, audio_format.channels, audio_format.sample_rate,
+        audio_format.bytes_per_second, block_align, audio_format.sample_width * 8,
+        b"data", len(pcm)
+    )
+    return header + pcm
+
 
 class GPTSoVITSClient:
     """
     GPT-SoVITS-v2pro API客户端，用于发送文本转语音请求
     """
     
-    def __init__(self, api_url: str = "http://127.0.0.1:9880"):
+    def __init__(
+        self,
+        api_url: str = "http://127.0.0.1:9880",
+        pool_size: int = 4,
+        timeout: Timeout = (3.05, 120),
+        max_retries: int = 2,
+        backoff_factor: float = 0.5
+    ):
         """
         初始化客户端
         
         参数:
             api_url: API服务地址，默认为 http://127.0.0.1:9880
+            pool_size: 连接池大小（keep-alive连接数），默认为4
+            timeout: 请求超时秒数，或 (连接超时, 读取超时)，默认为 (3.05, 120)
+            max_retries: 连接失败时的重试次数（POST请求不按状态码重放），默认为2
+            backoff_factor: 重试退避系数，默认为0.5
         """
         self.api_url = api_url.rstrip("/")
         self.tts_endpoint = f"{self.api_url}/tts"
-        
-    def generate_audio(
+        self.timeout = timeout
+        # 复用TCP连接，避免每句话都重新握手
+        self.session = create_session(pool_size=pool_size, max_retries=max_retries, backoff_factor=backoff_factor)
+    
+    def build_payload(
         self,
         text: str,
         text_lang: str,
         ref_audio_path: str,
-        output_path: str,
         prompt_lang: str,
         prompt_text: str = "",
         aux_ref_audio_paths: Optional[List[str]] = None,
@@ -43,15 +130,14 @@ class GPTSoVITSClient:
         repetition_penalty: float = 1.35,
         sample_steps: int = 32,
         super_sampling: bool = False
-    ) -> bool:
+    ) -> Dict[str, Any]:
         """
-        发送文本转语音请求并保存音频
+        构建TTS请求参数
         
         参数:
             text: 需要转换的文本
             text_lang: 文本语言（如"zh", "en", "ja"等）
             ref_audio_path: 参考音频路径，用于音色克隆
-            output_path: 生成的音频保存路径
             prompt_lang: 参考音频的语言
             prompt_text: 参考音频对应的文本（可选）
             aux_ref_audio_paths: 辅助参考音频路径列表（可选）
@@ -73,11 +159,9 @@ class GPTSoVITSClient:
             super_sampling: 是否使用超采样
             
         返回:
-            bool: 成功返回True，失败返回False
+            Dict[str, Any]: 请求参数
         """
-        
-        # 构建请求参数
-        payload = {
+        return {
             "text": text,
             "text_lang": text_lang,
             "ref_audio_path": ref_audio_path,
@@ -101,35 +185,79 @@ class GPTSoVITSClient:
             "sample_steps": sample_steps,
             "super_sampling": super_sampling
         }
+    
+    def _save_audio(self, status_code: int, content: bytes, output_path: str, error_json, error_text: str) -> bool:
+        """
+        根据响应状态保存音频或打印错误信息
         
+        返回:
+            bool: 成功返回True，失败返回False
+        """
+        # 检查响应状态码
+        if status_code == 200:
+            # 确保输出目录存在
+            output_dir = os.path.dirname(output_path)
+            if output_dir and not os.path.exists(output_dir):
+                os.makedirs(output_dir, exist_ok=True)
+            
+            # 保存音频文件
+            with open(output_path, "wb") as f:
+                f.write(content)
+            
+            print(f"音频已成功生成并保存到: {output_path}")
+            return True
+        
+        self._report_error(status_code, error_json, error_text)
+        return False
+    
+    @staticmethod
+    def _report_error(status_code: int, error_json, error_text: str):
+        """
+        打印错误响应
+        """
         try:
-            # 发送POST请求
-            print(f"正在发送TTS请求...")
-            response = requests.post(self.tts_endpoint, json=payload)
+            error_data = error_json()
+            print(f"请求失败: {status_code}")
+            print(f"错误信息: {error_data.get('message', '未知错误')}")
+        except (json.JSONDecodeError, ValueError):
+            print(f"请求失败: {status_code}")
+            print(f"响应内容: {error_text}")
+    
+    def generate_audio(
+        self,
+        text: str,
+        text_lang: str,
+        ref_audio_path: str,
+        output_path: str,
+        prompt_lang: str,
+        prompt_text: str = "",
+        **params
+    ) -> bool:
+        """
+        发送文本转语音请求并保存音频（复用连接池中的keep-alive连接）
+        
+        参数:
+            text: 需要转换的文本
+            text_lang: 文本语言（如"zh", "en", "ja"等）
+            ref_audio_path: 参考音频路径，用于音色克隆
+            output_path: 生成的音频保存路径
+            prompt_lang: 参考音频的语言
+            prompt_text: 参考音频对应的文本（可选）
+            **params: 其他合成参数，见 build_payload
             
-            # 检查响应状态码
-            if response.status_code == 200:
-                # 确保输出目录存在
-                output_dir = os.path.dirname(output_path)
-                if output_dir and not os.path.exists(output_dir):
-                    os.makedirs(output_dir, exist_ok=True)
-                
-                # 保存音频文件
-                with open(output_path, "wb") as f:
-                    f.write(response.content)
-                
-                print(f"音频已成功生成并保存到: {output_path}")
-                return True
-            else:
-                # 处理错误响应
-                try:
-                    error_data = response.json()
-                    print(f"请求失败: {response.status_code}")
-                    print(f"错误信息: {error_data.get('message', '未知错误')}")
-                except json.JSONDecodeError:
-                    print(f"请求失败: {response.status_code}")
-                    print(f"响应内容: {response.text}")
-                return False
+        返回:
+            bool: 成功返回True，失败返回False
+        """
+        
+        # 构建请求参数
+        payload = self.build_payload(text, text_lang, ref_audio_path, prompt_lang, prompt_text, **params)
+        
+        try:
+            # 发送POST请求
+            print("正在发送TTS请求...")
+            response = self.session.post(self.tts_endpoint, json=payload, timeout=self.timeout)
+            return self._save_audio(response.status_code, response.content, output_path,
+                                    response.json, response.text)
                 
         except requests.exceptions.RequestException as e:
             print(f"请求发生异常: {e}")
@@ -137,6 +265,125 @@ class GPTSoVITSClient:
         except Exception as e:
             print(f"发生未知异常: {e}")
             return False
+    
+    def synthesize(
+        self,
+        text: str,
+        text_lang: str,
+        ref_audio_path: str,
+        prompt_lang: str,
+        prompt_text: str = "",
+        **params
+    ) -> Optional[bytes]:
+        """
+        发送文本转语音请求，直接返回内存中的WAV数据，不写入磁盘
+        
+        参数:
+            text: 需要转换的文本
+            text_lang: 文本语言（如"zh", "en", "ja"等）
+            ref_audio_path: 参考音频路径，用于音色克隆
+            prompt_lang: 参考音频的语言
+            prompt_text: 参考音频对应的文本（可选）
+            **params: 其他合成参数，见 build_payload（media_type会被覆盖为wav）
+            
+        返回:
+            Optional[bytes]: WAV数据，失败返回None
+        """
+        params.update(media_type="wav")
+        payload = self.build_payload(text, text_lang, ref_audio_path, prompt_lang, prompt_text, **params)
+        
+        try:
+            print("正在发送TTS请求...")
+            response = self.session.post(self.tts_endpoint, json=payload, timeout=self.timeout)
+            if response.status_code != 200:
+                self._report_error(response.status_code, response.json, response.text)
+                return None
+            return response.content
+        except requests.exceptions.RequestException as e:
+            print(f"请求发生异常: {e}")
+            return None
+        except Exception as e:
+            print(f"发生未知异常: {e}")
+            return None
+    
+    def stream_audio(
+        self,
+        text: str,
+        text_lang: str,
+        ref_audio_path: str,
+        prompt_lang: str,
+        prompt_text: str = "",
+        chunk_size: int = 4096,
+        **params
+    ) -> Optional[Tuple[AudioFormat, Iterator[bytes]]]:
+        """
+        以流式模式请求TTS，服务端边合成边返回，无需等待整句合成完毕
+        
+        会先读取WAV头确定音频格式，之后由返回的迭代器逐块产出PCM数据。
+        
+        参数:
+            text: 需要转换的文本
+            text_lang: 文本语言（如"zh", "en", "ja"等）
+            ref_audio_path: 参考音频路径，用于音色克隆
+            prompt_lang: 参考音频的语言
+            prompt_text: 参考音频对应的文本（可选）
+            chunk_size: 每次读取的字节数，默认为4096
+            **params: 其他合成参数，见 build_payload（streaming_mode和media_type会被覆盖）
+            
+        返回:
+            Optional[Tuple[AudioFormat, Iterator[bytes]]]: (音频格式, PCM分块迭代器)，失败返回None
+        """
+        params.update(streaming_mode=True, media_type="wav")
+        payload = self.build_payload(text, text_lang, ref_audio_path, prompt_lang, prompt_text, **params)
+        
+        try:
+            print("正在发送流式TTS请求...")
+            response = self.session.post(self.tts_endpoint, json=payload, timeout=self.timeout, stream=True)
+            if response.status_code != 200:
+                self._report_error(response.status_code, response.json, response.text)
+                response.close()
+                return None
+            
+            chunks = response.iter_content(chunk_size=chunk_size)
+            # 读取直到拿到完整的WAV头
+            buffer = b""
+            header = None
+            for chunk in chunks:
+                buffer += chunk
+                header = parse_wav_header(buffer)
+                if header is not None:
+                    break
+            if header is None:
+                print("流式TTS响应中没有有效的WAV头")
+                response.close()
+                return None
+            audio_format, data_offset = header
+            
+            def pcm_chunks() -> Iterator[bytes]:
+                try:
+                    first = buffer[data_offset:]
+                    if first:
+                        yield first
+                    for chunk in chunks:
+                        if chunk:
+                            yield chunk
+                finally:
+                    response.close()
+            
+            return audio_format, pcm_chunks()
+        
+        except requests.exceptions.RequestException as e:
+            print(f"流式请求发生异常: {e}")
+            return None
+        except Exception as e:
+            print(f"流式请求发生未知异常: {e}")
+            return None
+    
+    def close(self):
+        """
+        关闭会话的连接池
+        """
+        self.session.close()
 
 # 使用示例
 if __name__ == "__main__":
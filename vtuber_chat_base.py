@@ -5,26 +5,38 @@ import threading
 import time
 import uuid
 import json
-import multiprocessing
-from typing import Dict, List, Optional, Any
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, List, Optional, Any
 from queue import Queue, Empty
 import asyncio
 import websockets
-import wave
-import pyaudio
-import requests
 # 导入音频相关模块
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from tts import GPTSoVITSClient
+from audio import EmotionRegistry, EmotionReference
+from audio_playback import AudioPlaybackService, AudioSegment, AudioArchive, wav_bytes_segment
+from speech_pipeline import SpeechPipeline
+from speech_cache import SpeechCache, DEFAULT_SPEECH_CACHE_DIR, warm_up_speech_cache
 from LLM_base.Agent import Agent
 from LLM_base.MilvusRAG import MilvusRAG, DoubaoEmbeddings
 from LLM_base.prompt import load_prompt
 from tool.config_load import load_config_to_env
+from tool.http_session import get_shared_session
 # 设置环境变量并返回字典
  # 输出解析后的配置字典
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("VTuberSystem")
 SERVER_URL = "http://localhost:8888"
+# Live2D控制器请求的超时（连接超时, 读取超时）
+LIVE2D_TIMEOUT = (1.0, 3.0)
+# 流式合成时无法预知音频时长，按语速估算动作持续时间（字/秒）
+SPEECH_CHARS_PER_SECOND = 4.5
+# 兜底回复，启动时预先合成语音
+BUSY_REPLY = "抱歉，我现在有点忙，稍后再和你聊吧~"
+ERROR_REPLY = "哎呀，刚才发生了一点小问题，我们换个话题聊聊吧~"
+CANNED_LINES = [BUSY_REPLY, ERROR_REPLY]
 # 设置环境变量并返回字典
 
 def send_request(function, duration=0, params=None):
@@ -49,53 +61,14 @@ def send_request(function, duration=0, params=None):
     }
     
     try:
-        # 发送POST请求
-        response = requests.post(SERVER_URL, json=request_data)
+        # 发送POST请求（复用keep-alive连接）
+        session = get_shared_session("live2d", pool_size=2, max_retries=1)
+        response = session.post(SERVER_URL, json=request_data, timeout=LIVE2D_TIMEOUT)
         # 解析响应
         return response.json()
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-def play_audio_external(audio_path):
-    """在外部进程中播放音频文件"""
-    try:
-        # 打开音频文件
-        wf = wave.open(audio_path, 'rb')
-        
-        # 初始化PyAudio
-        p = pyaudio.PyAudio()
-        send_request("回答问题", duration=wf.getnframes() / wf.getframerate())
-        # 定义回调函数
-        def callback(in_data, frame_count, time_info, status):
-            data = wf.readframes(frame_count)
-            return (data, pyaudio.paContinue)
-        
-        # 打开音频流
-        stream = p.open(format=p.get_format_from_width(wf.getsampwidth()),
-                       channels=wf.getnchannels(),
-                       rate=wf.getframerate(),
-                       output=True,
-                       stream_callback=callback)
-        
-        # 开始播放
-        stream.start_stream()
-        
-        # 等待播放完成
-        while stream.is_active():
-            time.sleep(0.1)
-        
-        # 停止并关闭流
-        stream.stop_stream()
-        stream.close()
-        
-        # 关闭PyAudio
-        p.terminate()
-        wf.close()
-        
-        logger.info(f"音频播放完成: {audio_path}")
-    except Exception as e:
-        logger.error(f"音频播放失败: {e}")
-
 class VTuberMessage:
     def __init__(self, user_id: str, username: str, content: str):
         self.user_id = user_id
@@ -105,7 +78,10 @@ class VTuberMessage:
         self.message_id = str(uuid.uuid4())
 
 class VTuberSystem:
-    def __init__(self, config_path: Optional[str] = None, ws_port: int = 8765):
+    def __init__(self, config_path: Optional[str] = None, ws_port: int = 8765, max_concurrency: int = 4,
+                 tts_streaming: bool = True, audio_sink=None, audio_archive_dir: Optional[str] = None,
+                 audio_archive_max_bytes: int = 200 * 1024 * 1024,
+                 speech_cache_dir: Optional[str] = DEFAULT_SPEECH_CACHE_DIR):
         self.config_path = config_path
         self.agent = None
         self.rag = None
@@ -114,6 +90,24 @@ class VTuberSystem:
         self.running = False
         self.vtuber_character_prompt = None
         self.conversation_memory = {}
+        self._conversation_lock = threading.Lock()
+        
+        # 并发处理配置：不同用户的消息并行处理，同一用户的消息按到达顺序串行处理
+        self.max_concurrency = max_concurrency
+        self.worker_pool: Optional[ThreadPoolExecutor] = None
+        # WebSocket路径上的阻塞调用（检索、向量库写入）使用独立的小线程池，不被长时间的消息处理任务占满
+        self.ws_io_pool: Optional[ThreadPoolExecutor] = None
+        # WebSocket非流式回复的语音在单个线程中按提交顺序合成播放
+        self.ws_audio_pool: Optional[ThreadPoolExecutor] = None
+        # user_id -> 该用户等待处理的消息；出现在字典中表示该用户已有消息在处理
+        self._user_pending: Dict[str, Deque[VTuberMessage]] = {}
+        self._scheduler_lock = threading.Lock()
+        # 排队统计
+        self._processed_count = 0
+        self._total_wait_time = 0.0
+        self._max_wait_time = 0.0
+        # WebSocket路径上每个用户的顺序锁（仅在事件循环线程中访问）
+        self._ws_user_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
         
         # WebSocket配置
         self.ws_port = ws_port
@@ -121,29 +115,19 @@ class VTuberSystem:
         
         # TTS配置
         self.tts_client = GPTSoVITSClient(api_url="http://127.0.0.1:9880")
-        self.audio_output_dir = "temp_audio"
-        os.makedirs(self.audio_output_dir, exist_ok=True)
-        # 情感对应的参考音频路径
-        self.emotion_audio_paths = {
-            "调皮": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【调皮】哇已经发展成三人关系了吗？芽衣你真是越来越大胆了呢。.wav",
-            "调侃": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【调侃的失望】啊真是的，头也不回的走掉了呢。.wav",
-            "尴尬": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【尴尬】呃，芽衣，你的问题还真是一如既往的，刁钻。.wav",
-            "感动": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【感动】能以这种方式见到你，我真的好幸运，你带给了我，一直渴望却又不敢奢求的礼物。.wav",
-            "积极": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【积极】执拗的花朵永远不会因暴雨而褪去颜色，你的决心也一定能在绝境中绽放真我。.wav",
-            "急了": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【急了】啊等等，难道说背叛者指的是芽衣的事，千万别这样想呀，我心里还是有你的。.wav",
-            "假装": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【假装】拜托了医生，对我来说这真的很重要。.wav",
-            "惊喜": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【惊喜】哇，那不是预约不知排到什么时候的超级餐厅嘛，突然带个人会不会给你添麻烦呀？.wav",
-            "开心": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【开心】哎呀，看到美少女突然来访，比起惊讶，要表现的更开心一些才行啊。.wav",
-            "撩拨": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【撩拨】哎呀，我还以为你会好好记住人家的名字的，有点难过。.wav",
-            "难过": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【难过】对你来说，对任何人来说，我们，意味着什么呢？.wav",
-            "疲惫": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【疲惫】我知道你在想什么，不过也稍微休息一下吧。.wav",
-            "普通": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【普通】爱莉希雅的贴心提示，你可以尽情依赖爱莉希雅，而她也会以全部的真心来回应你。.wav",
-            "撒娇": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【撒娇】我今天一定要知道这个，不然哪儿都不让你去，你就告诉我吧告诉我嘛，好不好？.wav",
-            "生气": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【生气】记错了，那不是他，为什么唯独对这件事印象这么深刻？.wav",
-            "严肃": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【严肃】不对，既然他已经给出了判断，你准备去做什么也没那么重要了。.wav",
-            "疑问": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【疑问】白纸，白纸，哪里能找到呢？.wav",
-            "自言": "E:\【GPT-SoVITS】爱莉希雅V2\参考音频\【自言】毕竟，我这一次又是来请他帮忙的，被他听到，恐怕要了不得了呢。.wav",
-        }
+        # 合成的音频在内存中直接交给播放服务；只有指定audio_archive_dir时才限额存档到磁盘
+        self.audio_archive: Optional[AudioArchive] = None
+        if audio_archive_dir:
+            self.audio_archive = AudioArchive(audio_archive_dir, max_bytes=audio_archive_max_bytes)
+        # 流式TTS：边合成边播放，首个音频块到达即开始发声
+        self.tts_streaming = tts_streaming
+        # 合成语音缓存：相同文本和参考音频的语音直接复用
+        self.speech_cache = SpeechCache(disk_dir=speech_cache_dir)
+        # 常驻播放服务：按提交顺序播放每条回复，支持跳过和打断；
+        # audio_sink可传入NullSink或WavFileSink以在无声卡环境下运行
+        self.playback = AudioPlaybackService(sink=audio_sink)
+        # 情感参考音频表：启动时一次性提取音频文字并读取、校验参考音频
+        self.emotion_registry = EmotionRegistry()
         
         self._initialize_system()
     
@@ -164,7 +148,9 @@ class VTuberSystem:
                 uri="http://localhost:19530",
                 token="root:Milvus",
                 dbname="vtuber",
-                embedding_model=DoubaoEmbeddings()
+                embedding_model=DoubaoEmbeddings(),
+                # 聊天记录异步攒批写入，不阻塞回复
+                write_batch_size=32
             )
             
         except Exception as e:
@@ -176,45 +162,124 @@ class VTuberSystem:
             return
         
         self.running = True
+        self.worker_pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="VTuberWorker")
+        self.ws_io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="VTuberWSIO")
+        self.ws_audio_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="VTuberWSAudio")
         self.processing_thread = threading.Thread(target=self._process_messages)
         self.processing_thread.daemon = True
         self.processing_thread.start()
         
+        # 后台预先合成兜底台词，不阻塞启动
+        warm_up_thread = threading.Thread(target=self.warm_up_speech_cache, name="SpeechWarmUp")
+        warm_up_thread.daemon = True
+        warm_up_thread.start()
+        
         # 启动WebSocket服务器
         self.start_websocket()
     
     def stop(self):
         self.running = False
+        if self.processing_thread is not None:
+            self.processing_thread.join(timeout=2)
+        if self.worker_pool is not None:
+            # 等待正在处理的消息完成，避免记忆和向量库写入被截断
+            self.worker_pool.shutdown(wait=True)
+        for pool in (self.ws_io_pool, self.ws_audio_pool):
+            if pool is not None:
+                pool.shutdown(wait=True)
         if hasattr(self.rag, 'close'):
             self.rag.close()
+        if self.agent is not None:
+            self.agent.close()
+        self.tts_client.close()
+        self.playback.close()
     
     def add_message(self, user_id: str, username: str, content: str):
+        # 用户消息在处理时与检索共用同一次嵌入写入 MilvusRAG
         message = VTuberMessage(user_id, username, content)
         self.message_queue.put(message)
-        
-        # 将用户消息添加到 MilvusRAG 中
-        try:
-            self.rag.add_user_message(user_id, username, content)
-        except Exception as e:
-            logger.error(f"添加用户消息到 MilvusRAG 时出错: {e}")
     
     def _process_messages(self):
+        """调度线程：从队列取出消息，按用户分派到工作线程池"""
         while self.running:
             try:
                 message = self.message_queue.get(timeout=1)
-                self._process_single_message(message)
+                self._dispatch_message(message)
                 self.message_queue.task_done()
             except Empty:
                 continue
             except Exception as e:
                 logger.error(f"处理消息队列时出错: {e}")
     
+    def _dispatch_message(self, message: VTuberMessage):
+        """
+        分派消息：该用户空闲时提交到线程池，否则排在该用户的待处理队列后面
+        
+        Args:
+            message (VTuberMessage): 待处理消息
+        """
+        with self._scheduler_lock:
+            pending = self._user_pending.get(message.user_id)
+            if pending is not None:
+                pending.append(message)
+                return
+            self._user_pending[message.user_id] = deque()
+        self.worker_pool.submit(self._run_user_messages, message)
+    
+    def _run_user_messages(self, message: VTuberMessage):
+        """
+        工作线程：处理一条消息后继续处理同一用户排队的消息，保证单个用户内的顺序
+        
+        Args:
+            message (VTuberMessage): 首条待处理消息
+        """
+        while message is not None:
+            wait_time = time.time() - message.timestamp
+            with self._scheduler_lock:
+                self._processed_count += 1
+                self._total_wait_time += wait_time
+                self._max_wait_time = max(self._max_wait_time, wait_time)
+            if wait_time > 5:
+                logger.warning(f"消息排队时间过长: {message.username} 等待{wait_time:.2f}秒")
+            
+            self._process_single_message(message)
+            
+            with self._scheduler_lock:
+                pending = self._user_pending[message.user_id]
+                if pending:
+                    message = pending.popleft()
+                else:
+                    del self._user_pending[message.user_id]
+                    message = None
+    
+    def get_queue_stats(self) -> Dict[str, Any]:
+        """
+        获取消息队列统计信息
+        
+        Returns:
+            Dict[str, Any]: 队列深度、处理中用户数和排队等待时间
+        """
+        with self._scheduler_lock:
+            pending_messages = sum(len(pending) for pending in self._user_pending.values())
+            return {
+                'queue_depth': self.message_queue.qsize() + pending_messages,
+                'active_users': len(self._user_pending),
+                'max_concurrency': self.max_concurrency,
+                'processed': self._processed_count,
+                'avg_wait_time': self._total_wait_time / self._processed_count if self._processed_count else 0.0,
+                'max_wait_time': self._max_wait_time
+            }
+    
     def _process_single_message(self, message: VTuberMessage):
         try:
-            relevant_info = self._retrieve_relevant_info(message.content)
+            relevant_info = self._retrieve_and_store_message(message)
             formatted_prompt = self._format_prompt(message, relevant_info)
             conversation_id = self._get_conversation_id(message.user_id)
-            response = self._generate_response(formatted_prompt, conversation_id)
+            if self.tts_streaming:
+                # 分句流水线：LLM每产出一句就开始合成播放
+                response = self._generate_and_speak(formatted_prompt, conversation_id)
+            else:
+                response = self._generate_response(formatted_prompt, conversation_id)
             self._record_conversation(message, response, conversation_id)
             
             # 将AI回复添加到 MilvusRAG 中
@@ -227,7 +292,8 @@ class VTuberSystem:
             logger.info(f"星野梦咲: {response}")
             print(response)
             # 生成并播放音频
-            self._generate_and_play_audio(response)
+            if not self.tts_streaming:
+                self._generate_and_play_audio(response)
             
         except Exception as e:
             logger.error(f"处理留言时出错: {e}")
@@ -243,24 +309,152 @@ class VTuberSystem:
             logger.error(f"检索相关信息时出错: {e}")
             return ""
     
+    def _retrieve_and_store_message(self, message: VTuberMessage) -> str:
+        """
+        检索相关信息并将用户消息写入 MilvusRAG，两步只嵌入一次
+        
+        Args:
+            message (VTuberMessage): 用户消息
+            
+        Returns:
+            str: 相关信息文本
+        """
+        try:
+            results, _ = self.rag.search_and_add_user_message(
+                message.user_id, message.username, message.content, top_k=3
+            )
+            if results:
+                return "\n".join([result["content"] for result in results])
+            return ""
+        except Exception as e:
+            logger.error(f"检索相关信息或添加用户消息到 MilvusRAG 时出错: {e}")
+            return ""
+    
     def _format_prompt(self, message: VTuberMessage, relevant_info: str) -> str:
         context = f"\n\n【相关信息参考】\n{relevant_info}\n" if relevant_info else ""
         return f"{self.vtuber_character_prompt}{context}\n\n{message.username}：{message.content}\n\n星野梦咲："
     
     def _get_conversation_id(self, user_id: str) -> str:
-        if user_id not in self.conversation_memory:
-            self.conversation_memory[user_id] = str(uuid.uuid4())
-        return self.conversation_memory[user_id]
+        with self._conversation_lock:
+            if user_id not in self.conversation_memory:
+                self.conversation_memory[user_id] = str(uuid.uuid4())
+            return self.conversation_memory[user_id]
     
     def _generate_response(self, prompt: str, conversation_id: str) -> str:
         try:
             result = self.agent.generate_response(prompt, conversation_id=conversation_id)
             if result:
                 return result['response']
-            return "抱歉，我现在有点忙，稍后再和你聊吧~"
+            return BUSY_REPLY
+        except Exception as e:
+            logger.error(f"生成回复时出错: {e}")
+            return ERROR_REPLY
+    
+    def _create_speech_pipeline(self) -> SpeechPipeline:
+        """创建一条回复的分句语音流水线，并作为一个任务排入播放队列"""
+        pipeline = SpeechPipeline(synthesize_fn=self._synthesize_sentence)
+        self.playback.submit(pipeline.segments(), label="流式回复", on_segment=self._on_segment_start,
+                             on_cancel=pipeline.cancel)
+        return pipeline
+    
+    def _generate_and_speak(self, prompt: str, conversation_id: str) -> str:
+        """
+        流式生成回复，并把凑齐的句子依次送入语音流水线
+        
+        Args:
+            prompt (str): 提示词
+            conversation_id (str): 对话ID
+            
+        Returns:
+            str: 完整回复（包含情感标记）
+        """
+        pipeline = self._create_speech_pipeline()
+        response = None
+        finished = False
+        fallback = BUSY_REPLY
+        try:
+            for chunk in self.agent.stream_response(prompt, conversation_id=conversation_id):
+                if chunk.get('error'):
+                    logger.error(f"流式生成回复失败: {chunk['error']}")
+                    break
+                if chunk.get('stream_end'):
+                    # LLM输出已结束，立即提交最后一句合成，不等记忆写入完成
+                    pipeline.finish()
+                    finished = True
+                    continue
+                if chunk['done']:
+                    response = chunk['response']
+                    break
+                pipeline.feed(chunk['delta'])
         except Exception as e:
             logger.error(f"生成回复时出错: {e}")
-            return "哎呀，刚才发生了一点小问题，我们换个话题聊聊吧~"
+            fallback = ERROR_REPLY
+        return self._finish_speaking(pipeline, response, finished, fallback)
+    
+    def _finish_speaking(self, pipeline: SpeechPipeline, response: Optional[str], finished: bool,
+                         fallback: str) -> str:
+        """
+        结束一条回复的语音流水线，并确定要记录的回复
+        
+        LLM没有返回完整回复时，已生成的文本照常播完并作为回复记录，
+        与实际播报的内容一致；一句都没有生成时改为播报并记录兜底回复。
+        
+        Args:
+            pipeline (SpeechPipeline): 本条回复的流水线
+            response (str, optional): LLM返回的完整回复，失败时为None
+            finished (bool): 流水线是否已经结束
+            fallback (str): 一句都没有生成时使用的兜底回复
+            
+        Returns:
+            str: 要记录的回复（包含情感标记）
+        """
+        if response is None:
+            if not finished:
+                pipeline.flush()
+            if pipeline.sentence_count > 0:
+                response = f"【{pipeline.emotion}】{pipeline.spoken_text()}"
+                logger.warning(f"回复生成中断，记录已播报的部分: {response}")
+            else:
+                response = fallback
+                if not finished:
+                    pipeline.feed(fallback)
+        if not finished:
+            pipeline.finish()
+        return response
+    
+    async def _agenerate_and_speak(self, prompt: str, conversation_id: str) -> str:
+        """
+        _generate_and_speak的协程版本，使用Agent的astream_response
+        
+        Args:
+            prompt (str): 提示词
+            conversation_id (str): 对话ID
+            
+        Returns:
+            str: 完整回复（包含情感标记）
+        """
+        pipeline = self._create_speech_pipeline()
+        response = None
+        finished = False
+        fallback = BUSY_REPLY
+        try:
+            async for chunk in self.agent.astream_response(prompt, conversation_id=conversation_id):
+                if chunk.get('error'):
+                    logger.error(f"流式生成回复失败: {chunk['error']}")
+                    break
+                if chunk.get('stream_end'):
+                    # LLM输出已结束，立即提交最后一句合成，不等记忆写入完成
+                    pipeline.finish()
+                    finished = True
+                    continue
+                if chunk['done']:
+                    response = chunk['response']
+                    break
+                pipeline.feed(chunk['delta'])
+        except Exception as e:
+            logger.error(f"生成回复时出错: {e}")
+            fallback = ERROR_REPLY
+        return self._finish_speaking(pipeline, response, finished, fallback)
     
     def _record_conversation(self, message: VTuberMessage, response: str, conversation_id: str):
         logger.info(f"记录对话: {conversation_id} - {message.username} -> VTuber")
@@ -284,94 +478,259 @@ class VTuberSystem:
                 content = response.strip()
             
             # 获取对应的参考音频
-            ref_audio_path = self.emotion_audio_paths.get(emotion, self.emotion_audio_paths["普通"])
+            reference = self.emotion_registry.get(emotion)
             print(content)
-            print(ref_audio_path)
-            # 生成唯一的输出文件名
-            output_filename = f"response_{int(time.time())}_{uuid.uuid4().hex[:8]}.wav"
-            output_path = os.path.join(self.audio_output_dir, output_filename)
-            print([
-                content,
-                "zh",
-                ref_audio_path,
-                output_path,
-                "zh",
-                "",
-            ])
-            # 生成音频
-            success = self.tts_client.generate_audio(
-                text=content,
-                text_lang="zh",
-                ref_audio_path=ref_audio_path,
-                output_path=output_path,
-                prompt_lang="zh",
-                prompt_text=""
-            )
+            print(reference.path)
+            if self.tts_streaming:
+                if not self._stream_and_play_audio(content, reference):
+                    logger.error("流式生成音频失败")
+                return
+            # 命中缓存直接播放，否则生成音频（WAV数据留在内存中）
+            cache_key = self._speech_cache_key(content, reference)
+            audio_data = self.speech_cache.get(cache_key)
+            if audio_data is None:
+                audio_data = self.tts_client.synthesize(
+                    text=content,
+                    text_lang="zh",
+                    ref_audio_path=reference.path,
+                    prompt_lang=reference.prompt_lang,
+                    prompt_text=reference.prompt_text
+                )
+                if audio_data:
+                    self.speech_cache.put(cache_key, audio_data)
             
-            if success:
-                # 在新进程中播放音频
-                self._play_audio_in_process(output_path)
+            if audio_data:
+                # 交给常驻播放服务按顺序播放
+                segment = wav_bytes_segment(audio_data, text=content)
+                self.playback.submit([segment], label=content, on_segment=self._on_segment_start)
+                if self.audio_archive is not None:
+                    self.audio_archive.save(audio_data)
             else:
                 logger.error("生成音频失败")
                 
         except Exception as e:
             logger.error(f"处理音频时出错: {e}")
     
-    def _play_audio_in_process(self, audio_path: str):
+    def _speech_cache_key(self, content: str, reference: EmotionReference) -> str:
+        """合成参数与_synthesize_speech一致的缓存键"""
+        return self.speech_cache.make_key(
+            content, "zh", reference.path, reference.prompt_lang, prompt_text=reference.prompt_text
+        )
+    
+    def _synthesize_speech(self, content: str, reference: EmotionReference):
+        """
+        流式合成一段文本，命中缓存时直接返回缓存的音频
+        
+        Args:
+            content (str): 要合成的文本
+            reference (EmotionReference): 参考音频
+            
+        Returns:
+            Optional[Tuple[AudioFormat, Iterable[bytes]]]: 音频格式和PCM分块，失败返回None
+        """
+        cache_key = self._speech_cache_key(content, reference)
+        cached = self.speech_cache.get(cache_key)
+        if cached is not None:
+            segment = wav_bytes_segment(cached, text=content)
+            return segment.audio_format, segment.chunks
+        result = self.tts_client.stream_audio(
+            text=content,
+            text_lang="zh",
+            ref_audio_path=reference.path,
+            prompt_lang=reference.prompt_lang,
+            prompt_text=reference.prompt_text
+        )
+        if result is None:
+            return None
+        audio_format, chunks = result
+        # 完整播放完的音频写入缓存
+        return audio_format, self.speech_cache.tee(cache_key, audio_format, chunks)
+    
+    def _synthesize_sentence(self, content: str, emotion: str):
         """
-        在新进程中播放音频
+        按情感选择参考音频，合成一句（供分句流水线调用）
         
         Args:
-            audio_path (str): 音频文件路径
+            content (str): 要合成的句子
+            emotion (str): 情感
+            
+        Returns:
+            Optional[Tuple[AudioFormat, Iterable[bytes]]]: 音频格式和PCM分块，失败返回None
         """
-
-        # 创建并启动新进程
-        audio_process = multiprocessing.Process(target=play_audio_external, args=(audio_path,))
-        audio_process.daemon = True
-        audio_process.start()
+        return self._synthesize_speech(content, self.emotion_registry.get(emotion))
+    
+    def warm_up_speech_cache(self, lines: Optional[List[str]] = None) -> int:
+        """
+        预先合成固定台词（默认是兜底回复）写入语音缓存
+        
+        Args:
+            lines (List[str], optional): 台词列表，使用默认情感的参考音频
+            
+        Returns:
+            int: 新合成的条数
+        """
+        reference = self.emotion_registry.get(self.emotion_registry.default_emotion)
+        try:
+            return warm_up_speech_cache(
+                self.speech_cache, self.tts_client,
+                [(line, reference.path) for line in (lines or CANNED_LINES)],
+                prompt_lang=reference.prompt_lang,
+                prompt_text=reference.prompt_text
+            )
+        except Exception as e:
+            logger.error(f"预热语音缓存时出错: {e}")
+            return 0
+    
+    def _on_segment_start(self, segment: AudioSegment):
+        """
+        一段音频开始播放时驱动Live2D动作
+        
+        Args:
+            segment (AudioSegment): 即将播放的音频段
+        """
+        duration = segment.duration
+        if duration is None:
+            # 流式合成时无法预知时长，按语速估算
+            duration = len(segment.text) / SPEECH_CHARS_PER_SECOND
+        send_request("回答问题", duration=duration)
+    
+    def _stream_and_play_audio(self, content: str, reference: EmotionReference) -> bool:
+        """
+        流式合成并播放：TTS服务端每产出一块PCM就交给播放服务
+        
+        Args:
+            content (str): 要合成的文本
+            reference (EmotionReference): 参考音频
+            
+        Returns:
+            bool: 是否成功开始播放
+        """
+        result = self._synthesize_speech(content, reference)
+        if result is None:
+            return False
+        audio_format, chunks = result
+        self.playback.play(audio_format, chunks, text=content, on_segment=self._on_segment_start)
+        return True
+    
+    def skip_current_audio(self) -> bool:
+        """
+        跳过正在播放的回复
+        
+        Returns:
+            bool: 是否有回复被跳过
+        """
+        return self.playback.skip()
+    
+    def interrupt_audio(self) -> int:
+        """
+        停止正在播放的回复并清空播放队列
+        
+        Returns:
+            int: 被取消的回复数
+        """
+        return self.playback.interrupt()
     
     # WebSocket核心功能
     async def _websocket_handler(self, websocket):
+        # 每帧消息作为独立任务处理，连接可以继续接收后续帧和心跳
+        tasks = set()
         try:
             async for message in websocket:
-                data = json.loads(message)
-                user_id = data.get("user").get('uid', 'anonymous')
-                username = data.get("user").get('uname', '匿名用户')
-                content = data.get('content', '')
-                
-                if not content:
-                    await websocket.send(json.dumps({'status': 'error', 'message': '内容不能为空'}))
+                try:
+                    data = json.loads(message)
+                except json.JSONDecodeError:
+                    await websocket.send(json.dumps({'status': 'error', 'message': '无效的JSON格式'}))
                     continue
-                
+                task = asyncio.create_task(self._handle_ws_frame(websocket, data))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except Exception as e:
+            logger.error(f"WebSocket错误: {e}")
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def _handle_ws_frame(self, websocket, data: Dict[str, Any]):
+        """
+        处理单帧WebSocket消息，同一用户的消息按到达顺序串行处理
+        
+        Args:
+            websocket: WebSocket连接
+            data (Dict[str, Any]): 解析后的消息数据
+        """
+        try:
+            user = data.get("user") or {}
+            user_id = user.get('uid', 'anonymous')
+            username = user.get('uname', '匿名用户')
+            content = data.get('content', '')
+            
+            if not content:
+                await websocket.send(json.dumps({'status': 'error', 'message': '内容不能为空'}))
+                return
+            
+            lock = self._ws_user_locks.get(user_id)
+            if lock is None:
+                lock = asyncio.Lock()
+                self._ws_user_locks[user_id] = lock
+            async with lock:
                 # 处理消息并生成回复
                 response = await self._process_ws_message(user_id, username, content)
-                
-                # 返回JSON格式的回复
-                await websocket.send(json.dumps({'status': 'success', 'response': response}))
-                
-        except json.JSONDecodeError:
-            await websocket.send(json.dumps({'status': 'error', 'message': '无效的JSON格式'}))
+            
+            # 返回JSON格式的回复
+            await websocket.send(json.dumps({'status': 'success', 'response': response}))
         except Exception as e:
             logger.error(f"WebSocket错误: {e}")
     
+    async def _run_blocking(self, func, *args):
+        """
+        将同步调用放到WebSocket专用的I/O线程池执行，避免阻塞事件循环
+        
+        Args:
+            func: 同步函数
+            *args: 函数参数
+            
+        Returns:
+            函数返回值
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.ws_io_pool, func, *args)
+    
+    async def _agenerate_response(self, prompt: str, conversation_id: str) -> str:
+        try:
+            result = await self.agent.agenerate_response(prompt, conversation_id=conversation_id)
+            if result:
+                return result['response']
+            return BUSY_REPLY
+        except Exception as e:
+            logger.error(f"生成回复时出错: {e}")
+            return ERROR_REPLY
+    
+    def _store_ws_response(self, user_id: str, username: str, response: str):
+        """将WS回复写入 MilvusRAG（在WebSocket I/O线程中执行）"""
+        try:
+            self.rag.add_llm_response(user_id, username, response)
+        except Exception as e:
+            logger.error(f"添加AI回复到 MilvusRAG 时出错: {e}")
+    
     async def _process_ws_message(self, user_id: str, username: str, content: str) -> str:
         try:
-            relevant_info = self._retrieve_relevant_info(content)
+            # 检索（同时写入用户消息）在工作线程中执行，LLM调用使用原生异步接口
             message = VTuberMessage(user_id, username, content)
+            relevant_info = await self._run_blocking(self._retrieve_and_store_message, message)
             formatted_prompt = self._format_prompt(message, relevant_info)
             conversation_id = self._get_conversation_id(user_id)
-            response = self._generate_response(formatted_prompt, conversation_id)
+            if self.tts_streaming:
+                # 分句流水线：LLM每产出一句就开始合成播放
+                response = await self._agenerate_and_speak(formatted_prompt, conversation_id)
+            else:
+                response = await self._agenerate_response(formatted_prompt, conversation_id)
             self._record_conversation(message, response, conversation_id)
             
-            # 将消息添加到 MilvusRAG 中
-            try:
-                self.rag.add_user_message(user_id, username, content)
-                self.rag.add_llm_response(user_id, username, response)
-            except Exception as e:
-                logger.error(f"添加消息到 MilvusRAG 时出错: {e}")
-            
-            # 生成并播放音频
-            self._generate_and_play_audio(response)
+            # 向量库写入和语音合成播放在后台执行，不延迟回复；
+            # 语音交给单线程执行器，播放顺序与回复完成的顺序一致
+            self.ws_io_pool.submit(self._store_ws_response, user_id, username, response)
+            if not self.tts_streaming:
+                self.ws_audio_pool.submit(self._generate_and_play_audio, response)
             
             return response
         except Exception as e:
@@ -0,0 +1,85 @@
+import os
+import sys
+
+# 模块导入时会创建默认的嵌入模型，测试中不会真正请求API
+os.environ.setdefault("Doubao_API_KEY", "test")
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from vtuber_chat_base import BUSY_REPLY, ERROR_REPLY, VTuberSystem
+
+
+class FakeAgent:
+    """按给定的增量文本流式输出，之后按fail抛出异常或返回错误块"""
+
+    def __init__(self, deltas, fail=None):
+        self.deltas = deltas
+        self.fail = fail
+
+    def stream_response(self, prompt, conversation_id=None):
+        for delta in self.deltas:
+            yield {'delta': delta, 'conversation_id': conversation_id, 'done': False}
+        if self.fail == 'raise':
+            raise ConnectionError("LLM断开")
+        if self.fail == 'error':
+            yield {'error': "LLM断开", 'conversation_id': conversation_id, 'done': True}
+            return
+        yield {'delta': '', 'conversation_id': conversation_id, 'done': False, 'stream_end': True}
+        yield {'delta': '', 'response': "".join(self.deltas), 'conversation_id': conversation_id, 'done': True}
+
+
+class FakePlayback:
+    """记录提交的流水线，不实际播放"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, segments, label=None, on_segment=None, on_cancel=None):
+        self.jobs.append(segments)
+
+
+def make_system(agent):
+    """不初始化LLM、Milvus和TTS，只设置分句播报用到的属性"""
+    system = VTuberSystem.__new__(VTuberSystem)
+    system.agent = agent
+    system.playback = FakePlayback()
+    spoken = []
+    system._synthesize_sentence = lambda sentence, emotion: spoken.append(sentence)
+    return system, spoken
+
+
+def speak(agent):
+    system, spoken = make_system(agent)
+    response = system._generate_and_speak("prompt", "conv")
+    # 等待流水线合成完提交的句子
+    for segment in system.playback.jobs[0]:
+        pass
+    return response, spoken
+
+
+def test_complete_reply_is_recorded():
+    response, spoken = speak(FakeAgent(["【开心】你好呀，", "今天天气不错。", "一起出去玩吧！"]))
+    assert response == "【开心】你好呀，今天天气不错。一起出去玩吧！"
+    assert spoken == ["你好呀，今天天气不错。", "一起出去玩吧！"]
+
+
+def test_failure_after_speaking_records_spoken_part():
+    response, spoken = speak(FakeAgent(["【开心】你好呀，今天天气不错。", "一起出"], fail='raise'))
+    # 已经生成的文本照常播完，记录的回复与播报内容一致，不混入兜底台词
+    assert spoken == ["你好呀，今天天气不错。", "一起出"]
+    assert response == "【开心】你好呀，今天天气不错。一起出"
+
+
+def test_error_chunk_after_speaking_records_spoken_part():
+    response, spoken = speak(FakeAgent(["今天天气不错。", "真好"], fail='error'))
+    assert spoken == ["今天天气不错。", "真好"]
+    assert response == "【普通】今天天气不错。真好"
+
+
+def test_failure_before_any_text_speaks_fallback():
+    response, spoken = speak(FakeAgent([], fail='raise'))
+    assert response == ERROR_REPLY
+    assert spoken == [ERROR_REPLY]
+
+    response, spoken = speak(FakeAgent([], fail='error'))
+    assert response == BUSY_REPLY
+    assert spoken == [BUSY_REPLY]